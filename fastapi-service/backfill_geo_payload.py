@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Backfill del campo geo normalizado en la colección de propiedades de Qdrant.
+
+Recorre todos los puntos, normaliza sus coordenadas (lat/latitude/latitud, lng/longitude/
+longitud/lon o el string PostGIS de `location`) y escribe un campo {"lat": ..., "lon": ...}
+con un índice GEO, para que /search pueda filtrar con geo_bounding_box dentro de Qdrant.
+
+Es idempotente. Con GEO_PAYLOAD_SYNC (default) el servicio ya escribe el campo para los puntos
+nuevos o modificados que ve el snapshot; este script queda para la carga inicial, para crear el
+índice y para colecciones con el sync desactivado.
+
+Uso:
+    python backfill_geo_payload.py [--dry-run] [--force] [--batch-size 256]
+"""
+
+import argparse
+import os
+
+from dotenv import load_dotenv
+from qdrant_client import QdrantClient, models
+
+from main import _geo_payload_value
+
+
+def ensure_geo_index(client: QdrantClient, collection_name: str, geo_field: str):
+    """Crea el índice GEO sobre el campo si todavía no existe."""
+    info = client.get_collection(collection_name=collection_name)
+    schema = info.payload_schema or {}
+    if geo_field in schema:
+        print(f"✅ El índice '{geo_field}' ya existe ({schema[geo_field].data_type})")
+        return
+    client.create_payload_index(
+        collection_name=collection_name,
+        field_name=geo_field,
+        field_schema=models.PayloadSchemaType.GEO,
+        wait=True,
+    )
+    print(f"✅ Índice GEO creado sobre '{geo_field}'")
+
+
+def backfill(client: QdrantClient, collection_name: str, geo_field: str, batch_size: int, dry_run: bool, force: bool):
+    offset = None
+    scanned = updated = already_ok = without_coords = 0
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False,
+        )
+        operations = []
+        for record in records:
+            scanned += 1
+            payload = record.payload or {}
+            # Recalcular siempre desde los campos de origen
+            geo = _geo_payload_value(payload)
+            if geo is None:
+                without_coords += 1
+                continue
+            if payload.get(geo_field) == geo and not force:
+                already_ok += 1
+                continue
+            operations.append(models.SetPayloadOperation(
+                set_payload=models.SetPayload(payload={geo_field: geo}, points=[record.id])
+            ))
+
+        if operations and not dry_run:
+            client.batch_update_points(collection_name=collection_name, update_operations=operations, wait=True)
+        updated += len(operations)
+        print(f"   ... {scanned} puntos revisados, {updated} {'a actualizar' if dry_run else 'actualizados'}")
+
+        if offset is None:
+            break
+
+    print(f"✅ Backfill terminado: {scanned} puntos, {updated} {'a actualizar' if dry_run else 'actualizados'}, "
+          f"{already_ok} ya correctos, {without_coords} sin coordenadas")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Backfill del campo geo en Qdrant")
+    parser.add_argument("--dry-run", action="store_true", help="Solo mostrar lo que se actualizaría")
+    parser.add_argument("--force", action="store_true", help="Reescribir el campo aunque ya esté correcto")
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    load_dotenv()
+    collection_name = os.getenv("COLLECTION_NAME", "propertiesV3")
+    geo_field = os.getenv("GEO_PAYLOAD_FIELD", "geo")
+
+    client = QdrantClient(
+        url=os.getenv("QDRANT_HOST") or os.getenv("QDRANT_URL"),
+        api_key=(os.getenv("QDRANT_API_KEY", "").strip() or None),
+    )
+    print(f"🔧 Colección: {collection_name}, campo geo: {geo_field}{' (dry run)' if args.dry_run else ''}")
+    if not args.dry_run:
+        ensure_geo_index(client, collection_name, geo_field)
+    backfill(client, collection_name, geo_field, args.batch_size, args.dry_run, args.force)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los backends de embeddings de /search (OpenAI vs. encoder ONNX local).
+
+Mide la latencia de una consulta suelta (lo que paga cada /search sin cache) y el throughput
+en lotes (lo que paga /search/batch), usando los mismos providers que el servicio.
+
+Uso:
+    python benchmark_embeddings.py [--backends openai,onnx] [--repeat 20] [--batch-sizes 1,8,32]
+                                   [--queries consultas.txt]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+
+import main as service
+
+DEFAULT_QUERIES = [
+    "departamento 2 ambientes en La Perla",
+    "casa con pileta y jardín en Los Troncos",
+    "monoambiente cerca del mar",
+    "3 dormitorios 2 baños con cochera",
+    "ph con patio en Chauvín",
+    "departamento a estrenar con balcón en Güemes",
+    "casa quinta en Sierra de los Padres",
+    "local comercial en el centro",
+]
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def bench_single(provider, queries: list, repeat: int) -> dict:
+    """Latencia de una consulta por llamada (sin cache de embeddings)."""
+    samples = []
+    for i in range(repeat):
+        query = f"{queries[i % len(queries)]} {i}"
+        started = time.perf_counter()
+        provider.embed([query])
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        "p50_ms": statistics.median(samples),
+        "p95_ms": percentile(samples, 95),
+        "mean_ms": statistics.fmean(samples),
+    }
+
+
+async def _time_batches(provider, texts: list, repeat: int) -> list:
+    # Un solo event loop para todas las repeticiones: crear uno por lote sumaría su costo a cada muestra
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await provider.embed_async(texts)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def bench_batch(provider, queries: list, batch_size: int, repeat: int) -> dict:
+    """Throughput con embed_async: lotes repartidos en el pool de threads del backend."""
+    texts = [f"{queries[i % len(queries)]} #{i}" for i in range(batch_size)]
+    samples = asyncio.run(_time_batches(provider, texts, repeat))
+    median = statistics.median(samples)
+    return {"p50_ms": median, "per_query_ms": median / batch_size, "queries_per_s": batch_size / (median / 1000)}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark de backends de embeddings")
+    parser.add_argument("--backends", default="openai,onnx", help="Backends separados por coma")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--queries", help="Archivo con una consulta por línea")
+    args = parser.parse_args()
+
+    load_dotenv()
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    service.settings = {
+        "embedding_model": os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"),
+        "embedding_batch_size": int(os.getenv("EMBEDDING_BATCH_SIZE", "64")),
+        "embedding_threads": int(os.getenv("EMBEDDING_THREADS", "4")),
+        "onnx_model_dir": os.getenv("ONNX_MODEL_DIR", "").strip(),
+        "onnx_max_length": int(os.getenv("ONNX_MAX_LENGTH", "128")),
+        "embedding_query_prefix": os.getenv("EMBEDDING_QUERY_PREFIX", ""),
+    }
+    api_key = os.getenv("OPENAI_API_KEY", "").strip()
+    if api_key:
+        service.openai_cli = OpenAI(api_key=api_key)
+        service.async_openai_cli = AsyncOpenAI(api_key=api_key)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",") if size.strip()]
+
+    print(f"{'backend':<8} {'modo':<10} {'p50 ms':>9} {'p95 ms':>9} {'ms/query':>9} {'query/s':>9}")
+    for backend in [name.strip() for name in args.backends.split(",") if name.strip()]:
+        if backend == "openai" and not api_key:
+            print("⚠️ OPENAI_API_KEY no configurada, salteando openai")
+            continue
+        try:
+            provider = service._create_embedding_provider(backend)
+            provider.warmup()
+            provider.embed([queries[0]])
+        except Exception as e:
+            print(f"❌ No se pudo inicializar '{backend}': {e}")
+            continue
+
+        try:
+            single = bench_single(provider, queries, args.repeat)
+            print(f"{backend:<8} {'single':<10} {single['p50_ms']:>9.1f} {single['p95_ms']:>9.1f} "
+                  f"{single['mean_ms']:>9.1f} {1000 / single['mean_ms']:>9.1f}")
+            for batch_size in batch_sizes:
+                batch = bench_batch(provider, queries, batch_size, max(args.repeat // 4, 3))
+                print(f"{backend:<8} {f'batch={batch_size}':<10} {batch['p50_ms']:>9.1f} {'':>9} "
+                      f"{batch['per_query_ms']:>9.2f} {batch['queries_per_s']:>9.1f}")
+        except Exception as e:
+            print(f"❌ Falló el benchmark de '{backend}': {e}")
+            continue
+        print(f"   dimensión: {provider.dimension}, modelo: {provider.model}")
+
+
+if __name__ == "__main__":
+    main_cli()
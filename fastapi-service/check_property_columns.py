@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Chequeo diferencial de PropertyColumns contra la implementación fila a fila original.
+
+/search evalúa los filtros estructurados y el puntaje heurístico con PropertyColumns.passes y
+PropertyColumns.scores (NumPy sobre todo el snapshot o sobre un subconjunto de filas). Este
+script conserva la versión original por payload como oráculo, carga la colección completa y
+compara ambas para un conjunto de consultas, con y sin bbox de barrio, filtros y `rows`.
+
+Uso:
+    python check_property_columns.py [--queries consultas.txt] [--samples 5] [--seed 0]
+"""
+
+import argparse
+import os
+import random
+import sys
+
+import numpy as np
+from dotenv import load_dotenv
+from qdrant_client import QdrantClient
+
+import main as service
+
+DEFAULT_QUERIES = [
+    "monoambiente cerca del mar",
+    "departamento 1 ambiente",
+    "departamento 2 ambientes en La Perla",
+    "3 ambientes con balcón en Güemes",
+    "1 dormitorio",
+    "3 dormitorios 2 baños con cochera",
+    "casa con pileta y jardín en Los Troncos",
+    "ph con patio en Chauvín",
+    "local comercial en el centro",
+    "casa quinta en Sierra de los Padres",
+]
+
+
+def reference_score(payload: dict, features: dict) -> int:
+    """Puntaje heurístico de una propiedad, calculado fila a fila."""
+    score = 0
+    profile = service.PropertySearchText(payload)
+
+    for token in features["tokens"]:
+        if token and profile.matches(service._fold_term(token)):
+            score += 2
+    for phrase in features["phrases"]:
+        if phrase and profile.matches(service._fold_term(phrase)):
+            score += 4
+    for neighborhood in features["neighborhoods"]:
+        if neighborhood and profile.matches(service._fold_term(neighborhood)):
+            score += 5
+    for ptype in features["property_types"]:
+        if service._fold_text(ptype) in profile.property_type:
+            score += 6
+    for term in features["must_have_terms"]:
+        if term and profile.matches(service._fold_term(term)):
+            score += 5
+
+    if features["bedrooms"] is not None:
+        bedrooms_field = service._extract_numeric(
+            payload.get("bedrooms") or payload.get("ambientes") or payload.get("rooms")
+        )
+        if bedrooms_field is not None:
+            if bedrooms_field == features["bedrooms"]:
+                score += 6
+            elif bedrooms_field > features["bedrooms"]:
+                score += 3
+            else:
+                score -= 4
+
+    if features["bathrooms"] is not None:
+        bathrooms_field = service._extract_numeric(payload.get("bathrooms"))
+        if bathrooms_field is not None:
+            if bathrooms_field == features["bathrooms"]:
+                score += 3
+            elif bathrooms_field > features["bathrooms"]:
+                score += 1
+            else:
+                score -= 2
+
+    return score
+
+
+def _matches_rooms(payload: dict, features: dict) -> bool:
+    # Sistema argentino ("ambientes") vs internacional ("bedrooms")
+    search_mode = features.get("search_mode")
+    desired_ambientes = features.get("ambientes")
+    desired_bedrooms = features.get("bedrooms")
+
+    if search_mode == "ambientes" and desired_ambientes is not None:
+        # ambientes == N o bedrooms == N-1; monoambiente acepta ambientes=1, bedrooms=1 o bedrooms=0
+        ambientes_field = service._extract_numeric(payload.get("ambientes"))
+        bedrooms_field = service._extract_numeric(payload.get("bedrooms") or payload.get("rooms"))
+        if ambientes_field is None and bedrooms_field is None:
+            return False
+        if desired_ambientes == 1:
+            if ambientes_field is not None and ambientes_field >= 2:
+                return False
+            return ambientes_field == 1 or bedrooms_field in (0, 1)
+        return ambientes_field == desired_ambientes or (
+            bedrooms_field is not None and bedrooms_field == desired_ambientes - 1
+        )
+
+    if desired_bedrooms is not None:
+        # Modo "bedrooms" o sin search_mode: 1 dormitorio exacto, 2+ como mínimo
+        bedrooms_field = service._extract_numeric(payload.get("bedrooms") or payload.get("rooms"))
+        if bedrooms_field is None:
+            return False
+        if desired_bedrooms == 1:
+            return bedrooms_field == 1
+        return bedrooms_field >= desired_bedrooms
+    return True
+
+
+def reference_passes(payload: dict, features: dict, filters: dict, neighborhood_bbox: dict = None) -> bool:
+    """Filtros estructurados de una propiedad, evaluados fila a fila."""
+    if not _matches_rooms(payload, features):
+        return False
+
+    desired_bathrooms = features.get("bathrooms")
+    if desired_bathrooms is not None:
+        bathrooms_field = service._extract_numeric(payload.get("bathrooms"))
+        if bathrooms_field is None or bathrooms_field < desired_bathrooms:
+            return False
+
+    profile = service.PropertySearchText(payload)
+    if features.get("property_types"):
+        if not any(service._fold_text(ptype) in profile.property_type for ptype in features["property_types"]):
+            return False
+
+    neighborhoods = features.get("neighborhoods", [])
+    text_match = any(profile.matches_location(service._fold_term(neigh)) for neigh in neighborhoods)
+    if neighborhood_bbox and neighborhood_bbox.get("bbox"):
+        bbox = neighborhood_bbox["bbox"]
+        lat, lng = service._extract_property_coords(payload)
+        if lat is None or lng is None:
+            # Sin coordenadas: fallback por texto
+            if not text_match:
+                return False
+        else:
+            try:
+                if not (bbox["min_lat"] <= float(lat) <= bbox["max_lat"] and
+                        bbox["min_lon"] <= float(lng) <= bbox["max_lon"]):
+                    return False
+            except (ValueError, TypeError):
+                if not text_match:
+                    return False
+    elif neighborhoods and not text_match:
+        return False
+
+    for key, expected in (filters or {}).items():
+        value = payload.get(key)
+        if value is None:
+            return False
+        if isinstance(expected, (list, tuple, set)):
+            if str(value).lower() not in [str(opt).lower() for opt in expected]:
+                return False
+        elif str(value).lower() != str(expected).lower():
+            return False
+
+    return True
+
+
+def build_cases(payloads: list, queries: list) -> list:
+    """(descripción, features, filters, neighborhood_bbox) para cada consulta y variante."""
+    coords = [service._extract_property_coords(payload) for payload in payloads]
+    coords = [(lat, lng) for lat, lng in coords if lat is not None and lng is not None]
+    bboxes = [None]
+    if coords:
+        lat, lng = float(np.median([c[0] for c in coords])), float(np.median([c[1] for c in coords]))
+        bboxes.append({"name": "mediana", "bbox": {
+            "min_lat": lat - 0.02, "max_lat": lat + 0.02, "min_lon": lng - 0.02, "max_lon": lng + 0.02,
+        }})
+
+    filter_sets = [{}]
+    property_type = next((p.get("property_type") for p in payloads if isinstance(p.get("property_type"), str)), None)
+    if property_type:
+        filter_sets += [{"property_type": property_type.upper()}, {"property_type": [property_type, "otro"]}]
+
+    cases = []
+    for query in queries:
+        features = service._parse_query_features(query)
+        for bbox in bboxes:
+            for filters in filter_sets:
+                label = f"{query!r} bbox={'sí' if bbox else 'no'} filtros={filters or '-'}"
+                cases.append((label, features, filters, bbox))
+    return cases
+
+
+def check(snapshot, queries: list, samples: int = 5, seed: int = 0) -> int:
+    """Compara PropertyColumns con la referencia; devuelve la cantidad de casos con diferencias."""
+    columns = service._build_property_columns(snapshot)
+    payloads = columns.payloads
+    rng = random.Random(seed)
+    failures = 0
+    for label, features, filters, bbox in build_cases(payloads, queries):
+        expected_pass = np.array([reference_passes(p, features, filters, bbox) for p in payloads], dtype=bool)
+        expected_score = np.array([reference_score(p, features) for p in payloads], dtype=np.int64)
+        subsets = [None] + [
+            np.array(rng.sample(range(len(payloads)), rng.randint(0, len(payloads))), dtype=np.int64)
+            for _ in range(samples)
+        ]
+        for rows in subsets:
+            want_pass = expected_pass if rows is None else expected_pass[rows]
+            want_score = expected_score if rows is None else expected_score[rows]
+            got_pass = columns.passes(features, filters, bbox, rows=rows)
+            got_score = columns.scores(features, rows=rows)
+            if np.array_equal(got_pass, want_pass) and np.array_equal(got_score, want_score):
+                continue
+            failures += 1
+            scope = "todas las filas" if rows is None else f"{len(rows)} filas"
+            bad = np.flatnonzero((got_pass != want_pass) | (got_score != want_score))[:5]
+            print(f"❌ {label} ({scope}): difiere en las posiciones {bad.tolist()}")
+    return failures
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Chequeo diferencial de PropertyColumns")
+    parser.add_argument("--queries", help="Archivo con una consulta por línea")
+    parser.add_argument("--samples", type=int, default=5, help="Subconjuntos de filas aleatorios por caso")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    load_dotenv()
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    service.settings = {
+        "collection_name": os.getenv("COLLECTION_NAME", "propertiesV3"),
+        "snapshot_change_field": os.getenv("SNAPSHOT_CHANGE_FIELD", "updated_at"),
+    }
+    service.qdrant_cli = QdrantClient(
+        url=os.getenv("QDRANT_HOST") or os.getenv("QDRANT_URL"),
+        api_key=(os.getenv("QDRANT_API_KEY", "").strip() or None),
+    )
+    snapshot = service.property_snapshot.load_full()
+    if snapshot is None:
+        print("❌ No se pudo cargar la colección")
+        sys.exit(2)
+
+    print(f"🔧 {len(snapshot.point_ids)} propiedades, {len(queries)} consultas")
+    failures = check(snapshot, queries, args.samples, args.seed)
+    if failures:
+        print(f"❌ {failures} casos con diferencias")
+        sys.exit(1)
+    print("✅ PropertyColumns coincide con la referencia fila a fila")
+
+
+if __name__ == "__main__":
+    main_cli()
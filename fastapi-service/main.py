@@ -1,16 +1,39 @@
 from fastapi import FastAPI, HTTPException, Request, Response, Query
 from pydantic import BaseModel
-from qdrant_client import QdrantClient, models
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
 import os
 import json
 import re
+import math
+import time
+import asyncio
+import base64
+import bisect
+import struct
+import hashlib
+import hmac
+import sqlite3
+import threading
+import unicodedata
+import uuid
+import numpy as np
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 from datetime import datetime
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from dotenv import load_dotenv
 from functools import lru_cache
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from supabase import create_client, Client
 
+try:
+    import orjson  # encoder rápido para las respuestas grandes (geojson, listados)
+except ImportError:
+    orjson = None
+
 # --- Configuration & Initialization ---
 
 @lru_cache()
@@ -38,7 +61,57 @@ def get_settings():
         "supabase_db_port": os.getenv("SUPABASE_DB_PORT", "5432"),
         "supabase_db_name": os.getenv("SUPABASE_DB_NAME"),
         "supabase_db_user": os.getenv("SUPABASE_DB_USER"),
-        "supabase_db_password": os.getenv("SUPABASE_DB_PASSWORD")
+        "supabase_db_password": os.getenv("SUPABASE_DB_PASSWORD"),
+        # Snapshot en memoria de la colección (ver PropertySnapshotStore)
+        "snapshot_refresh_seconds": int(os.getenv("SNAPSHOT_REFRESH_SECONDS", "60")),
+        "snapshot_full_refresh_seconds": int(os.getenv("SNAPSHOT_FULL_REFRESH_SECONDS", "900")),
+        "snapshot_change_field": os.getenv("SNAPSHOT_CHANGE_FIELD", "updated_at"),
+        # Cache de tenants por subdominio usada por tenant_middleware
+        "tenant_cache_ttl_seconds": int(os.getenv("TENANT_CACHE_TTL_SECONDS", "300")),
+        "tenant_negative_ttl_seconds": int(os.getenv("TENANT_NEGATIVE_TTL_SECONDS", "60")),
+        "tenant_negative_max_entries": int(os.getenv("TENANT_NEGATIVE_MAX_ENTRIES", "1024")),
+        "tenant_reload_min_seconds": int(os.getenv("TENANT_RELOAD_MIN_SECONDS", "30")),
+        # Token para operaciones administrativas (header X-Admin-Token); vacío = deshabilitadas
+        "admin_api_token": os.getenv("ADMIN_API_TOKEN", "").strip(),
+        "neighborhood_refresh_seconds": int(os.getenv("NEIGHBORHOOD_REFRESH_SECONDS", "600")),
+        # Cache de embeddings de consultas (LRU en memoria + SQLite en disco)
+        "embedding_model": os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"),
+        "embedding_cache_size": int(os.getenv("EMBEDDING_CACHE_SIZE", "2048")),
+        "embedding_cache_path": os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite3"),
+        # Backend de embeddings: "openai" o "onnx" (encoder local en CPU), elegible por colección
+        # con EMBEDDING_BACKEND_BY_COLLECTION="propertiesLocal=onnx,propertiesV3=openai"
+        "embedding_backend": os.getenv("EMBEDDING_BACKEND", "openai").strip().lower(),
+        "embedding_backend_by_collection": {
+            name.strip(): backend.strip().lower()
+            for name, backend in (item.split("=", 1) for item in os.getenv("EMBEDDING_BACKEND_BY_COLLECTION", "").split(",") if "=" in item)
+        },
+        "embedding_batch_size": int(os.getenv("EMBEDDING_BATCH_SIZE", "64")),
+        "embedding_threads": int(os.getenv("EMBEDDING_THREADS", "4")),
+        "onnx_model_dir": os.getenv("ONNX_MODEL_DIR", "").strip(),
+        "onnx_max_length": int(os.getenv("ONNX_MAX_LENGTH", "128")),
+        # Los modelos E5 esperan "query: " delante de las consultas
+        "embedding_query_prefix": os.getenv("EMBEDDING_QUERY_PREFIX", ""),
+        # Cache de resultados de /search (se invalida también al cambiar la versión de la colección)
+        "search_cache_ttl_seconds": int(os.getenv("SEARCH_CACHE_TTL_SECONDS", "300")),
+        "search_cache_size": int(os.getenv("SEARCH_CACHE_SIZE", "1024")),
+        # Campo geo normalizado {"lat", "lon"} con índice GEO (ver backfill_geo_payload.py). Con
+        # GEO_PAYLOAD_SYNC el snapshot lo escribe en Qdrant para los puntos nuevos o modificados
+        "geo_field": os.getenv("GEO_PAYLOAD_FIELD", "geo"),
+        "geo_payload_sync": os.getenv("GEO_PAYLOAD_SYNC", "true").lower() in ("1", "true", "yes"),
+        # Búsqueda híbrida: patas vectorial y BM25 en paralelo, fusionadas con RRF
+        "hybrid_search": os.getenv("HYBRID_SEARCH", "true").lower() in ("1", "true", "yes"),
+        "search_latency_budget_ms": int(os.getenv("SEARCH_LATENCY_BUDGET_MS", "2500")),
+        "rrf_k": int(os.getenv("RRF_K", "60")),
+        "search_batch_max_size": int(os.getenv("SEARCH_BATCH_MAX_SIZE", "20")),
+        # Paginado adaptativo de la búsqueda vectorial (ver PassRateEstimator)
+        "search_max_pages": int(os.getenv("SEARCH_MAX_PAGES", "5")),
+        "search_max_page_size": int(os.getenv("SEARCH_MAX_PAGE_SIZE", "256")),
+        # Índice vectorial en memoria ("off", "float32" o "int8"); por encima del tamaño máximo se usa Qdrant
+        "vector_index": os.getenv("VECTOR_INDEX", "off").strip().lower(),
+        "vector_index_max_points": int(os.getenv("VECTOR_INDEX_MAX_POINTS", "20000")),
+        # Por encima de este zoom /properties/geojson devuelve puntos individuales
+        "cluster_max_zoom": int(os.getenv("CLUSTER_MAX_ZOOM", "15")),
+        "tile_cache_size": int(os.getenv("TILE_CACHE_SIZE", "4096")),
     }
     # Only enforce required keys - make more flexible for debugging
     required_keys = ["qdrant_host", "collection_name", "supabase_url", "supabase_key"]
@@ -61,6 +134,9 @@ settings = {}
 qdrant_cli = None
 openai_cli = None
 supabase_cli = None
+# Clientes async para /search (el resto de los endpoints sigue usando los sync)
+async_qdrant_cli = None
+async_openai_cli = None
 
 app = FastAPI(
     title="Real Estate API",
@@ -71,7 +147,7 @@ app = FastAPI(
 @app.on_event("startup")
 async def startup_event():
     """Initialize clients when the app starts."""
-    global settings, qdrant_cli, openai_cli, supabase_cli
+    global settings, qdrant_cli, openai_cli, supabase_cli, async_qdrant_cli, async_openai_cli
     print("🚀 Starting FastAPI application...")
     settings = get_settings()
     
@@ -80,21 +156,60 @@ async def startup_event():
         url=settings["qdrant_host"],
         api_key=(settings["qdrant_api_key"] or None)
     )
+    async_qdrant_cli = AsyncQdrantClient(
+        url=settings["qdrant_host"],
+        api_key=(settings["qdrant_api_key"] or None)
+    )
     
     print("🔧 Initializing OpenAI client...")
     # Asegurar que el API key no tenga espacios (doble protección)
     openai_api_key = settings["openai_api_key"].strip() if settings["openai_api_key"] else ""
     print(f"🔍 DEBUG - OpenAI API Key length: {len(openai_api_key)}, ends with space: {openai_api_key.endswith(' ') if openai_api_key else False}")
     openai_cli = OpenAI(api_key=openai_api_key)
+    async_openai_cli = AsyncOpenAI(api_key=openai_api_key)
+    embedding_cache.configure(settings["embedding_cache_size"], settings["embedding_cache_path"])
+    search_result_cache.configure(settings["search_cache_ttl_seconds"], settings["search_cache_size"])
+    tile_cache.max_entries = settings["tile_cache_size"]
     
     print("🔧 Initializing Supabase client...")
     supabase_cli = create_client(settings["supabase_url"], settings["supabase_key"])
     
+    print("🔧 Loading tenants and neighborhoods...")
+    await asyncio.to_thread(tenant_resolver.load)
+    await asyncio.to_thread(neighborhood_gazetteer.load)
+    asyncio.create_task(_run_periodically("tenants", settings["tenant_cache_ttl_seconds"], tenant_resolver.load))
+    asyncio.create_task(_run_periodically("neighborhoods", settings["neighborhood_refresh_seconds"], neighborhood_gazetteer.load))
+    
     print(f"✅ Connecting to collection: {settings['collection_name']}")
-    qdrant_cli.get_collection(collection_name=settings["collection_name"])
+    collection_info = qdrant_cli.get_collection(collection_name=settings["collection_name"])
+    
+    print("🔧 Loading embedding backend...")
+    try:
+        await asyncio.to_thread(_warm_up_embedding_provider, collection_info)
+    except Exception as e:
+        # /search sigue funcionando con la pata BM25 hasta que el backend responda
+        print(f"⚠️ Embedding backend not ready at startup: {e}")
+    
+    print("🔧 Loading property snapshot...")
+    try:
+        await asyncio.to_thread(property_snapshot.load_full)
+    except Exception as e:
+        # Los endpoints reintentan la carga bajo demanda o caen a Qdrant
+        print(f"⚠️ Could not load property snapshot at startup: {e}")
+    asyncio.create_task(_run_periodically("snapshot", settings["snapshot_refresh_seconds"], property_snapshot.refresh))
     
     print("✅ All clients initialized successfully!")
 
+async def _run_periodically(name: str, interval_seconds: int, func):
+    """Ejecuta `func` en un thread cada `interval_seconds` (refrescos de caches en segundo plano)."""
+    interval_seconds = max(int(interval_seconds or 0), 1)
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(func)
+        except Exception as e:
+            print(f"⚠️ Periodic refresh '{name}' failed: {e}")
+
 # --- Add CORS Middleware ---
 # Define the specific origins that are allowed to make requests.
 allowed_origins = [
@@ -119,8 +234,144 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+# --- Tenant Resolution Cache ---
+
+class TenantResolver:
+    """Mapa subdominio → tenant_id precargado desde Supabase.
+
+    Se recarga completo cada TENANT_CACHE_TTL_SECONDS; los subdominios desconocidos se
+    recuerdan durante TENANT_NEGATIVE_TTL_SECONDS para no consultar la base en cada request.
+    La cache negativa es un LRU acotado a TENANT_NEGATIVE_MAX_ENTRIES: cualquiera puede mandar
+    hosts inventados, así que no puede crecer sin límite.
+    """
+
+    def __init__(self):
+        self._tenants = {}
+        self._negative = OrderedDict()
+        self._lock = threading.Lock()
+        self.loaded_at = None
+        self.forced_reload_at = None
+        self.last_error = None
+        self.hits = 0
+        self.negative_hits = 0
+        self.lookups = 0
+
+    def load(self) -> bool:
+        try:
+            response = supabase_cli.table("tenants").select("id, subdomain").execute()
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"⚠️ Error cargando tenants desde Supabase: {e}")
+            return False
+        tenants = {
+            row["subdomain"].lower(): row["id"]
+            for row in (response.data or [])
+            if row.get("subdomain") and row.get("id")
+        }
+        with self._lock:
+            self._tenants = tenants
+            # Un tenant recién creado deja de estar en la cache negativa
+            self._negative = OrderedDict((sub, exp) for sub, exp in self._negative.items() if sub not in tenants)
+            self.loaded_at = time.time()
+            self.last_error = None
+        print(f"✅ Cargados {len(tenants)} tenants desde Supabase")
+        return True
+
+    def cached(self, subdomain: str):
+        """(encontrado, tenant_id) sin tocar la base; encontrado=False si hay que consultar Supabase."""
+        subdomain = subdomain.lower()
+        tenant_id = self._tenants.get(subdomain)
+        if tenant_id is not None:
+            self.hits += 1
+            return True, tenant_id
+        with self._lock:
+            expires_at = self._negative.get(subdomain)
+            if expires_at is None:
+                return False, None
+            if expires_at <= time.time():
+                del self._negative[subdomain]
+                return False, None
+            self._negative.move_to_end(subdomain)
+        self.negative_hits += 1
+        return True, None
+
+    def fetch(self, subdomain: str):
+        """Consulta un subdominio en Supabase y recuerda el resultado. Bloqueante: llamar fuera del event loop."""
+        subdomain = subdomain.lower()
+        self.lookups += 1
+        response = supabase_cli.table("tenants").select("id").eq("subdomain", subdomain).limit(1).execute()
+        with self._lock:
+            if response.data:
+                tenant_id = response.data[0]["id"]
+                self._tenants = {**self._tenants, subdomain: tenant_id}
+                self._negative.pop(subdomain, None)
+                return tenant_id
+            self._remember_missing(subdomain)
+            return None
+
+    def _remember_missing(self, subdomain: str):
+        # Con TTL fijo el orden de inserción es el de vencimiento: las vencidas están al principio
+        now = time.time()
+        while self._negative:
+            oldest, expires_at = next(iter(self._negative.items()))
+            if expires_at > now:
+                break
+            del self._negative[oldest]
+        self._negative[subdomain] = now + (settings.get("tenant_negative_ttl_seconds") or 60)
+        self._negative.move_to_end(subdomain)
+        max_entries = max(1, settings.get("tenant_negative_max_entries") or 1024)
+        while len(self._negative) > max_entries:
+            self._negative.popitem(last=False)
+
+    def resolve(self, subdomain: str):
+        """tenant_id del subdominio, o None si no existe. Lanza excepción si falla la base."""
+        found, tenant_id = self.cached(subdomain)
+        if found:
+            return tenant_id
+        # Tenant nuevo o desconocido: una sola consulta y se recuerda el resultado
+        return self.fetch(subdomain)
+
+    def invalidate(self, subdomain: str = None):
+        """Olvida un subdominio, o toda la cache negativa (el mapa completo se reemplaza con reload)."""
+        with self._lock:
+            if subdomain:
+                subdomain = subdomain.lower()
+                self._tenants = {sub: tid for sub, tid in self._tenants.items() if sub != subdomain}
+                self._negative.pop(subdomain, None)
+            else:
+                self._negative = OrderedDict()
+
+    def claim_forced_reload(self) -> float:
+        """Reserva una recarga completa forzada: 0 si se puede hacer ya, o los segundos que faltan."""
+        now = time.time()
+        min_interval = settings.get("tenant_reload_min_seconds") or 30
+        with self._lock:
+            if self.forced_reload_at is not None and now - self.forced_reload_at < min_interval:
+                return self.forced_reload_at + min_interval - now
+            self.forced_reload_at = now
+        return 0.0
+
+    def force_reload(self) -> bool:
+        self.invalidate()
+        return self.load()
+
+    def stats(self) -> dict:
+        return {
+            "tenants": len(self._tenants),
+            "negative_entries": len(self._negative),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "db_lookups": self.lookups,
+            "age_seconds": round(time.time() - self.loaded_at, 1) if self.loaded_at else None,
+            "last_error": self.last_error,
+        }
+
+
+tenant_resolver = TenantResolver()
+
 # --- Tenant Resolution Middleware ---
 @app.middleware("http")
 async def tenant_middleware(request: Request, call_next):
@@ -167,19 +418,17 @@ async def tenant_middleware(request: Request, call_next):
             else:
                 subdomain = temp_subdomain
 
-    # If we found a valid subdomain, get its ID from Supabase
+    # If we found a valid subdomain, resolve its ID (cached; only unknown subdomains hit Supabase, off the event loop)
     if subdomain:
-        print(f"Found subdomain '{subdomain}'. Resolving tenant ID...")
         try:
-            response = supabase_cli.table("tenants").select("id").eq("subdomain", subdomain).single().execute()
-            if not response.data:
-                return Response(content=f'{{"detail":"Tenant with subdomain \'{subdomain}\' not found."}}', status_code=404, media_type="application/json")
-            
-            tenant_id = response.data['id']
-            print(f"Request mapped to tenant ID: {tenant_id}")
+            found, tenant_id = tenant_resolver.cached(subdomain)
+            if not found:
+                tenant_id = await asyncio.to_thread(tenant_resolver.fetch, subdomain)
         except Exception as e:
             print(f"Error during tenant resolution for subdomain '{subdomain}': {e}")
             return Response(content='{"detail":"Error resolving tenant."}', status_code=500, media_type="application/json")
+        if tenant_id is None:
+            return Response(content=f'{{"detail":"Tenant with subdomain \'{subdomain}\' not found."}}', status_code=404, media_type="application/json")
 
     # Attach tenant_id (or None) to the request state for use in endpoints
     request.state.tenant_id = tenant_id
@@ -198,6 +447,14 @@ class SearchRequestModel(BaseModel):
     filters: dict = None
     top_k: int = 5
 
+class SearchBatchRequestModel(BaseModel):
+    searches: List[SearchRequestModel]
+
+class PropertyBatchRequestModel(BaseModel):
+    ids: List[str]
+    profile: str = "full"
+    fields: List[str] = None
+
 PROPERTY_TYPE_KEYWORDS = {
     "departamento": ["departamento", "departamentos", "depto", "dto"],
     "casa": ["casa", "casas", "chalet", "chalets"],
@@ -209,75 +466,154 @@ PROPERTY_TYPE_KEYWORDS = {
     "terreno": ["terreno", "lote", "lotes"]
 }
 
-# NEIGHBORHOODS ahora se carga dinámicamente desde Supabase
-NEIGHBORHOODS_CACHE = None
+# Los barrios se cargan desde Supabase y se mantienen en memoria (ver NeighborhoodGazetteer)
+NEIGHBORHOOD_FIELDS = "id, name, slug, bbox_min_lat, bbox_max_lat, bbox_min_lon, bbox_max_lon"
+NEIGHBORHOOD_RETRY_SECONDS = 30
 
-def _get_neighborhoods_from_db():
-    """Obtiene la lista de barrios desde la tabla neighborhoods de Supabase."""
-    global NEIGHBORHOODS_CACHE
-    
-    if NEIGHBORHOODS_CACHE is not None:
-        return NEIGHBORHOODS_CACHE
-    
-    try:
-        if not supabase_cli:
-            print("⚠️ Supabase client no inicializado, usando lista hardcodeada")
-            NEIGHBORHOODS_CACHE = []
-            return NEIGHBORHOODS_CACHE
-        
-        response = supabase_cli.table("neighborhoods").select("name, slug").execute()
-        neighborhoods = []
-        if response.data:
-            for nb in response.data:
-                neighborhoods.append(nb.get("name", "").lower())
-                neighborhoods.append(nb.get("slug", "").lower())
-        
-        NEIGHBORHOODS_CACHE = neighborhoods
-        print(f"✅ Cargados {len(neighborhoods)} barrios desde Supabase")
-        return neighborhoods
-    except Exception as e:
-        print(f"⚠️ Error cargando barrios desde Supabase: {e}")
-        NEIGHBORHOODS_CACHE = []
-        return []
 
-def _find_neighborhood_by_query(query: str):
-    """Busca un barrio en la base de datos basado en la query del usuario."""
-    try:
-        if not supabase_cli:
+class NeighborhoodGazetteer:
+    """Tabla neighborhoods completa en memoria, con búsqueda exacta, por prefijo y por subcadena.
+
+    Reemplaza las consultas ilike '%q%' a Supabase en cada /search. Si una carga falla se
+    conservan los datos anteriores y se reintenta después de NEIGHBORHOOD_RETRY_SECONDS.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.version = 0
+        self.loaded_at = None
+        self.last_attempt_at = None
+        self.last_error = None
+        self._names = []
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def is_loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def ensure_loaded(self):
+        if self.is_loaded() or not supabase_cli:
+            return
+        if self.last_attempt_at and time.time() - self.last_attempt_at < NEIGHBORHOOD_RETRY_SECONDS:
+            return
+        self.load()
+
+    def load(self) -> bool:
+        """Recarga la tabla desde Supabase; devuelve False si falló (sin tocar los datos actuales)."""
+        with self._lock:
+            self.last_attempt_at = time.time()
+            try:
+                response = supabase_cli.table("neighborhoods").select(NEIGHBORHOOD_FIELDS).execute()
+                rows = response.data or []
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"⚠️ Error cargando barrios desde Supabase: {e}")
+                return False
+            self.last_error = None
+            self.loaded_at = time.time()
+            if rows == self.rows:
+                return True
+            self._build(rows)
+            print(f"✅ Cargados {len(rows)} barrios desde Supabase (versión {self.version})")
+            return True
+
+    def _build(self, rows: list):
+        names = []
+        indexes = {}
+        for field in ("name", "slug"):
+            exact, keys, trigrams = {}, [], {}
+            for position, row in enumerate(rows):
+                key = (row.get(field) or "").lower()
+                names.append(key)
+                if not key:
+                    continue
+                exact.setdefault(key, position)
+                keys.append((key, position))
+                for i in range(len(key) - 2):
+                    trigrams.setdefault(key[i : i + 3], set()).add(position)
+            keys.sort()
+            indexes[field] = (exact, keys, trigrams)
+        self.rows = rows
+        self._indexes = indexes
+        self._names = names
+        self.version += 1
+
+    def names(self) -> list:
+        """Nombres y slugs en minúsculas; la misma lista mientras no cambie la versión."""
+        return self._names
+
+    def _lookup(self, field: str, query: str):
+        exact, keys, trigrams = self._indexes[field]
+        if query in exact:
+            return exact[query]
+        # Prefijo: búsqueda binaria sobre las claves ordenadas
+        i = bisect.bisect_left(keys, (query, -1))
+        prefixed = []
+        while i < len(keys) and keys[i][0].startswith(query):
+            prefixed.append(keys[i][1])
+            i += 1
+        if prefixed:
+            return min(prefixed)
+        # Subcadena: intersección de trigramas y verificación final
+        if len(query) >= 3:
+            candidates = None
+            for j in range(len(query) - 2):
+                postings = trigrams.get(query[j : j + 3])
+                if not postings:
+                    return None
+                candidates = set(postings) if candidates is None else candidates & postings
+                if not candidates:
+                    return None
+        else:
+            candidates = [position for _, position in keys]
+        matches = [position for position in candidates if query in (self.rows[position].get(field) or "").lower()]
+        return min(matches) if matches else None
+
+    def find(self, query: str):
+        """Primer barrio cuyo nombre (o, si no hay, slug) coincide con la consulta."""
+        query = (query or "").lower().strip()
+        if not query or not self._indexes:
             return None
-        
-        query_lower = query.lower()
-        
-        # Buscar por nombre primero
-        response = supabase_cli.table("neighborhoods").select(
-            "id, name, slug, bbox_min_lat, bbox_max_lat, bbox_min_lon, bbox_max_lon"
-        ).ilike("name", f"%{query_lower}%").limit(1).execute()
-        
-        # Si no encuentra por nombre, buscar por slug
-        if not response.data or len(response.data) == 0:
-            response = supabase_cli.table("neighborhoods").select(
-                "id, name, slug, bbox_min_lat, bbox_max_lat, bbox_min_lon, bbox_max_lon"
-            ).ilike("slug", f"%{query_lower}%").limit(1).execute()
-        
-        if response.data and len(response.data) > 0:
-            nb = response.data[0]
-            return {
-                "id": nb.get("id"),
-                "name": nb.get("name"),
-                "slug": nb.get("slug"),
-                "bbox": {
-                    "min_lat": nb.get("bbox_min_lat"),
-                    "max_lat": nb.get("bbox_max_lat"),
-                    "min_lon": nb.get("bbox_min_lon"),
-                    "max_lon": nb.get("bbox_max_lon")
-                }
-            }
+        for field in ("name", "slug"):
+            position = self._lookup(field, query)
+            if position is not None:
+                return self.rows[position]
         return None
-    except Exception as e:
-        print(f"⚠️ Error buscando barrio en Supabase: {e}")
-        import traceback
-        traceback.print_exc()
+
+    def status(self) -> dict:
+        return {
+            "loaded": self.is_loaded(),
+            "version": self.version,
+            "neighborhoods": len(self.rows),
+            "age_seconds": round(time.time() - self.loaded_at, 1) if self.loaded_at else None,
+            "last_error": self.last_error,
+        }
+
+
+neighborhood_gazetteer = NeighborhoodGazetteer()
+
+def _get_neighborhoods_from_db():
+    """Obtiene la lista de barrios (nombres y slugs) desde el gazetteer en memoria."""
+    neighborhood_gazetteer.ensure_loaded()
+    return neighborhood_gazetteer.names()
+
+def _find_neighborhood_by_query(query: str):
+    """Busca un barrio en el gazetteer en memoria basado en la query del usuario."""
+    neighborhood_gazetteer.ensure_loaded()
+    nb = neighborhood_gazetteer.find(query)
+    if not nb:
         return None
+    return {
+        "id": nb.get("id"),
+        "name": nb.get("name"),
+        "slug": nb.get("slug"),
+        "bbox": {
+            "min_lat": nb.get("bbox_min_lat"),
+            "max_lat": nb.get("bbox_max_lat"),
+            "min_lon": nb.get("bbox_min_lon"),
+            "max_lon": nb.get("bbox_max_lon")
+        }
+    }
 
 def _normalise_text(value: str) -> str:
     if not value:
@@ -292,25 +628,204 @@ def _extract_numeric(value):
     except (ValueError, TypeError):
         return None
 
-def _extract_coords_from_postgis(location_str: str):
-    """Extrae coordenadas lat/lng del formato PostGIS POINT o SRID=4326;POINT(...)"""
-    if not location_str:
+POSTGIS_POINT_RE = re.compile(r'POINT\s*\(\s*(-?[0-9.]+)\s+(-?[0-9.]+)\s*\)', re.IGNORECASE)
+LAT_FIELDS = ("lat", "latitude", "latitud")
+LNG_FIELDS = ("lng", "longitude", "longitud", "lon")
+
+def _first_coordinate(payload: dict, fields) -> float:
+    for field in fields:
+        value = payload.get(field)
+        if value in (None, ""):
+            continue
+        try:
+            return float(value)
+        except (ValueError, TypeError):
+            continue
+    return None
+
+def _extract_property_coords(payload: dict):
+    """Normaliza las coordenadas de un payload a (lat, lng).
+
+    Soporta el campo geo normalizado, lat/latitude/latitud, lng/longitude/longitud/lon y el
+    string PostGIS de `location`.
+    Devuelve (None, None) si no hay coordenadas válidas.
+    """
+    if not payload:
         return None, None
-    try:
-        # Buscar el patrón POINT(lng lat) o SRID=4326;POINT(lng lat)
-        import re
-        location_str_clean = str(location_str)
-        match = re.search(r'POINT\(([-\d.]+)\s+([-\d.]+)\)', location_str_clean)
-        if match:
-            lng = float(match.group(1))
-            lat = float(match.group(2))
-            print(f"   🔍 DEBUG _extract_coords_from_postgis: Match encontrado - lng={lng}, lat={lat}")
+    geo = payload.get(settings.get("geo_field") or "geo")
+    if isinstance(geo, dict):
+        lat = _first_coordinate(geo, LAT_FIELDS)
+        lng = _first_coordinate(geo, LNG_FIELDS)
+        if lat is not None and lng is not None:
             return lat, lng
-        else:
-            print(f"   ⚠️ DEBUG _extract_coords_from_postgis: No match encontrado - location_str={location_str_clean[:100]}")
-    except (ValueError, TypeError, AttributeError) as e:
-        print(f"   ⚠️ DEBUG _extract_coords_from_postgis: Error al extraer - {e}")
-    return None, None
+    return _source_property_coords(payload)
+
+def _source_property_coords(payload: dict):
+    """Como _extract_property_coords pero solo desde los campos de origen, ignorando el campo geo."""
+    lat = _first_coordinate(payload, LAT_FIELDS)
+    lng = _first_coordinate(payload, LNG_FIELDS)
+    if lat is None or lng is None:
+        location = payload.get("location")
+        match = POSTGIS_POINT_RE.search(location) if isinstance(location, str) else None
+        if not match:
+            return None, None
+        try:
+            lng, lat = float(match.group(1)), float(match.group(2))
+        except ValueError:
+            return None, None
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0) or (lat == 0 and lng == 0):
+        return None, None
+    return lat, lng
+
+def _geo_payload_value(payload: dict):
+    """Valor del campo geo normalizado ({"lat", "lon"}) recalculado desde los campos de origen; None sin coordenadas."""
+    lat, lng = _source_property_coords(payload or {})
+    if lat is None:
+        return None
+    return {"lat": lat, "lon": lng}
+
+def _geo_bbox_condition(bbox: dict, margin_ratio: float = 0.0):
+    """Condición de Qdrant para el bbox de un barrio: geo_bounding_box sobre el campo geo, o rangos
+    de latitude/longitude para los puntos que todavía no tienen el campo geo.
+
+    La ingesta no genera el campo geo: lo escribe el snapshot al ver puntos nuevos o modificados
+    (GEO_PAYLOAD_SYNC) o backfill_geo_payload.py. Mientras tanto esos puntos caen en los rangos.
+    Devuelve None si el bbox está incompleto. margin_ratio expande el bbox (0.1 = 10% por lado).
+    """
+    if not bbox or not all(bbox.get(key) for key in ("min_lat", "max_lat", "min_lon", "max_lon")):
+        return None
+    min_lat, max_lat = float(bbox["min_lat"]), float(bbox["max_lat"])
+    min_lon, max_lon = float(bbox["min_lon"]), float(bbox["max_lon"])
+    lat_margin = (max_lat - min_lat) * margin_ratio
+    lon_margin = (max_lon - min_lon) * margin_ratio
+    min_lat, max_lat = min_lat - lat_margin, max_lat + lat_margin
+    min_lon, max_lon = min_lon - lon_margin, max_lon + lon_margin
+    return models.Filter(should=[
+        models.FieldCondition(
+            key=settings.get("geo_field") or "geo",
+            geo_bounding_box=models.GeoBoundingBox(
+                top_left=models.GeoPoint(lat=max_lat, lon=min_lon),
+                bottom_right=models.GeoPoint(lat=min_lat, lon=max_lon),
+            ),
+        ),
+        models.Filter(must=[
+            models.FieldCondition(key="latitude", range=models.Range(gte=min_lat, lte=max_lat)),
+            models.FieldCondition(key="longitude", range=models.Range(gte=min_lon, lte=max_lon)),
+        ]),
+    ])
+
+AMENITY_KEYWORDS = [
+    "frente al mar",
+    "vista al mar",
+    "vista al golf",
+    "pileta",
+    "piscina",
+    "quincho",
+    "cochera",
+    "balcón",
+    "balcon",
+    "amueblado",
+    "luminoso",
+    "terraza",
+    "patio",
+    "jardín",
+    "jardin",
+]
+
+# Palabras que, precedidas por un número, indican ambientes, dormitorios o baños
+ROOM_COUNT_KEYWORDS = {
+    "ambientes": ["ambiente"],
+    "dormitorios": ["dormitorio", "cuarto", "habitacion", "habitación"],
+    "bathrooms": ["baño"],
+}
+
+
+class KeywordAutomaton:
+    """Autómata Aho-Corasick: encuentra todas las apariciones de un conjunto de patrones en una pasada."""
+
+    def __init__(self, patterns):
+        # patterns: iterable de (texto, valor)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for text, value in patterns:
+            if not text:
+                continue
+            node = 0
+            for char in text:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = next_node
+            self._output[node].append((len(text), value))
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find_all(self, text: str):
+        """Genera (inicio, valor) por cada aparición, en orden de posición final."""
+        node = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, value in output[node]:
+                yield position - length + 1, value
+
+
+def _number_before(text: str, start: int, allow_mono: bool = False):
+    """Número escrito justo antes de `start` (admite espacios en el medio), o None.
+
+    Replica `(\\d+)\\s*(?:mono)?` de las expresiones regulares originales.
+    """
+    end = start
+    if allow_mono and text.endswith("mono", 0, end):
+        end -= 4
+    while end > 0 and text[end - 1].isspace():
+        end -= 1
+    digits_start = end
+    while digits_start > 0 and text[digits_start - 1].isdecimal():
+        digits_start -= 1
+    if digits_start == end:
+        return None
+    return _extract_numeric(text[digits_start:end])
+
+
+_QUERY_MATCHER = (None, None)
+
+def _get_query_matcher() -> KeywordAutomaton:
+    """Autómata de tipos, amenities, barrios y palabras de conteo; se reconstruye si cambian los barrios."""
+    global _QUERY_MATCHER
+    db_neighborhoods = _get_neighborhoods_from_db()
+    source, automaton = _QUERY_MATCHER
+    if automaton is not None and source is db_neighborhoods:
+        return automaton
+
+    patterns = []
+    for canonical, variations in PROPERTY_TYPE_KEYWORDS.items():
+        patterns.extend((variation, ("type", canonical)) for variation in variations)
+    patterns.extend((key, ("amenity", key)) for key in AMENITY_KEYWORDS)
+    for kind, words in ROOM_COUNT_KEYWORDS.items():
+        patterns.extend((word, ("count", kind)) for word in words)
+    patterns.extend((name, ("neighborhood", name)) for name in db_neighborhoods if name)
+
+    automaton = KeywordAutomaton(patterns)
+    _QUERY_MATCHER = (db_neighborhoods, automaton)
+    print(f"✅ Matcher de consultas construido con {len(patterns)} patrones")
+    return automaton
 
 def _parse_query_features(query: str):
     text = _normalise_text(query)
@@ -327,64 +842,43 @@ def _parse_query_features(query: str):
     bathrooms = None
     property_types = set()
     must_have_terms = set()
+    neighborhoods = set()
     search_mode = None  # "ambientes" o "bedrooms" para saber qué sistema usa el usuario
 
-    for canonical, variations in PROPERTY_TYPE_KEYWORDS.items():
-        if any(var in text for var in variations):
-            property_types.add(canonical)
+    # Una sola pasada del autómata: tipos, amenities, barrios y "N ambientes/dormitorios/baños"
+    counts = {}
+    for start, (kind, value) in _get_query_matcher().find_all(text):
+        if kind == "type":
+            property_types.add(value)
+        elif kind == "amenity":
+            must_have_terms.add(value)
+        elif kind == "neighborhood":
+            neighborhoods.add(value)
+        elif value not in counts:
+            number = _number_before(text, start, allow_mono=(value == "ambientes"))
+            if number is not None:
+                counts[value] = number
 
     # Detectar si el usuario está usando sistema argentino ("ambientes") o internacional ("dormitorios/cuartos")
-    # Priorizar "ambientes" si aparece primero en la query
-    ambiente_match = re.search(r"(\d+)\s*(?:mono)?ambiente(?:s)?", text, re.IGNORECASE)
-    dormitorio_match = re.search(r"(\d+)\s*(?:dormitorio|cuarto|habitaci[oó]n)(?:s|es)?", text, re.IGNORECASE)
-    
-    if ambiente_match:
+    # Priorizar "ambientes" si aparece en la query
+    if "ambientes" in counts:
         # Sistema argentino: "N ambientes" = living/comedor + (N-1) dormitorios
-        ambientes = _extract_numeric(ambiente_match.group(1))
+        ambientes = counts["ambientes"]
         search_mode = "ambientes"
         # Convertir a bedrooms para búsqueda: N ambientes = N-1 dormitorios (excepto monoambiente = 0 dormitorios)
         if ambientes == 1:
             bedrooms = 0  # Monoambiente no tiene dormitorios separados
         else:
             bedrooms = ambientes - 1  # 2 ambientes = 1 dormitorio, 3 ambientes = 2 dormitorios, etc.
-    elif dormitorio_match:
+    elif "dormitorios" in counts:
         # Sistema internacional: "N dormitorios" = N dormitorios
-        bedrooms = _extract_numeric(dormitorio_match.group(1))
+        bedrooms = counts["dormitorios"]
         search_mode = "bedrooms"
         # Convertir a ambientes: N dormitorios = N+1 ambientes (0 dormitorios = 1 ambiente/monoambiente)
         ambientes = bedrooms + 1 if bedrooms is not None else None
 
-    bathroom_match = re.search(r"(\d+)\s*(baño|baños)", text)
-    if bathroom_match:
-        bathrooms = _extract_numeric(bathroom_match.group(1))
-
-    keywords_of_interest = [
-        "frente al mar",
-        "vista al mar",
-        "vista al golf",
-        "pileta",
-        "piscina",
-        "quincho",
-        "cochera",
-        "balcón",
-        "balcon",
-        "amueblado",
-        "luminoso",
-        "terraza",
-        "patio",
-        "jardín",
-        "jardin",
-    ]
-    for key in keywords_of_interest:
-        if key.lower() in text:
-            must_have_terms.add(key.lower())
-
-    neighborhoods = set()
-    # Cargar barrios desde la base de datos
-    db_neighborhoods = _get_neighborhoods_from_db()
-    for neighborhood in db_neighborhoods:
-        if neighborhood and neighborhood in text:
-            neighborhoods.add(neighborhood)
+    if "bathrooms" in counts:
+        bathrooms = counts["bathrooms"]
 
     return {
         "tokens": tokens,
@@ -398,293 +892,127 @@ def _parse_query_features(query: str):
         "neighborhoods": neighborhoods,
     }
 
-def _property_score(payload: dict, features: dict) -> int:
-    score = 0
-    tokens = features["tokens"]
-    property_types = features["property_types"]
-    neighborhoods = features["neighborhoods"]
-    must_have_terms = features["must_have_terms"]
-
-    searchable_fields = [
-        _normalise_text(payload.get("title")),
-        _normalise_text(payload.get("description")),
-        _normalise_text(payload.get("summary")),
-        _normalise_text(payload.get("address")),
-        _normalise_text(payload.get("location")),
-        _normalise_text(payload.get("neighborhood")),
-        _normalise_text(payload.get("property_type")),
-        " ".join(str(tag).lower() for tag in (payload.get("tags") or [])),
-    ]
-
-    combined_text = " ".join(field for field in searchable_fields if field)
-
-    for token in tokens:
-        if token and token in combined_text:
-            score += 2
-
-    for phrase in features["phrases"]:
-        if phrase and phrase in combined_text:
-            score += 4
-    for neighborhood in neighborhoods:
-        if neighborhood and neighborhood in combined_text:
-            score += 5
-
-    if property_types:
-        prop_type_value = _normalise_text(payload.get("property_type"))
-        for ptype in property_types:
-            if ptype in prop_type_value:
-                score += 6
-
-    for term in must_have_terms:
-        if term and term in combined_text:
-            score += 5
-
-    if features["bedrooms"] is not None:
-        bedrooms_field = _extract_numeric(
-            payload.get("bedrooms")
-            or payload.get("ambientes")
-            or payload.get("rooms")
-        )
-        if bedrooms_field is not None:
-            if bedrooms_field == features["bedrooms"]:
-                score += 6
-            elif bedrooms_field > features["bedrooms"]:
-                score += 3
-            else:
-                score -= 4
-
-    if features["bathrooms"] is not None:
-        bathrooms_field = _extract_numeric(payload.get("bathrooms"))
-        if bathrooms_field is not None:
-            if bathrooms_field == features["bathrooms"]:
-                score += 3
-            elif bathrooms_field > features["bathrooms"]:
-                score += 1
-            else:
-                score -= 2
+# --- Search Text Profiles ---
+# Texto normalizado (minúsculas, sin tildes) y conjuntos de tokens de cada propiedad, calculados una
+# vez por propiedad al armar el snapshot y reutilizados por el scoring y el filtro por barrio.
 
-    return score
+WORD_RE = re.compile(r"\w+")
 
-def _passes_filters(payload: dict, features: dict, filters: dict, neighborhood_bbox: dict = None) -> bool:
-    # Manejar sistema argentino ("ambientes") vs internacional ("bedrooms")
-    search_mode = features.get("search_mode")
-    desired_ambientes = features.get("ambientes")
-    desired_bedrooms = features.get("bedrooms")
-    
-    if search_mode == "ambientes" and desired_ambientes is not None:
-        # Sistema argentino: buscar propiedades donde ambientes == N
-        # O donde bedrooms == N-1 (excepto monoambiente)
-        ambientes_raw = payload.get("ambientes")
-        bedrooms_raw = payload.get("bedrooms") or payload.get("rooms")
-        ambientes_field = _extract_numeric(ambientes_raw)
-        bedrooms_field = _extract_numeric(bedrooms_raw)
-        
-        # Debug logging para entender qué valores llegan
-        if desired_ambientes == 1:
-            print(f"   🔍 DEBUG _passes_filters INICIO: ambientes_raw={ambientes_raw} (type={type(ambientes_raw)}), bedrooms_raw={bedrooms_raw} (type={type(bedrooms_raw)}), ambientes_field={ambientes_field}, bedrooms_field={bedrooms_field}")
-        
-        if ambientes_field is None and bedrooms_field is None:
-            print(f"   🔍 DEBUG _passes_filters: Ambos campos son None - ambientes_raw={ambientes_raw}, bedrooms_raw={bedrooms_raw}")
-            return False
-        
-        # Si busca monoambiente (1 ambiente)
-        # UNIFICACIÓN: Aceptar propiedades con ambientes=1 O bedrooms=1 O bedrooms=0
-        # IMPORTANTE: Rechazar propiedades con ambientes=2+ aunque tengan bedrooms=1
-        if desired_ambientes == 1:
-            # PRIMERO: Rechazar si tiene ambientes=2 o más (definitivamente NO es 1 ambiente)
-            if ambientes_field is not None and ambientes_field >= 2:
-                print(f"   🔍 DEBUG _passes_filters monoambiente: Rechazada por ambientes >= 2 - ambientes_field={ambientes_field}")
-                return False
-            
-            # SEGUNDO: Aceptar si cumple alguna de estas condiciones
-            match = False
-            # Si tiene ambientes=1, aceptar (sin importar bedrooms)
-            print(f"   🔍 DEBUG _passes_filters ANTES IF: ambientes_field={ambientes_field}, type={type(ambientes_field)}, bedrooms_field={bedrooms_field}, type={type(bedrooms_field)}")
-            if ambientes_field is not None and ambientes_field == 1:
-                match = True
-                print(f"   ✅ DEBUG _passes_filters monoambiente: ACEPTADA por ambientes=1 - ambientes_field={ambientes_field}, bedrooms_field={bedrooms_field}")
-            # Si tiene bedrooms=1 Y ambientes no es 2+, aceptar
-            elif bedrooms_field is not None and bedrooms_field == 1:
-                match = True
-                print(f"   ✅ DEBUG _passes_filters monoambiente: ACEPTADA por bedrooms=1 - ambientes_field={ambientes_field}, bedrooms_field={bedrooms_field}")
-            # Si tiene bedrooms=0, aceptar (monoambiente)
-            elif bedrooms_field is not None and bedrooms_field == 0:
-                match = True
-                print(f"   ✅ DEBUG _passes_filters monoambiente: ACEPTADA por bedrooms=0 - ambientes_field={ambientes_field}, bedrooms_field={bedrooms_field}")
-            print(f"   🔍 DEBUG _passes_filters DESPUES IF: match={match}")
-            
-            if not match:
-                # Log detallado para debuggear
-                print(f"   🔍 DEBUG _passes_filters monoambiente: RECHAZADA - ambientes_raw={ambientes_raw}, bedrooms_raw={bedrooms_raw}, ambientes_field={ambientes_field}, bedrooms_field={bedrooms_field}, match={match}")
-                return False
-        else:
-            # Para 2+ ambientes: ambientes == N O bedrooms == N-1
-            match = False
-            if ambientes_field is not None and ambientes_field == desired_ambientes:
-                match = True
-            elif bedrooms_field is not None and bedrooms_field == (desired_ambientes - 1):
-                match = True
-            if not match:
-                return False
-    elif search_mode == "bedrooms" and desired_bedrooms is not None:
-        # Sistema internacional: buscar propiedades donde bedrooms == N
-        bedrooms_field = _extract_numeric(
-            payload.get("bedrooms")
-            or payload.get("rooms")
-        )
-        if bedrooms_field is None:
-            return False
-        # Si busca 1 dormitorio, buscar exactamente 1. Si busca 2+, usar >=
-        if desired_bedrooms == 1:
-            if bedrooms_field != 1:
-                return False
-        else:
-            if bedrooms_field < desired_bedrooms:
-                return False
-    elif desired_bedrooms is not None:
-        # Fallback: si no hay search_mode pero hay bedrooms, usar lógica antigua
-        bedrooms_field = _extract_numeric(
-            payload.get("bedrooms")
-            or payload.get("rooms")
-        )
-        if bedrooms_field is None:
-            return False
-        if desired_bedrooms == 1:
-            if bedrooms_field != 1:
-                return False
-        else:
-            if bedrooms_field < desired_bedrooms:
-                return False
+def _fold_text(value) -> str:
+    """Minúsculas y sin tildes/diéresis ("Güemes" -> "guemes", "balcón" -> "balcon")."""
+    if not value:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", str(value).lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
 
-    desired_bathrooms = features.get("bathrooms")
-    if desired_bathrooms is not None:
-        bathrooms_field = _extract_numeric(payload.get("bathrooms"))
-        if bathrooms_field is None or bathrooms_field < desired_bathrooms:
-            print(f"   🔍 DEBUG _passes_filters: Rechazada por bathrooms - desired={desired_bathrooms}, actual={bathrooms_field}")
-            return False
+def _folded_words(value) -> list:
+    return WORD_RE.findall(_fold_text(value))
 
-    if features.get("property_types"):
-        prop_type_value = _normalise_text(payload.get("property_type") or "")
-        if not any(ptype in prop_type_value for ptype in features["property_types"]):
-            print(f"   🔍 DEBUG _passes_filters: Rechazada por property_types - desired={features['property_types']}, actual={prop_type_value}")
-            return False
+@lru_cache(maxsize=4096)
+def _fold_term(value: str) -> str:
+    """Forma normalizada de un término de la consulta (token, frase, barrio o amenity)."""
+    return " ".join(_folded_words(value))
 
-    # Verificar filtro geográfico si hay un barrio con bbox
-    if neighborhood_bbox and neighborhood_bbox.get("bbox"):
-        bbox = neighborhood_bbox["bbox"]
-        lat = payload.get("latitude") or payload.get("lat")
-        lng = payload.get("longitude") or payload.get("lng") or payload.get("lon")
-        
-        # Si no hay coordenadas explícitas, intentar extraerlas del formato PostGIS
-        if lat is None or lng is None:
-            location_str = payload.get("location") or ""
-            if location_str:
-                print(f"   🔍 DEBUG _passes_filters: Intentando extraer coordenadas de PostGIS - location_str={location_str[:100]}")
-                postgis_lat, postgis_lng = _extract_coords_from_postgis(location_str)
-                if postgis_lat is not None and postgis_lng is not None:
-                    lat = postgis_lat
-                    lng = postgis_lng
-                    print(f"   ✅ DEBUG _passes_filters: Coordenadas extraídas de PostGIS - lat={lat}, lng={lng}")
-                else:
-                    print(f"   ⚠️ DEBUG _passes_filters: No se pudieron extraer coordenadas de PostGIS - location_str={location_str[:100]}")
-        
-        if lat is None or lng is None:
-            # Si no hay coordenadas, verificar por texto como fallback
-            # Si location tiene formato PostGIS, ignorarlo y buscar en otros campos
-            location_raw = payload.get("location") or ""
-            location_text = ""
-            # Si location NO tiene formato PostGIS, incluirlo en la búsqueda
-            if not location_raw.startswith("SRID=") and not location_raw.startswith("POINT("):
-                location_text = _normalise_text(location_raw) + " "
-            
-            location_text += _normalise_text(payload.get("neighborhood") or "") + " " + _normalise_text(
-                payload.get("address") or ""
-            )
-            neighborhoods_in_query = features.get("neighborhoods", [])
-            if not any(neigh in location_text for neigh in neighborhoods_in_query):
-                print(f"   🔍 DEBUG _passes_filters: Rechazada por filtro geográfico (sin coordenadas, fallback texto) - location_raw={location_raw[:50]}, location_text={location_text[:100]}, neighborhoods={neighborhoods_in_query}")
-                return False
-        else:
-            # Verificar que esté dentro del bounding box
-            try:
-                lat = float(lat)
-                lng = float(lng)
-                if not (bbox["min_lat"] <= lat <= bbox["max_lat"] and 
-                        bbox["min_lon"] <= lng <= bbox["max_lon"]):
-                    print(f"   🔍 DEBUG _passes_filters: Rechazada por filtro geográfico (fuera de bbox) - lat={lat}, lng={lng}, bbox={bbox}")
-                    return False
-            except (ValueError, TypeError):
-                # Si no se puede convertir, usar fallback por texto
-                location_text = _normalise_text(payload.get("location") or "") + " " + _normalise_text(
-                    payload.get("neighborhood") or ""
-                )
-                if not any(neigh in location_text for neigh in features.get("neighborhoods", [])):
-                    return False
-    elif features.get("neighborhoods"):
-        # Si hay barrios mencionados pero no hay bbox, verificar por texto
-        # Buscar en múltiples campos: location, neighborhood, address
-        # Si location tiene formato PostGIS (SRID=4326;POINT...), ignorarlo y buscar en otros campos
-        location_raw = payload.get("location") or ""
-        location_text = ""
-        # Si location NO tiene formato PostGIS, incluirlo en la búsqueda
-        if not location_raw.startswith("SRID=") and not location_raw.startswith("POINT("):
-            location_text = _normalise_text(location_raw) + " "
-        
-        location_text += _normalise_text(payload.get("neighborhood") or "") + " " + _normalise_text(
-            payload.get("address") or ""
-        )
-        neighborhoods_in_query = features["neighborhoods"]
-        if not any(neigh in location_text for neigh in neighborhoods_in_query):
-            print(f"   🔍 DEBUG _passes_filters: Rechazada por filtro de neighborhoods (texto) - location_raw={location_raw[:50]}, location_text={location_text[:100]}, neighborhoods={neighborhoods_in_query}")
-            return False
+def _combined_search_text(payload: dict) -> str:
+    """Texto de la propiedad sobre el que se buscan tokens, frases, barrios y amenities."""
+    searchable_fields = [
+        payload.get("title"),
+        payload.get("description"),
+        payload.get("summary"),
+        payload.get("address"),
+        payload.get("location"),
+        payload.get("neighborhood"),
+        payload.get("property_type"),
+        " ".join(str(tag) for tag in (payload.get("tags") or [])),
+    ]
+    return " ".join(str(field) for field in searchable_fields if field)
 
-    if filters:
-        for key, expected in filters.items():
-            value = payload.get(key)
-            if value is None:
-                return False
-            if isinstance(expected, (list, tuple, set)):
-                expected_values = [str(opt).lower() for opt in expected]
-                if str(value).lower() not in expected_values:
-                    return False
-            else:
-                if str(value).lower() != str(expected).lower():
-                    return False
+def _location_search_text(payload: dict) -> str:
+    """Texto de ubicación (location, neighborhood, address) para filtrar por barrio sin coordenadas.
 
-    return True
+    Si location tiene formato PostGIS (SRID=4326;POINT...), se ignora.
+    """
+    location_raw = str(payload.get("location") or "")
+    location_text = ""
+    if not location_raw.startswith("SRID=") and not location_raw.startswith("POINT("):
+        location_text = location_raw + " "
+    return location_text + str(payload.get("neighborhood") or "") + " " + str(payload.get("address") or "")
+
+
+class PropertySearchText:
+    """Texto y tokens normalizados de una propiedad."""
+
+    __slots__ = ("payload", "text", "tokens", "location_text", "location_tokens", "property_type")
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        words = _folded_words(_combined_search_text(payload))
+        location_words = _folded_words(_location_search_text(payload))
+        # Con espacios en los bordes para buscar frases respetando límites de palabra
+        self.text = " " + " ".join(words) + " "
+        self.tokens = frozenset(words)
+        self.location_text = " " + " ".join(location_words) + " "
+        self.location_tokens = frozenset(location_words)
+        self.property_type = _fold_text(payload.get("property_type"))
+
+    @staticmethod
+    def _contains(term: str, tokens: frozenset, text: str) -> bool:
+        if not term:
+            return True
+        if " " not in term:
+            return term in tokens
+        return all(word in tokens for word in term.split()) and f" {term} " in text
+
+    def matches(self, term: str) -> bool:
+        """¿Aparece el término normalizado (palabra o frase) en el texto de la propiedad?"""
+        return self._contains(term, self.tokens, self.text)
+
+    def matches_location(self, term: str) -> bool:
+        return self._contains(term, self.location_tokens, self.location_text)
+
+
+def _snapshot_has_current(snapshot, point_id, payload: dict) -> bool:
+    """¿El payload de este hit de Qdrant es el mismo que tiene el snapshot (mismo SNAPSHOT_CHANGE_FIELD)?"""
+    if point_id is None or point_id not in snapshot.records:
+        return False
+    change_field = settings.get("snapshot_change_field")
+    return not change_field or (payload or {}).get(change_field) == snapshot.fingerprints.get(point_id)
+
+def _search_profile(payload: dict, point_id=None) -> PropertySearchText:
+    """Perfil precalculado de la propiedad si está en el snapshot (buscado por point id); si no, se calcula en el momento."""
+    snapshot = property_snapshot.current
+    if snapshot is not None and _snapshot_has_current(snapshot, point_id, payload):
+        profile = snapshot.derived("search_text", SNAPSHOT_INDEX_BUILDERS["search_text"]).get(point_id)
+        if profile is not None:
+            return profile
+    return PropertySearchText(payload)
 
 def _fallback_semantic_search(search_request: SearchRequestModel, neighborhood_data: dict = None) -> list:
     if not qdrant_cli:
         return []
 
+    # Con el snapshot cargado, el índice BM25 cubre toda la colección; el scroll queda como respaldo
+    snapshot = property_snapshot.current
+    if snapshot is not None:
+        try:
+            return _keyword_search(snapshot, search_request, neighborhood_data)
+        except Exception as e:
+            print(f"⚠️ Keyword index search failed, falling back to scroll: {e}")
+
     features = _parse_query_features(search_request.query)
     limit = max(search_request.top_k * 8, 200)
     
     # Construir filtros de Qdrant para el scroll
     scroll_filter_conditions = []
+    geo_condition = None
     
     # Agregar filtros geográficos si hay un barrio (con margen para ser más flexible)
     if neighborhood_data and neighborhood_data.get("bbox"):
-        bbox = neighborhood_data["bbox"]
-        if bbox.get("min_lat") and bbox.get("max_lat") and bbox.get("min_lon") and bbox.get("max_lon"):
-            # Expandir el bbox ligeramente (0.01 grados ≈ 1km) para ser más flexible
-            lat_margin = (float(bbox["max_lat"]) - float(bbox["min_lat"])) * 0.1  # 10% de margen
-            lon_margin = (float(bbox["max_lon"]) - float(bbox["min_lon"])) * 0.1
-            scroll_filter_conditions.append(models.FieldCondition(
-                key="latitude",
-                range=models.Range(
-                    gte=float(bbox["min_lat"]) - lat_margin,
-                    lte=float(bbox["max_lat"]) + lat_margin
-                )
-            ))
-            scroll_filter_conditions.append(models.FieldCondition(
-                key="longitude",
-                range=models.Range(
-                    gte=float(bbox["min_lon"]) - lon_margin,
-                    lte=float(bbox["max_lon"]) + lon_margin
-                )
-            ))
-            print(f"✅ Fallback: Filtros geográficos aplicados con margen (bbox expandido ~10%)")
+        # Expandir el bbox un 10% por lado para ser más flexible
+        geo_condition = _geo_bbox_condition(neighborhood_data["bbox"], margin_ratio=0.1)
+        if geo_condition is not None:
+            scroll_filter_conditions.append(geo_condition)
+            print(f"✅ Fallback: Filtro geo_bounding_box aplicado con margen (bbox expandido ~10%)")
     
     # Agregar otros filtros estructurados
     search_mode = features.get("search_mode")
@@ -769,7 +1097,7 @@ def _fallback_semantic_search(search_request: SearchRequestModel, neighborhood_d
             print("🔄 Intentando fallback sin filtros geográficos...")
             try:
                 # Remover filtros geográficos y mantener solo los otros
-                non_geo_conditions = [c for c in scroll_filter_conditions if c.key not in ["latitude", "longitude"]]
+                non_geo_conditions = [c for c in scroll_filter_conditions if c is not geo_condition]
                 fallback_filter = models.Filter(must=non_geo_conditions) if non_geo_conditions else None
                 scroll_results, _ = qdrant_cli.scroll(
                     collection_name=settings["collection_name"],
@@ -785,22 +1113,16 @@ def _fallback_semantic_search(search_request: SearchRequestModel, neighborhood_d
         else:
             return []
 
-    scored_payloads = []
-    for record in scroll_results:
-        payload = record.payload
-        if not _passes_filters(payload, features, search_request.filters or {}, neighborhood_data):
-            continue
-
-        score = _property_score(payload, features)
-        if score > 0:
-            scored_payloads.append((score, payload))
+    passes, scores = _evaluate_candidates(scroll_results, features, search_request.filters or {}, neighborhood_data)
+    scored_payloads = [
+        (score, record.payload)
+        for record, passed, score in zip(scroll_results, passes, scores)
+        if passed and score > 0
+    ]
 
     if not scored_payloads:
         # Si no hay resultados con score > 0, incluir todos los que pasen los filtros
-        for record in scroll_results:
-            payload = record.payload
-            if _passes_filters(payload, features, search_request.filters or {}, neighborhood_data):
-                scored_payloads.append((0, payload))
+        scored_payloads = [(0, record.payload) for record, passed in zip(scroll_results, passes) if passed]
     
     # Si aún no hay resultados y hay un barrio, intentar sin filtro geográfico estricto
     if not scored_payloads and neighborhood_data:
@@ -876,16 +1198,12 @@ def _fallback_semantic_search(search_request: SearchRequestModel, neighborhood_d
             neighborhood_names = features.get("neighborhoods", [])
             neighborhood_name_from_db = neighborhood_data.get("name", "").lower() if neighborhood_data else ""
             print(f"🔍 Buscando barrios: {neighborhood_names} (barrio DB: {neighborhood_name_from_db})")
-            for record in relaxed_results:
+            # Verificar que pasen filtros básicos (sin bbox estricto)
+            relaxed_passes, relaxed_scores = _evaluate_candidates(relaxed_results, features, search_request.filters or {}, None)
+            print(f"🔍 {sum(relaxed_passes)} de {len(relaxed_results)} propiedades pasan los filtros básicos")
+            for record, passes_basic_filters, score in zip(relaxed_results, relaxed_passes, relaxed_scores):
                 payload = record.payload
-                # Verificar que pase filtros básicos
-                passes_basic_filters = _passes_filters(payload, features, search_request.filters or {}, None)  # Sin bbox estricto
-                
                 if not passes_basic_filters:
-                    # Log para debuggear por qué no pasa los filtros
-                    ambientes_field = payload.get("ambientes")
-                    bedrooms_field = payload.get("bedrooms")
-                    print(f"⚠️ Propiedad rechazada por filtros: {payload.get('title', 'Sin título')[:50]} - ambientes={ambientes_field}, bedrooms={bedrooms_field}")
                     continue
                 
                 # Primero verificar el campo neighborhood directamente (más preciso)
@@ -908,20 +1226,2585 @@ def _fallback_semantic_search(search_request: SearchRequestModel, neighborhood_d
                         neighborhood_match = True
                 
                 if neighborhood_match:
-                    score = _property_score(payload, features)
                     scored_payloads.append((score, payload))
                     print(f"✅ Propiedad encontrada por texto: {payload.get('title', 'Sin título')[:50]} - Neighborhood: {payload.get('neighborhood', 'N/A')}, ambientes={payload.get('ambientes')}, bedrooms={payload.get('bedrooms')}")
             
             print(f"✅ Búsqueda relajada encontró {len(scored_payloads)} propiedades por texto")
         except Exception as e:
-            print(f"⚠️ Búsqueda relajada falló: {e}")
-            import traceback
-            traceback.print_exc()
+            print(f"⚠️ Búsqueda relajada falló: {e}")
+            import traceback
+            traceback.print_exc()
+
+    scored_payloads.sort(key=lambda item: item[0], reverse=True)
+    result = [payload for _, payload in scored_payloads[: search_request.top_k]]
+    print(f"✅ Fallback retornó {len(result)} propiedades después de filtrar")
+    return result
+
+# --- Property Snapshot Store ---
+# La colección es chica y cambia poco: mantenemos en memoria una copia versionada de
+# todos los payloads para que los endpoints de lectura no hagan un round trip a Qdrant.
+
+SNAPSHOT_PAGE_SIZE = 1000
+SNAPSHOT_RETRIEVE_CHUNK = 256
+SNAPSHOT_RETRY_SECONDS = 10
+
+def _point_id_sort_key(point_id):
+    # Qdrant ordena el scroll por id: primero los enteros, después los UUID
+    if isinstance(point_id, int):
+        return (0, point_id, "")
+    return (1, 0, str(point_id))
+
+def _payload_hash(payload: dict) -> int:
+    raw = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "big")
+
+
+class PropertySnapshot:
+    """Vista inmutable de los payloads de la colección en una versión dada."""
+
+    def __init__(self, version: int, records: dict, fingerprints: dict, hashes: dict, loaded_at: float):
+        self.version = version
+        self.records = records              # point_id -> payload
+        self.fingerprints = fingerprints    # point_id -> valor del campo de cambio
+        self.hashes = hashes                # point_id -> hash del payload
+        self.loaded_at = loaded_at
+        self.point_ids = sorted(records, key=_point_id_sort_key)
+        self.sort_keys = [_point_id_sort_key(point_id) for point_id in self.point_ids]  # para bisect (py3.9)
+        digest = 0
+        for value in hashes.values():
+            digest ^= value
+        self.digest = f"{len(records):x}-{digest:016x}"
+        self._derived = {}
+        self._derived_lock = threading.RLock()  # un índice derivado puede depender de otro
+
+    def __len__(self):
+        return len(self.point_ids)
+
+    def payloads(self) -> list:
+        return [self.records[point_id] for point_id in self.point_ids]
+
+    def derived(self, name: str, builder):
+        """Devuelve un índice derivado (espacial, texto, etc.), construido una sola vez por versión."""
+        value = self._derived.get(name)
+        if value is not None:
+            return value
+        with self._derived_lock:
+            if name not in self._derived:
+                self._derived[name] = builder(self)
+            return self._derived[name]
+
+    def peek(self, name: str):
+        """El índice derivado si ya está construido; None si no (nunca lo construye)."""
+        return self._derived.get(name)
+
+
+class PropertySnapshotStore:
+    """Carga la colección al inicio y la mantiene fresca con refrescos incrementales."""
+
+    def __init__(self):
+        self._snapshot = None
+        self._load_lock = threading.Lock()
+        self._next_version = 1
+        self.last_full_load_at = None
+        self.last_refresh_at = None
+        self.last_attempt_at = None
+        self.last_error = None
+        self.geo_synced = 0
+        self.geo_sync_disabled = False
+
+    @property
+    def current(self):
+        return self._snapshot
+
+    def is_ready(self) -> bool:
+        return self._snapshot is not None
+
+    def ensure_loaded(self):
+        """Devuelve el snapshot actual, intentando cargarlo si todavía no existe."""
+        if self._snapshot is not None:
+            return self._snapshot
+        if self.last_attempt_at and time.time() - self.last_attempt_at < SNAPSHOT_RETRY_SECONDS:
+            return None
+        try:
+            self.load_full()
+        except Exception as e:
+            print(f"⚠️ Snapshot load failed: {e}")
+        return self._snapshot
+
+    def _scroll_all(self, with_payload):
+        offset = None
+        while True:
+            records, offset = qdrant_cli.scroll(
+                collection_name=settings["collection_name"],
+                limit=SNAPSHOT_PAGE_SIZE,
+                offset=offset,
+                with_payload=with_payload,
+                with_vectors=False,
+            )
+            for record in records:
+                yield record
+            if offset is None:
+                break
+
+    def _publish(self, records: dict, fingerprints: dict, hashes: dict):
+        previous = self._snapshot
+        if previous is not None and previous.hashes == hashes:
+            return previous
+        snapshot = PropertySnapshot(self._next_version, records, fingerprints, hashes, time.time())
+        self._next_version += 1
+        self._snapshot = snapshot
+        for name, builder in SNAPSHOT_INDEX_BUILDERS.items():
+            try:
+                snapshot.derived(name, builder)
+            except Exception as e:
+                print(f"⚠️ Could not build snapshot index '{name}': {e}")
+        return snapshot
+
+    def load_full(self):
+        """Recarga la colección completa y publica una nueva versión si cambió algo."""
+        with self._load_lock:
+            self.last_attempt_at = time.time()
+            change_field = settings.get("snapshot_change_field")
+            started = time.perf_counter()
+            try:
+                records, fingerprints, hashes = {}, {}, {}
+                for record in self._scroll_all(with_payload=True):
+                    records[record.id] = record.payload or {}
+                self._sync_geo_fields(records, list(records))
+                for point_id, payload in records.items():
+                    fingerprints[point_id] = payload.get(change_field) if change_field else None
+                    hashes[point_id] = _payload_hash(payload)
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            snapshot = self._publish(records, fingerprints, hashes)
+            self.last_full_load_at = self.last_refresh_at = time.time()
+            self.last_error = None
+            print(f"✅ Snapshot v{snapshot.version}: {len(snapshot)} properties loaded in {(time.perf_counter() - started) * 1000:.0f} ms")
+            return snapshot
+
+    def refresh(self):
+        """Refresco incremental: trae solo los puntos nuevos o modificados y descarta los borrados.
+
+        Se compara el conjunto de ids y el valor de SNAPSHOT_CHANGE_FIELD; los cambios que no tocan
+        ese campo se levantan en la recarga completa periódica (SNAPSHOT_FULL_REFRESH_SECONDS).
+        """
+        current = self._snapshot
+        full_every = settings.get("snapshot_full_refresh_seconds") or 0
+        if current is None or (full_every and time.time() - (self.last_full_load_at or 0) >= full_every):
+            return self.load_full()
+
+        with self._load_lock:
+            self.last_attempt_at = time.time()
+            change_field = settings.get("snapshot_change_field")
+            try:
+                seen = {}
+                for record in self._scroll_all(with_payload=[change_field] if change_field else False):
+                    seen[record.id] = (record.payload or {}).get(change_field) if change_field else None
+
+                stale = [
+                    point_id for point_id, fingerprint in seen.items()
+                    if point_id not in current.records or fingerprint != current.fingerprints.get(point_id)
+                ]
+                removed = [point_id for point_id in current.records if point_id not in seen]
+                if not stale and not removed:
+                    self.last_refresh_at = time.time()
+                    self.last_error = None
+                    return current
+
+                records = dict(current.records)
+                fingerprints = dict(current.fingerprints)
+                hashes = dict(current.hashes)
+                for point_id in removed:
+                    records.pop(point_id, None)
+                    fingerprints.pop(point_id, None)
+                    hashes.pop(point_id, None)
+                for i in range(0, len(stale), SNAPSHOT_RETRIEVE_CHUNK):
+                    fetched = qdrant_cli.retrieve(
+                        collection_name=settings["collection_name"],
+                        ids=stale[i : i + SNAPSHOT_RETRIEVE_CHUNK],
+                        with_payload=True,
+                        with_vectors=False,
+                    )
+                    for record in fetched:
+                        records[record.id] = record.payload or {}
+                        fingerprints[record.id] = seen.get(record.id)
+                fetched_ids = [point_id for point_id in stale if point_id in fingerprints]
+                self._sync_geo_fields(records, fetched_ids)
+                for point_id in fetched_ids:
+                    hashes[point_id] = _payload_hash(records[point_id])
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            snapshot = self._publish(records, fingerprints, hashes)
+            self.last_refresh_at = time.time()
+            self.last_error = None
+            print(f"🔄 Snapshot v{snapshot.version}: {len(stale)} updated, {len(removed)} removed")
+            return snapshot
+
+    def _sync_geo_fields(self, records: dict, point_ids: list):
+        """Escribe en Qdrant el campo geo de los puntos recién leídos que no lo tienen al día.
+
+        Reemplaza correr backfill_geo_payload.py después de cada ingesta. Si Qdrant rechaza la
+        escritura (por ejemplo, una API key de solo lectura) se desactiva hasta reiniciar.
+        """
+        if not settings.get("geo_payload_sync") or self.geo_sync_disabled:
+            return
+        geo_field = settings.get("geo_field") or "geo"
+        updates = {}
+        for point_id in point_ids:
+            payload = records[point_id]
+            geo = _geo_payload_value(payload)
+            if geo is not None and payload.get(geo_field) != geo:
+                updates[point_id] = geo
+        if not updates:
+            return
+        items = list(updates.items())
+        try:
+            for i in range(0, len(items), SNAPSHOT_RETRIEVE_CHUNK):
+                qdrant_cli.batch_update_points(
+                    collection_name=settings["collection_name"],
+                    update_operations=[
+                        models.SetPayloadOperation(set_payload=models.SetPayload(payload={geo_field: geo}, points=[point_id]))
+                        for point_id, geo in items[i : i + SNAPSHOT_RETRIEVE_CHUNK]
+                    ],
+                    wait=False,
+                )
+        except Exception as e:
+            self.geo_sync_disabled = True
+            print(f"⚠️ Could not write '{geo_field}' payloads, geo sync disabled: {e}")
+            return
+        # Mismo payload que quedó en Qdrant, así el hash coincide en la próxima recarga completa
+        for point_id, geo in updates.items():
+            records[point_id] = {**records[point_id], geo_field: geo}
+        self.geo_synced += len(updates)
+        print(f"📍 Campo '{geo_field}' escrito en {len(updates)} puntos")
+
+    def status(self) -> dict:
+        snapshot = self._snapshot
+        now = time.time()
+        return {
+            "ready": snapshot is not None,
+            "version": snapshot.version if snapshot else None,
+            "digest": snapshot.digest if snapshot else None,
+            "properties": len(snapshot) if snapshot else 0,
+            "age_seconds": round(now - snapshot.loaded_at, 1) if snapshot else None,
+            "last_refresh_seconds_ago": round(now - self.last_refresh_at, 1) if self.last_refresh_at else None,
+            "last_full_load_seconds_ago": round(now - self.last_full_load_at, 1) if self.last_full_load_at else None,
+            "last_error": self.last_error,
+            "geo_synced": self.geo_synced,
+            "geo_sync_disabled": self.geo_sync_disabled,
+        }
+
+
+# Índices derivados que se construyen en segundo plano cada vez que se publica una versión nueva
+SNAPSHOT_INDEX_BUILDERS = {}
+
+property_snapshot = PropertySnapshotStore()
+
+PROPERTY_ID_FIELDS = ("id", "property_id", "uuid")
+
+POINT_ID_MAX = 2 ** 64  # Qdrant: ids de punto enteros u64
+PAYLOAD_INT_MAX = 2 ** 63  # Qdrant: enteros de payload i64
+
+def _parse_numeric_id(property_id: str):
+    """Entero si `property_id` es su forma canónica ("42", no "042", "²" ni "٤٢") y entra en u64; si no, None."""
+    if not (property_id.isascii() and property_id.isdigit()):
+        return None
+    if len(property_id) > 1 and property_id[0] == "0":
+        return None
+    number = int(property_id)
+    return number if number < POINT_ID_MAX else None
+
+def _as_point_id(property_id: str):
+    """El id de punto de Qdrant si `property_id` tiene ese formato (entero sin signo o UUID); si no, None."""
+    number = _parse_numeric_id(property_id)
+    if number is not None:
+        return number
+    try:
+        return str(uuid.UUID(property_id))
+    except ValueError:
+        return None
+
+
+class PropertyAliasIndex:
+    """Todos los identificadores de cada propiedad (id, property_id, uuid y el id de punto) -> id de punto."""
+
+    def __init__(self, snapshot: PropertySnapshot):
+        self.aliases = {}
+        # El orden de PROPERTY_ID_FIELDS define la prioridad si dos propiedades comparten un valor
+        for field in PROPERTY_ID_FIELDS:
+            for point_id in snapshot.point_ids:
+                value = snapshot.records[point_id].get(field)
+                if value is not None:
+                    self.aliases.setdefault(str(value), point_id)
+        for point_id in snapshot.point_ids:
+            self.aliases.setdefault(str(point_id), point_id)
+
+    def resolve(self, property_id: str):
+        return self.aliases.get(property_id)
+
+SNAPSHOT_INDEX_BUILDERS["aliases"] = PropertyAliasIndex
+
+def _find_properties_in_qdrant(property_ids: list) -> dict:
+    """Busca en Qdrant varias propiedades por cualquiera de sus ids en un único scroll: {id pedido: record}.
+
+    Los errores de Qdrant se propagan: un fallo no tiene que confundirse con "no existe".
+    """
+    property_ids = list(dict.fromkeys(property_ids))
+    if not property_ids:
+        return {}
+    numbers = [
+        number for number in map(_parse_numeric_id, property_ids)
+        if number is not None and number < PAYLOAD_INT_MAX
+    ]
+    point_ids = [point_id for point_id in map(_as_point_id, property_ids) if point_id is not None]
+    conditions = []
+    for field in PROPERTY_ID_FIELDS:
+        conditions.append(models.FieldCondition(key=field, match=models.MatchAny(any=property_ids)))
+        if numbers:
+            conditions.append(models.FieldCondition(key=field, match=models.MatchAny(any=numbers)))
+    if point_ids:
+        conditions.append(models.HasIdCondition(has_id=point_ids))
+    records, _ = qdrant_cli.scroll(
+        collection_name=settings["collection_name"],
+        limit=len(property_ids) * (len(PROPERTY_ID_FIELDS) + 1),
+        with_payload=True,
+        with_vectors=False,
+        scroll_filter=models.Filter(should=conditions),
+    )
+    # Misma prioridad que el índice de alias: primero por campo, después por id de punto
+    aliases = {}
+    for field in PROPERTY_ID_FIELDS:
+        for record in records:
+            value = (record.payload or {}).get(field)
+            if value is not None:
+                aliases.setdefault(str(value), record)
+    for record in records:
+        aliases.setdefault(str(record.id), record)
+    found = {}
+    for property_id in property_ids:
+        record = aliases.get(property_id) or aliases.get(str(_as_point_id(property_id)))
+        if record is not None:
+            found[property_id] = record
+    return found
+
+def _lookup_property_payloads(property_ids: list) -> tuple:
+    """Resuelve varias propiedades por cualquiera de sus ids: (payloads en el orden pedido, snapshot).
+
+    Las que están en el índice de alias del snapshot salen de memoria; el resto, de un único scroll a Qdrant.
+    El snapshot se devuelve solo si todas las encontradas salieron de él (su digest sirve de ETag);
+    es None si alguna vino de Qdrant y todavía no está en el snapshot.
+    """
+    snapshot = property_snapshot.ensure_loaded()
+    aliases = snapshot.derived("aliases", PropertyAliasIndex) if snapshot is not None else None
+    found = {}
+    for property_id in property_ids:
+        point_id = aliases.resolve(property_id) if aliases is not None else None
+        if point_id is not None:
+            found[property_id] = snapshot.records[point_id]
+    missing = [property_id for property_id in property_ids if property_id not in found]
+    from_qdrant = _find_properties_in_qdrant(missing)
+    for property_id, record in from_qdrant.items():
+        found[property_id] = record.payload
+    return [found.get(property_id) for property_id in property_ids], (snapshot if not from_qdrant else None)
+
+def _get_property_payloads(property_ids: list) -> list:
+    """Resuelve varias propiedades por cualquiera de sus ids, en el orden pedido (None si no existe)."""
+    return _lookup_property_payloads(property_ids)[0]
+
+def _get_property_payload(property_id: str):
+    """Resuelve una propiedad por cualquiera de sus ids (ver _get_property_payloads)."""
+    return _get_property_payloads([property_id])[0]
+
+# Paginado por cursor de /properties/all: el cursor es el id del primer punto de la página siguiente,
+# igual que el next_page_offset del scroll de Qdrant, así que vale tanto con snapshot como sin él.
+PROPERTIES_PAGE_SIZE = 1000
+
+def _encode_cursor(point_id) -> str:
+    return base64.urlsafe_b64encode(json.dumps(point_id).encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str):
+    """Id de punto dentro de un cursor; ValueError si el cursor no es válido."""
+    try:
+        point_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8"))
+    except Exception:
+        raise ValueError("invalid cursor")
+    if isinstance(point_id, bool) or not isinstance(point_id, (int, str)):
+        raise ValueError("invalid cursor")
+    return point_id
+
+def _property_page(offset, limit: int, snapshot: PropertySnapshot = None) -> tuple:
+    """Una página de payloads desde `offset` (id de punto, None = inicio): (payloads, offset siguiente o None)."""
+    if snapshot is not None:
+        start = bisect.bisect_left(snapshot.sort_keys, _point_id_sort_key(offset)) if offset is not None else 0
+        point_ids = snapshot.point_ids[start:start + limit]
+        next_offset = snapshot.point_ids[start + limit] if start + limit < len(snapshot.point_ids) else None
+        return [snapshot.records[point_id] for point_id in point_ids], next_offset
+    records, next_offset = qdrant_cli.scroll(
+        collection_name=settings["collection_name"],
+        limit=limit,
+        offset=offset,
+        with_payload=True,
+        with_vectors=False,
+    )
+    return [record.payload for record in records], next_offset
+
+def _iter_property_pages(snapshot, page_size: int = PROPERTIES_PAGE_SIZE):
+    """Recorre toda la colección página por página: la versión del snapshot recibida, o Qdrant si es None."""
+    offset = None
+    while True:
+        payloads, offset = _property_page(offset, page_size, snapshot)
+        yield payloads
+        if offset is None:
+            break
+
+# --- Query Embedding Cache ---
+# El chatbot y el agente repiten constantemente las mismas consultas ("2 ambientes en La Perla"):
+# cacheamos los embeddings en un LRU en memoria respaldado por SQLite en disco.
+
+def _normalise_query(query: str) -> str:
+    """Forma canónica de una consulta para usar como clave de cache."""
+    return " ".join(unicodedata.normalize("NFC", query or "").lower().split())
+
+
+class EmbeddingCache:
+    """Cache de embeddings de dos niveles: LRU en memoria + SQLite persistente.
+
+    Cada nivel tiene su propio lock: una escritura lenta en disco no bloquea los hits en memoria.
+    """
+
+    def __init__(self, max_entries: int = 2048, path: str = None):
+        self.max_entries = max_entries
+        self.path = path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()      # LRU en memoria y contadores
+        self._db_lock = threading.Lock()   # conexión SQLite
+        self._db = None
+        self._db_failed = False
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def configure(self, max_entries: int, path: str):
+        with self._lock, self._db_lock:
+            self.max_entries = max_entries
+            self.path = path
+            self._db = None
+            self._db_failed = False
+
+    def _connection(self):
+        if self._db is not None or self._db_failed or not self.path:
+            return self._db
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, query TEXT NOT NULL, vector BLOB NOT NULL,"
+                " created_at REAL NOT NULL, PRIMARY KEY (model, query))"
+            )
+            db.commit()
+            self._db = db
+        except Exception as e:
+            # Sin disco seguimos solo con la capa en memoria
+            print(f"⚠️ Embedding cache on disk disabled ({self.path}): {e}")
+            self._db_failed = True
+        return self._db
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def peek(self, model: str, query: str):
+        """Solo la capa en memoria: nunca toca el disco, se puede llamar desde el event loop."""
+        key = (model, _normalise_query(query))
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return vector
+
+    def get(self, model: str, query: str):
+        vector = self.peek(model, query)
+        if vector is not None:
+            return vector
+        key = (model, _normalise_query(query))
+        row = None
+        with self._db_lock:
+            db = self._connection()
+            if db is not None:
+                try:
+                    row = db.execute(
+                        "SELECT vector FROM embeddings WHERE model = ? AND query = ?", key
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    print(f"⚠️ Embedding cache read failed: {e}")
+        with self._lock:
+            if row:
+                vector = array("f", row[0]).tolist()
+                self._remember(key, vector)
+                self.disk_hits += 1
+                return vector
+            self.misses += 1
+            return None
+
+    def put(self, model: str, query: str, vector: list):
+        key = (model, _normalise_query(query))
+        with self._lock:
+            self._remember(key, vector)
+        with self._db_lock:
+            db = self._connection()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO embeddings (model, query, vector, created_at) VALUES (?, ?, ?, ?)",
+                    (key[0], key[1], array("f", vector).tobytes(), time.time()),
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ Embedding cache write failed: {e}")
+
+    def stats(self) -> dict:
+        disk_entries = None
+        with self._db_lock:
+            db = self._connection()
+            if db is not None:
+                try:
+                    disk_entries = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                except sqlite3.Error:
+                    pass
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "lookups": lookups,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else None,
+                "memory_entries": len(self._memory),
+                "memory_capacity": self.max_entries,
+                "disk_entries": disk_entries,
+                "disk_path": self.path,
+            }
+
+
+embedding_cache = EmbeddingCache()
+
+# --- Embedding Providers ---
+# Los vectores de una colección tienen que venir siempre del mismo modelo, así que el backend se
+# elige por colección: OpenAI (default) o un encoder ONNX local en CPU, sin round trip de red.
+
+class EmbeddingProvider:
+    """Backend de embeddings: parte los textos en lotes y los ejecuta en su propio pool de threads."""
+
+    name = "base"
+
+    def __init__(self, model: str, batch_size: int = 64, threads: int = 4):
+        self.model = model
+        self.batch_size = max(int(batch_size or 1), 1)
+        self.threads = max(int(threads or 1), 1)
+        self.dimension = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.texts = 0
+        self.total_ms = 0.0
+
+    @property
+    def cache_key(self) -> str:
+        """Clave de modelo para EmbeddingCache: backends distintos no comparten vectores."""
+        return self.model
+
+    def _embed_batch(self, texts: list) -> list:
+        raise NotImplementedError
+
+    def _batches(self, texts: list) -> list:
+        return [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix=f"embed-{self.name}")
+            return self._executor
+
+    def _record(self, texts: int, started: float):
+        with self._lock:
+            self.requests += 1
+            self.texts += texts
+            self.total_ms += (time.perf_counter() - started) * 1000
+
+    def warmup(self):
+        """Carga perezosa del backend (no-op para los remotos)."""
+
+    def embed(self, texts: list) -> list:
+        """Embeddings de `texts` en el thread actual, lote por lote."""
+        started = time.perf_counter()
+        vectors = [vector for batch in self._batches(texts) for vector in self._embed_batch(batch)]
+        self._record(len(texts), started)
+        return vectors
+
+    async def embed_async(self, texts: list) -> list:
+        """Como embed, pero con los lotes repartidos en paralelo en el pool del backend."""
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        pool = self._pool()
+        results = await asyncio.gather(*(loop.run_in_executor(pool, self._embed_batch, batch) for batch in self._batches(texts)))
+        self._record(len(texts), started)
+        return [vector for batch in results for vector in batch]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "model": self.model,
+                "dimension": self.dimension,
+                "batch_size": self.batch_size,
+                "threads": self.threads,
+                "requests": self.requests,
+                "texts": self.texts,
+                "avg_ms": round(self.total_ms / self.requests, 2) if self.requests else None,
+            }
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Embeddings con la API de OpenAI (usa los clientes globales openai_cli / async_openai_cli)."""
+
+    name = "openai"
+
+    def _vectors(self, response) -> list:
+        vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        if vectors:
+            self.dimension = len(vectors[0])
+        return vectors
+
+    def _embed_batch(self, texts: list) -> list:
+        return self._vectors(openai_cli.embeddings.create(input=texts, model=self.model))
+
+    async def embed_async(self, texts: list) -> list:
+        if async_openai_cli is None:
+            return await super().embed_async(texts)
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(
+            async_openai_cli.embeddings.create(input=batch, model=self.model) for batch in self._batches(texts)
+        ))
+        self._record(len(texts), started)
+        return [vector for response in responses for vector in self._vectors(response)]
+
+
+class OnnxEmbeddingProvider(EmbeddingProvider):
+    """Sentence encoder local en CPU exportado a ONNX (idealmente cuantizado a int8).
+
+    `model_dir` tiene que contener `model.onnx` (o `model_quantized.onnx`) y el `tokenizer.json`
+    de Hugging Face. Los embeddings salen del mean pooling de la última capa, normalizados a L2.
+    onnxruntime y tokenizers solo se importan si alguna colección usa este backend.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_dir: str, batch_size: int = 64, threads: int = 4, max_length: int = 128, query_prefix: str = ""):
+        if not model_dir:
+            raise ValueError("ONNX_MODEL_DIR is not set for the onnx embedding backend")
+        super().__init__(f"onnx:{os.path.basename(os.path.normpath(model_dir))}", batch_size, threads)
+        self.model_dir = model_dir
+        self.model_path = self._model_path(model_dir)
+        self.max_length = max_length
+        self.query_prefix = query_prefix or ""
+        self._cache_key = self._build_cache_key()
+        self._session = None
+        self._tokenizer = None
+        self._input_names = ()
+        self._load_lock = threading.Lock()
+
+    @staticmethod
+    def _model_path(model_dir: str) -> str:
+        model_path = os.path.join(model_dir, "model_quantized.onnx")
+        if not os.path.exists(model_path):
+            model_path = os.path.join(model_dir, "model.onnx")
+        return os.path.abspath(model_path)
+
+    def _build_cache_key(self) -> str:
+        # Otro archivo de modelo (aunque el directorio se llame igual), otro prefijo u otro max_length
+        # dan otros vectores: entran en la clave, junto con tamaño y mtime por si se reemplaza el archivo
+        try:
+            stat = os.stat(self.model_path)
+            file_signature = [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            file_signature = None
+        fingerprint = json.dumps([self.model_path, file_signature, self.query_prefix, self.max_length])
+        return f"{self.model}:{hashlib.sha1(fingerprint.encode()).hexdigest()[:16]}"
+
+    @property
+    def cache_key(self) -> str:
+        return self._cache_key
+
+    def _load(self):
+        with self._load_lock:
+            if self._session is not None:
+                return
+            import onnxruntime
+            from tokenizers import Tokenizer
+
+            model_path = self.model_path
+            tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+            tokenizer.enable_truncation(max_length=self.max_length)
+            if tokenizer.padding is None:
+                pad_token = next((token for token in ("<pad>", "[PAD]") if tokenizer.token_to_id(token) is not None), "[PAD]")
+                tokenizer.enable_padding(pad_id=tokenizer.token_to_id(pad_token) or 0, pad_token=pad_token)
+
+            # El paralelismo viene del pool (un lote por thread); cada sesión usa un solo thread
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = 1
+            options.inter_op_num_threads = 1
+            session = onnxruntime.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+            self._input_names = tuple(item.name for item in session.get_inputs())
+            self._tokenizer = tokenizer
+            self._session = session
+            print(f"✅ ONNX embedding model loaded: {model_path}")
+
+    def warmup(self):
+        self.embed(["warmup"])
+
+    def _embed_batch(self, texts: list) -> list:
+        if self._session is None:
+            self._load()
+        encodings = self._tokenizer.encode_batch([self.query_prefix + text for text in texts])
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+        output = self._session.run(None, {name: value for name, value in feed.items() if name in self._input_names})[0]
+        if output.ndim == 3:
+            # Mean pooling sobre los tokens reales (sin padding)
+            mask = attention_mask[:, :, None].astype(np.float32)
+            output = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        norms = np.linalg.norm(output, axis=1, keepdims=True)
+        output = (output / np.maximum(norms, 1e-12)).astype(np.float32)
+        self.dimension = int(output.shape[1])
+        return output.tolist()
+
+
+_embedding_providers = {}
+_embedding_providers_lock = threading.Lock()
+
+def _create_embedding_provider(backend: str) -> EmbeddingProvider:
+    batch_size = settings.get("embedding_batch_size", 64)
+    threads = settings.get("embedding_threads", 4)
+    if backend == "openai":
+        return OpenAIEmbeddingProvider(settings.get("embedding_model") or "text-embedding-3-small", batch_size, threads)
+    if backend == "onnx":
+        return OnnxEmbeddingProvider(
+            settings.get("onnx_model_dir"),
+            batch_size,
+            threads,
+            max_length=settings.get("onnx_max_length", 128),
+            query_prefix=settings.get("embedding_query_prefix", ""),
+        )
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+def _embedding_backend_for(collection_name: str = None) -> str:
+    collection_name = collection_name or settings.get("collection_name")
+    overrides = settings.get("embedding_backend_by_collection") or {}
+    return overrides.get(collection_name) or settings.get("embedding_backend") or "openai"
+
+def _embeddings_available() -> bool:
+    """La pata vectorial necesita un backend: el local siempre está, OpenAI solo con API key."""
+    return _embedding_backend_for() != "openai" or bool(settings.get("openai_api_key"))
+
+def get_embedding_provider(collection_name: str = None) -> EmbeddingProvider:
+    """Backend de embeddings configurado para la colección (por default, la del servicio)."""
+    backend = _embedding_backend_for(collection_name)
+    with _embedding_providers_lock:
+        provider = _embedding_providers.get(backend)
+        if provider is None:
+            provider = _create_embedding_provider(backend)
+            _embedding_providers[backend] = provider
+        return provider
+
+def _warm_up_embedding_provider(collection_info=None):
+    """Carga el backend de la colección y avisa si su dimensión no coincide con la de los vectores."""
+    provider = get_embedding_provider()
+    provider.warmup()
+    vectors_config = getattr(getattr(getattr(collection_info, "config", None), "params", None), "vectors", None)
+    expected = getattr(vectors_config, "size", None)
+    if provider.dimension and expected and provider.dimension != expected:
+        print(f"⚠️ Embedding backend '{provider.name}' produces {provider.dimension}-d vectors "
+              f"but collection '{settings['collection_name']}' expects {expected}")
+    print(f"✅ Embedding backend: {provider.name} ({provider.model})")
+
+def _get_query_embedding(query: str) -> list:
+    """Embedding de la consulta, desde la cache o generado con el backend de la colección."""
+    provider = get_embedding_provider()
+    vector = embedding_cache.get(provider.cache_key, query)
+    if vector is not None:
+        print("✅ Embedding obtenido de la cache")
+        return vector
+
+    print(f"🔍 Generando embedding con {provider.name}...")
+    vector = provider.embed([query])[0]
+    embedding_cache.put(provider.cache_key, query, vector)
+    return vector
+
+async def _get_query_embedding_async(query: str) -> list:
+    """Versión async de _get_query_embedding para /search."""
+    return (await _get_query_embeddings_async([query]))[0]
+
+async def _get_query_embeddings_async(queries: list) -> list:
+    """Embeddings de varias consultas: las que no están en cache se generan juntas, en lotes."""
+    provider = get_embedding_provider()
+    # La capa en memoria se consulta en el loop; la de disco (SQLite) en un thread
+    vectors = [embedding_cache.peek(provider.cache_key, query) for query in queries]
+    if any(vector is None for vector in vectors):
+        vectors = await asyncio.to_thread(
+            lambda: [vector if vector is not None else embedding_cache.get(provider.cache_key, query)
+                     for query, vector in zip(queries, vectors)]
+        )
+    missing = list(dict.fromkeys(query for query, vector in zip(queries, vectors) if vector is None))
+    if not missing:
+        print(f"✅ {len(queries)} embedding(s) obtenidos de la cache")
+        return vectors
+
+    print(f"🔍 Generando {len(missing)} embedding(s) con {provider.name}...")
+    generated = dict(zip(missing, await provider.embed_async(missing)))
+
+    def store():
+        for query, vector in generated.items():
+            embedding_cache.put(provider.cache_key, query, vector)
+    await asyncio.to_thread(store)
+    return [vector if vector is not None else generated[query] for query, vector in zip(queries, vectors)]
+
+# --- Search Result Cache ---
+
+class SearchResultCache:
+    """Cache LRU con TTL de respuestas de /search, atada a la versión de la colección.
+
+    Cada entrada guarda la versión del snapshot con la que se calculó; cuando la colección
+    cambia, las entradas viejas dejan de servirse aunque no haya vencido el TTL.
+    """
+
+    def __init__(self, ttl_seconds: int = 300, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidated = 0
+
+    def configure(self, ttl_seconds: int, max_entries: int):
+        with self._lock:
+            self.ttl_seconds = ttl_seconds
+            self.max_entries = max_entries
+            self._entries.clear()
+
+    @staticmethod
+    def make_key(search_request, tenant_id) -> str:
+        return json.dumps(
+            [
+                _normalise_query(search_request.query),
+                search_request.filters or {},
+                search_request.top_k,
+                str(tenant_id) if tenant_id else None,
+            ],
+            sort_keys=True,
+            default=str,
+        )
+
+    def get(self, key: str, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry_version, expires_at, value = entry
+            if entry_version != version:
+                self.invalidated += 1
+            elif expires_at < time.time():
+                self.expired += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, version, value):
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, time.time() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "lookups": lookups,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "invalidated_by_version": self.invalidated,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "entries": len(self._entries),
+                "capacity": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+search_result_cache = SearchResultCache()
+
+def _collection_version():
+    """Versión actual de la colección según el snapshot (None si no está cargado)."""
+    snapshot = property_snapshot.current
+    return snapshot.version if snapshot is not None else None
+
+# --- Spatial Index ---
+
+class PointRTree:
+    """R-tree estático sobre puntos (lng, lat), empaquetado con Sort-Tile-Recursive.
+
+    Se construye una vez por versión del snapshot; una consulta por bbox recorre solo los
+    nodos que intersectan el rectángulo, O(log n + k).
+    """
+
+    NODE_CAPACITY = 16
+
+    def __init__(self, entries: list):
+        # entries: [(lng, lat, item), ...]
+        self.size = len(entries)
+        nodes = [self._leaf(chunk) for chunk in self._str_pack(entries, key_x=lambda e: e[0], key_y=lambda e: e[1])]
+        while len(nodes) > 1:
+            nodes = [
+                self._branch(chunk)
+                for chunk in self._str_pack(
+                    nodes,
+                    key_x=lambda n: (n[0] + n[2]) / 2,
+                    key_y=lambda n: (n[1] + n[3]) / 2,
+                )
+            ]
+        self.root = nodes[0] if nodes else None
+
+    def _str_pack(self, items: list, key_x, key_y) -> list:
+        capacity = self.NODE_CAPACITY
+        if len(items) <= capacity:
+            return [items] if items else []
+        leaf_count = -(-len(items) // capacity)
+        slice_count = max(1, int(leaf_count ** 0.5 + 0.999999))
+        slice_size = slice_count * capacity
+        chunks = []
+        by_x = sorted(items, key=key_x)
+        for i in range(0, len(by_x), slice_size):
+            vertical_slice = sorted(by_x[i : i + slice_size], key=key_y)
+            for j in range(0, len(vertical_slice), capacity):
+                chunks.append(vertical_slice[j : j + capacity])
+        return chunks
+
+    @staticmethod
+    def _leaf(entries: list):
+        xs = [e[0] for e in entries]
+        ys = [e[1] for e in entries]
+        return (min(xs), min(ys), max(xs), max(ys), True, entries)
+
+    @staticmethod
+    def _branch(children: list):
+        return (
+            min(c[0] for c in children),
+            min(c[1] for c in children),
+            max(c[2] for c in children),
+            max(c[3] for c in children),
+            False,
+            children,
+        )
+
+    def query(self, minx: float, miny: float, maxx: float, maxy: float) -> list:
+        """Devuelve los items cuyo punto cae dentro del bbox (bordes incluidos)."""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            nminx, nminy, nmaxx, nmaxy, is_leaf, children = stack.pop()
+            if nmaxx < minx or nminx > maxx or nmaxy < miny or nminy > maxy:
+                continue
+            if is_leaf:
+                if minx <= nminx and nmaxx <= maxx and miny <= nminy and nmaxy <= maxy:
+                    found.extend(e[2] for e in children)
+                else:
+                    found.extend(e[2] for e in children if minx <= e[0] <= maxx and miny <= e[1] <= maxy)
+            else:
+                stack.extend(children)
+        return found
+
+
+class SpatialIndex:
+    """Coordenadas normalizadas de cada propiedad del snapshot más su R-tree."""
+
+    def __init__(self, snapshot: PropertySnapshot):
+        self.coords = {}  # point_id -> (lat, lng)
+        self.order = {}   # point_id -> posición en el snapshot (orden estable de respuesta)
+        entries = []
+        for position, point_id in enumerate(snapshot.point_ids):
+            lat, lng = _extract_property_coords(snapshot.records[point_id])
+            if lat is None:
+                continue
+            self.coords[point_id] = (lat, lng)
+            self.order[point_id] = position
+            entries.append((lng, lat, point_id))
+        self.tree = PointRTree(entries)
+        print(f"🗺️ Spatial index v{snapshot.version}: {len(entries)}/{len(snapshot)} properties with coordinates")
+
+    def query_bbox(self, minx: float, miny: float, maxx: float, maxy: float) -> list:
+        """Point ids dentro del bbox (minLon, minLat, maxLon, maxLat), en orden del snapshot."""
+        point_ids = self.tree.query(minx, miny, maxx, maxy)
+        point_ids.sort(key=self.order.__getitem__)
+        return point_ids
+
+SNAPSHOT_INDEX_BUILDERS["spatial"] = SpatialIndex
+
+# --- Map Clustering ---
+# Clusters jerárquicos por nivel de zoom al estilo supercluster: se agrupan los puntos del nivel
+# z+1 que quedan a menos de CLUSTER_RADIUS_PX píxeles en el zoom z, desde CLUSTER_MAX_ZOOM hasta 0.
+
+CLUSTER_RADIUS_PX = 60
+CLUSTER_TILE_EXTENT = 512
+THOUSANDS_PRICE_RE = re.compile(r"\d{1,3}(\.\d{3})+(,\d+)?")
+
+def _extract_price(value) -> float:
+    """Precio numérico de un payload ("USD 120.000", "120000", 120000.0); None si no se puede leer."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value > 0 else None
+    digits = re.sub(r"[^\d,.]", "", str(value))
+    if not digits:
+        return None
+    if THOUSANDS_PRICE_RE.fullmatch(digits):
+        digits = digits.replace(".", "").replace(",", ".")
+    else:
+        digits = digits.replace(",", "")
+    try:
+        price = float(digits)
+    except ValueError:
+        return None
+    return price if price > 0 else None
+
+def _lng_to_x(lng: float) -> float:
+    return lng / 360.0 + 0.5
+
+# Límite de Web Mercator: en ±90° la proyección diverge (log(0) / división por cero)
+MERCATOR_MAX_LAT = 85.05112878
+
+def _lat_to_y(lat: float) -> float:
+    lat = min(max(lat, -MERCATOR_MAX_LAT), MERCATOR_MAX_LAT)
+    sin = math.sin(lat * math.pi / 180.0)
+    y = 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi
+    return min(max(y, 0.0), 1.0)
+
+def _x_to_lng(x: float) -> float:
+    return (x - 0.5) * 360.0
+
+def _y_to_lat(y: float) -> float:
+    y2 = (180.0 - y * 360.0) * math.pi / 180.0
+    return 360.0 * math.atan(math.exp(y2)) / math.pi - 90.0
+
+
+class MapCluster:
+    """Nodo de un nivel de zoom: un punto individual (count == 1) o un cluster."""
+
+    __slots__ = ("cluster_id", "x", "y", "count", "price_min", "price_max", "point_id", "zoom")
+
+    def __init__(self, cluster_id, x, y, count, price_min, price_max, point_id=None, zoom=None):
+        self.cluster_id = cluster_id
+        self.x = x
+        self.y = y
+        self.count = count
+        self.price_min = price_min
+        self.price_max = price_max
+        self.point_id = point_id
+        self.zoom = zoom
+
+    @property
+    def lng(self) -> float:
+        return _x_to_lng(self.x)
+
+    @property
+    def lat(self) -> float:
+        return _y_to_lat(self.y)
+
+
+class PropertyClusterIndex:
+    """Clusters precalculados por zoom sobre toda la colección, con un R-tree por nivel."""
+
+    def __init__(self, snapshot: PropertySnapshot, max_zoom: int = None, radius_px: int = CLUSTER_RADIUS_PX):
+        self.max_zoom = settings.get("cluster_max_zoom", 15) if max_zoom is None else max_zoom
+        spatial = snapshot.derived("spatial", SpatialIndex)
+        nodes = []
+        for point_id, (lat, lng) in spatial.coords.items():
+            price = _extract_price(snapshot.records[point_id].get("price"))
+            nodes.append(MapCluster(None, _lng_to_x(lng), _lat_to_y(lat), 1, price, price, point_id=point_id))
+        nodes.sort(key=lambda node: spatial.order[node.point_id])
+
+        self.levels = {}
+        self._next_id = 1
+        for zoom in range(self.max_zoom, -1, -1):
+            nodes = self._cluster_level(nodes, zoom, radius_px / (CLUSTER_TILE_EXTENT * (2 ** zoom)))
+            self.levels[zoom] = (nodes, PointRTree([(node.lng, node.lat, node) for node in nodes]))
+        print(f"🧩 Cluster index v{snapshot.version}: {len(spatial.coords)} points, {len(self.levels[0][0])} clusters at zoom 0")
+
+    def _cluster_level(self, nodes: list, zoom: int, radius: float) -> list:
+        grid = {}
+        for index, node in enumerate(nodes):
+            grid.setdefault((int(node.x / radius), int(node.y / radius)), []).append(index)
+
+        radius_sq = radius * radius
+        processed = [False] * len(nodes)
+        result = []
+        for index, node in enumerate(nodes):
+            if processed[index]:
+                continue
+            processed[index] = True
+            cell_x, cell_y = int(node.x / radius), int(node.y / radius)
+            neighbors = []
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for other in grid.get((cell_x + dx, cell_y + dy), ()):
+                        if processed[other]:
+                            continue
+                        candidate = nodes[other]
+                        if (candidate.x - node.x) ** 2 + (candidate.y - node.y) ** 2 <= radius_sq:
+                            processed[other] = True
+                            neighbors.append(candidate)
+            if not neighbors:
+                result.append(node)
+                continue
+
+            members = [node] + neighbors
+            count = sum(member.count for member in members)
+            prices_min = [member.price_min for member in members if member.price_min is not None]
+            prices_max = [member.price_max for member in members if member.price_max is not None]
+            result.append(MapCluster(
+                self._next_id,
+                sum(member.x * member.count for member in members) / count,
+                sum(member.y * member.count for member in members) / count,
+                count,
+                min(prices_min) if prices_min else None,
+                max(prices_max) if prices_max else None,
+                zoom=zoom,
+            ))
+            self._next_id += 1
+        return result
+
+    def query(self, minx: float, miny: float, maxx: float, maxy: float, zoom: int) -> list:
+        """Nodos del nivel `zoom` dentro del bbox; None si ese zoom ya muestra puntos individuales."""
+        zoom = max(0, int(zoom))
+        if zoom > self.max_zoom:
+            return None
+        _, tree = self.levels[zoom]
+        return tree.query(minx, miny, maxx, maxy)
+
+SNAPSHOT_INDEX_BUILDERS["clusters"] = PropertyClusterIndex
+
+def _abbreviate_count(count: int) -> str:
+    if count >= 10000:
+        return f"{round(count / 1000)}k"
+    if count >= 1000:
+        return f"{round(count / 100) / 10}k"
+    return str(count)
+
+def _cluster_feature(node: MapCluster) -> dict:
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [node.lng, node.lat]
+        },
+        "properties": {
+            "cluster": True,
+            "cluster_id": node.cluster_id,
+            "point_count": node.count,
+            "point_count_abbreviated": _abbreviate_count(node.count),
+            "price_min": node.price_min,
+            "price_max": node.price_max,
+            "expansion_zoom": node.zoom + 1,
+        }
+    }
+
+# --- Vector Tiles ---
+# /properties/tiles/{z}/{x}/{y}.mvt: los mismos pines y clusters que /properties/geojson, pero en tiles
+# fijas (cacheables por el navegador y la CDN) y codificadas en Mapbox Vector Tile (protobuf).
+# Solo hay geometrías de tipo punto, así que el encoder es mínimo y no necesita dependencias.
+
+MVT_EXTENT = 4096
+MVT_BUFFER = 64     # margen en unidades de tile para no cortar los pines en los bordes
+MVT_MAX_ZOOM = 22
+
+def _pb_varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _pb_zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+def _pb_field(field: int, wire_type: int) -> bytes:
+    return _pb_varint((field << 3) | wire_type)
+
+def _pb_bytes(field: int, data: bytes) -> bytes:
+    return _pb_field(field, 2) + _pb_varint(len(data)) + data
+
+def _pb_packed(field: int, values: list) -> bytes:
+    return _pb_bytes(field, b"".join(_pb_varint(value) for value in values))
+
+def _mvt_value(value) -> bytes:
+    """Mensaje Value de MVT: string (1), double (3), sint (6) o bool (7)."""
+    if isinstance(value, bool):
+        return _pb_field(7, 0) + _pb_varint(int(value))
+    if isinstance(value, int) and -(2 ** 63) <= value < 2 ** 63:
+        return _pb_field(6, 0) + _pb_varint(_pb_zigzag(value))
+    if isinstance(value, float):
+        return _pb_field(3, 1) + struct.pack("<d", value)
+    return _pb_bytes(1, str(value).encode("utf-8"))
+
+
+class MvtLayer:
+    """Capa de una tile MVT con features de tipo punto; las claves y valores se deduplican."""
+
+    def __init__(self, name: str, extent: int = MVT_EXTENT):
+        self.name = name
+        self.extent = extent
+        self._keys = {}
+        self._values = {}
+        self._features = []
+
+    def _index(self, table: dict, key) -> int:
+        index = table.get(key)
+        if index is None:
+            index = table[key] = len(table)
+        return index
+
+    def add_point(self, x: int, y: int, attributes: dict, feature_id: int = None):
+        tags = []
+        for key, value in attributes.items():
+            if value is None or isinstance(value, (dict, list, tuple)):
+                continue
+            tags.append(self._index(self._keys, key))
+            tags.append(self._index(self._values, (type(value).__name__, value)))
+        feature = b""
+        if feature_id is not None:
+            feature += _pb_field(1, 0) + _pb_varint(feature_id)
+        feature += _pb_packed(2, tags)
+        feature += _pb_field(3, 0) + _pb_varint(1)  # GeomType.POINT
+        feature += _pb_packed(4, [(1 & 0x7) | (1 << 3), _pb_zigzag(x), _pb_zigzag(y)])  # MoveTo(1)
+        self._features.append(feature)
+
+    def __len__(self):
+        return len(self._features)
+
+    def encode(self) -> bytes:
+        layer = _pb_field(15, 0) + _pb_varint(2) + _pb_bytes(1, self.name.encode("utf-8"))
+        layer += b"".join(_pb_bytes(2, feature) for feature in self._features)
+        layer += b"".join(_pb_bytes(3, key.encode("utf-8")) for key in self._keys)
+        layer += b"".join(_pb_bytes(4, _mvt_value(value)) for _, value in self._values)
+        layer += _pb_field(5, 0) + _pb_varint(self.extent)
+        return _pb_bytes(3, layer)
+
+
+def _tile_bbox(z: int, x: int, y: int, buffer: int = MVT_BUFFER) -> tuple:
+    """(minLon, minLat, maxLon, maxLat) de la tile, con el margen de `buffer` unidades incluido."""
+    scale = 2 ** z
+    margin = buffer / MVT_EXTENT
+    return (
+        _x_to_lng((x - margin) / scale),
+        _y_to_lat(min((y + 1 + margin) / scale, 1.0)),
+        _x_to_lng((x + 1 + margin) / scale),
+        _y_to_lat(max((y - margin) / scale, 0.0)),
+    )
+
+def _tile_point(lat: float, lng: float, z: int, x: int, y: int) -> tuple:
+    scale = 2 ** z
+    return (
+        int(round((_lng_to_x(lng) * scale - x) * MVT_EXTENT)),
+        int(round((_lat_to_y(lat) * scale - y) * MVT_EXTENT)),
+    )
+
+def _encode_property_tile(snapshot: PropertySnapshot, z: int, x: int, y: int) -> bytes:
+    """Tile con dos capas: "properties" (pines, campos del perfil pin) y "clusters" hasta CLUSTER_MAX_ZOOM."""
+    minx, miny, maxx, maxy = _tile_bbox(z, x, y)
+    points, clusters = MvtLayer("properties"), MvtLayer("clusters")
+    pin_fields = GEOJSON_PROFILES["pin"]
+
+    def add_property(payload: dict, lat: float, lng: float):
+        attributes = _project_payload(payload, pin_fields)
+        attributes["price_value"] = _extract_price(payload.get("price"))
+        points.add_point(*_tile_point(lat, lng, z, x, y), attributes)
+
+    if snapshot is None:
+        for payload, lat, lng in _properties_in_bbox(minx, miny, maxx, maxy):
+            add_property(payload, lat, lng)
+    else:
+        spatial = snapshot.derived("spatial", SpatialIndex)
+        nodes = snapshot.derived("clusters", PropertyClusterIndex).query(minx, miny, maxx, maxy, z)
+        if nodes is None:
+            for point_id in spatial.query_bbox(minx, miny, maxx, maxy):
+                add_property(snapshot.records[point_id], *spatial.coords[point_id])
+        else:
+            for node in nodes:
+                if node.point_id is not None:
+                    add_property(snapshot.records[node.point_id], *spatial.coords[node.point_id])
+                    continue
+                clusters.add_point(*_tile_point(node.lat, node.lng, z, x, y), {
+                    "cluster": True,
+                    "cluster_id": node.cluster_id,
+                    "point_count": node.count,
+                    "point_count_abbreviated": _abbreviate_count(node.count),
+                    "price_min": node.price_min,
+                    "price_max": node.price_max,
+                    "expansion_zoom": node.zoom + 1,
+                }, feature_id=node.cluster_id)
+    return b"".join(layer.encode() for layer in (points, clusters) if len(layer))
+
+
+class TileCache:
+    """LRU de tiles codificadas; se vacía entera cuando cambia la versión del snapshot."""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.version = None
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version: int, key: tuple):
+        with self._lock:
+            if version != self.version:
+                self._tiles.clear()
+                self.version = version
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def put(self, version: int, key: tuple, tile: bytes):
+        with self._lock:
+            if version != self.version:
+                return
+            self._tiles[key] = tile
+            while len(self._tiles) > self.max_entries:
+                self._tiles.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "tiles": len(self._tiles),
+                "bytes": sum(len(tile) for tile in self._tiles.values()),
+                "capacity": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+tile_cache = TileCache()
+
+# --- Batch Filtering & Scoring ---
+# Filtros estructurados y puntaje heurístico vectorizados: las columnas numéricas y los perfiles de
+# texto de cada propiedad se calculan una vez por versión del snapshot, y cada búsqueda evalúa
+# todos sus candidatos con unas pocas operaciones de NumPy. La versión fila a fila original queda
+# como referencia en check_property_columns.py, que compara ambas sobre la colección real.
+
+class SearchTextIndex:
+    """Perfiles de texto de todas las propiedades de un snapshot, indexados por point id.
+
+    Cada perfil queda asociado al hash del payload (snapshot.hashes): las propiedades cuyo payload no
+    cambió entre versiones reutilizan el perfil de la versión anterior, aunque una recarga completa
+    haya reemplazado los objetos.
+    """
+
+    def __init__(self, snapshot, previous: "SearchTextIndex" = None):
+        self._profiles = {}
+        self._hashes = snapshot.hashes
+        self.reused = 0
+        for point_id in snapshot.point_ids:
+            profile = previous.get(point_id, snapshot.hashes.get(point_id)) if previous is not None else None
+            if profile is None:
+                profile = PropertySearchText(snapshot.records[point_id])
+            else:
+                self.reused += 1
+            self._profiles[point_id] = profile
+
+    def get(self, point_id, payload_hash: int = None):
+        """Perfil del punto; con payload_hash, solo si corresponde a ese mismo payload."""
+        if payload_hash is not None and self._hashes.get(point_id) != payload_hash:
+            return None
+        return self._profiles.get(point_id)
+
+
+_LAST_SEARCH_TEXT_INDEX = None
+
+def _build_search_text_index(snapshot) -> SearchTextIndex:
+    global _LAST_SEARCH_TEXT_INDEX
+    index = SearchTextIndex(snapshot, previous=_LAST_SEARCH_TEXT_INDEX)
+    _LAST_SEARCH_TEXT_INDEX = index
+    return index
+
+SNAPSHOT_INDEX_BUILDERS["search_text"] = _build_search_text_index
+
+PROPERTY_TYPE_CODES = {canonical: 1 << bit for bit, canonical in enumerate(PROPERTY_TYPE_KEYWORDS)}
+AMENITY_CODES = {
+    term: 1 << bit for bit, term in enumerate(dict.fromkeys(_fold_term(keyword) for keyword in AMENITY_KEYWORDS))
+}
+
+def _numeric_or_nan(value) -> float:
+    try:
+        number = _extract_numeric(value)
+    except OverflowError:
+        number = None
+    return float("nan") if number is None else float(number)
+
+
+# Claves de SearchRequestModel.filters con columna en minúsculas precalculada por versión del snapshot
+FILTER_COLUMNS_MAX_KEYS = 16
+
+class PropertyColumns:
+    """Columnas de búsqueda (numéricas, coordenadas, tipos y tokens) de una lista de payloads."""
+
+    def __init__(self, payloads: list, point_ids: list = None, profiles: list = None):
+        self.payloads = payloads
+        self.size = len(payloads)
+        self.rows = {point_id: row for row, point_id in enumerate(point_ids or [])}
+        self.profiles = profiles or [
+            _search_profile(payload, point_id) for payload, point_id in zip(payloads, point_ids or [None] * len(payloads))
+        ]
+
+        ambientes, bedrooms, score_rooms, bathrooms, lats, lngs = [], [], [], [], [], []
+        type_codes, amenity_codes = [], []
+        for payload, profile in zip(payloads, self.profiles):
+            ambientes.append(_numeric_or_nan(payload.get("ambientes")))
+            bedrooms.append(_numeric_or_nan(payload.get("bedrooms") or payload.get("rooms")))
+            score_rooms.append(_numeric_or_nan(payload.get("bedrooms") or payload.get("ambientes") or payload.get("rooms")))
+            bathrooms.append(_numeric_or_nan(payload.get("bathrooms")))
+            lat, lng = _extract_property_coords(payload)
+            lats.append(float("nan") if lat is None else lat)
+            lngs.append(float("nan") if lng is None else lng)
+            type_codes.append(sum(code for canonical, code in PROPERTY_TYPE_CODES.items() if canonical in profile.property_type))
+            amenity_codes.append(sum(code for term, code in AMENITY_CODES.items() if profile.matches(term)))
+
+        self.ambientes = np.array(ambientes, dtype=np.float64)
+        self.bedrooms = np.array(bedrooms, dtype=np.float64)
+        self.score_rooms = np.array(score_rooms, dtype=np.float64)
+        self.bathrooms = np.array(bathrooms, dtype=np.float64)
+        self.lat = np.array(lats, dtype=np.float64)
+        self.lng = np.array(lngs, dtype=np.float64)
+        self.has_coords = ~(np.isnan(self.lat) | np.isnan(self.lng))
+        self.type_codes = np.array(type_codes, dtype=np.int64)
+        self.amenity_codes = np.array(amenity_codes, dtype=np.int64)
+        self.token_rows = self._invert(profile.tokens for profile in self.profiles)
+        self.location_token_rows = self._invert(profile.location_tokens for profile in self.profiles)
+        self._filter_columns = OrderedDict()
+        self._filter_lock = threading.Lock()
+
+    @staticmethod
+    def _invert(token_sets) -> dict:
+        """token -> filas que lo contienen."""
+        inverted = {}
+        for row, tokens in enumerate(token_sets):
+            for token in tokens:
+                inverted.setdefault(token, []).append(row)
+        return {token: np.array(rows, dtype=np.int32) for token, rows in inverted.items()}
+
+    def _size(self, rows) -> int:
+        return self.size if rows is None else len(rows)
+
+    @staticmethod
+    def _select(values: np.ndarray, rows) -> np.ndarray:
+        return values if rows is None else values[rows]
+
+    def _row_ids(self, rows):
+        return range(self.size) if rows is None else rows
+
+    def _member_mask(self, token_rows: np.ndarray, rows) -> np.ndarray:
+        """Máscara de las filas (todas, o las de `rows`) que están en la lista ordenada token_rows."""
+        if rows is None:
+            mask = np.zeros(self.size, dtype=bool)
+            mask[token_rows] = True
+            return mask
+        # Búsqueda binaria: O(len(rows) · log) en vez de recorrer la colección
+        positions = np.minimum(np.searchsorted(token_rows, rows), len(token_rows) - 1)
+        return token_rows[positions] == rows
+
+    def _term_mask(self, term: str, token_rows: dict, text_attr: str, rows=None) -> np.ndarray:
+        # Misma semántica que PropertySearchText.matches: lookup de tokens y, para frases, confirmación
+        # del texto solo en las filas que tienen todas las palabras
+        size = self._size(rows)
+        if not term:
+            return np.ones(size, dtype=bool)
+        words = term.split()
+        mask = None
+        for word in words:
+            word_rows = token_rows.get(word)
+            if word_rows is None:
+                return np.zeros(size, dtype=bool)
+            word_mask = self._member_mask(word_rows, rows)
+            mask = word_mask if mask is None else mask & word_mask
+        if len(words) > 1:
+            needle = f" {term} "
+            row_ids = self._row_ids(rows)
+            for position in np.flatnonzero(mask):
+                if needle not in getattr(self.profiles[row_ids[position]], text_attr):
+                    mask[position] = False
+        return mask
+
+    def text_mask(self, term: str, rows=None) -> np.ndarray:
+        return self._term_mask(term, self.token_rows, "text", rows)
+
+    def location_mask(self, term: str, rows=None) -> np.ndarray:
+        return self._term_mask(term, self.location_token_rows, "location_text", rows)
+
+    def type_mask(self, ptype: str, rows=None) -> np.ndarray:
+        code = PROPERTY_TYPE_CODES.get(ptype)
+        if code is not None:
+            return (self._select(self.type_codes, rows) & code) != 0
+        folded = _fold_text(ptype)
+        return np.array([folded in self.profiles[row].property_type for row in self._row_ids(rows)], dtype=bool)
+
+    def amenity_mask(self, term: str, rows=None) -> np.ndarray:
+        folded = _fold_term(term)
+        code = AMENITY_CODES.get(folded)
+        if code is not None:
+            return (self._select(self.amenity_codes, rows) & code) != 0
+        return self.text_mask(folded, rows)
+
+    def filter_column(self, key: str) -> np.ndarray:
+        """Valores de `key` en minúsculas (None si falta), calculados una vez por versión del snapshot."""
+        column = self._filter_columns.get(key)
+        if column is None:
+            column = np.array(
+                [None if payload.get(key) is None else str(payload.get(key)).lower() for payload in self.payloads],
+                dtype=object,
+            )
+            with self._filter_lock:
+                if len(self._filter_columns) >= FILTER_COLUMNS_MAX_KEYS:
+                    self._filter_columns.popitem(last=False)
+                self._filter_columns[key] = column
+        return column
+
+    def _filter_values(self, key: str, rows) -> np.ndarray:
+        if rows is None:
+            return self.filter_column(key)
+        # Pocos candidatos: se normalizan solo esos payloads
+        cached = self._filter_columns.get(key)
+        if cached is not None:
+            return cached[rows]
+        return np.array(
+            [None if self.payloads[row].get(key) is None else str(self.payloads[row].get(key)).lower() for row in rows],
+            dtype=object,
+        )
+
+    def passes(self, features: dict, filters: dict, neighborhood_bbox: dict = None, rows=None) -> np.ndarray:
+        """Máscara de los filtros estructurados para todas las filas, o solo para las de `rows` (en ese orden)."""
+        mask = np.ones(self._size(rows), dtype=bool)
+        search_mode = features.get("search_mode")
+        desired_ambientes = features.get("ambientes")
+        desired_bedrooms = features.get("bedrooms")
+        ambientes, bedrooms = self._select(self.ambientes, rows), self._select(self.bedrooms, rows)
+
+        if search_mode == "ambientes" and desired_ambientes is not None:
+            mask &= ~(np.isnan(ambientes) & np.isnan(bedrooms))
+            if desired_ambientes == 1:
+                # Monoambiente: ambientes=1, bedrooms=1 o bedrooms=0, pero nunca ambientes >= 2
+                mask &= ~(ambientes >= 2)
+                mask &= (ambientes == 1) | (bedrooms == 1) | (bedrooms == 0)
+            else:
+                mask &= (ambientes == desired_ambientes) | (bedrooms == desired_ambientes - 1)
+        elif desired_bedrooms is not None:
+            # Sistema internacional (o sin search_mode): 1 dormitorio exacto, 2+ como mínimo
+            if desired_bedrooms == 1:
+                mask &= bedrooms == 1
+            else:
+                mask &= bedrooms >= desired_bedrooms
+
+        desired_bathrooms = features.get("bathrooms")
+        if desired_bathrooms is not None:
+            mask &= self._select(self.bathrooms, rows) >= desired_bathrooms
+
+        if features.get("property_types"):
+            type_mask = np.zeros(len(mask), dtype=bool)
+            for ptype in features["property_types"]:
+                type_mask |= self.type_mask(ptype, rows)
+            mask &= type_mask
+
+        neighborhoods = features.get("neighborhoods") or []
+        if neighborhood_bbox and neighborhood_bbox.get("bbox"):
+            bbox = neighborhood_bbox["bbox"]
+            text_match = self.any_location(neighborhoods, rows)
+            bounds = [bbox.get(key) for key in ("min_lat", "max_lat", "min_lon", "max_lon")]
+            lat, lng = self._select(self.lat, rows), self._select(self.lng, rows)
+            if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in bounds):
+                min_lat, max_lat, min_lon, max_lon = bounds
+                inside = (min_lat <= lat) & (lat <= max_lat) & (min_lon <= lng) & (lng <= max_lon)
+            else:
+                inside = np.array(
+                    [self._inside_bbox(row, bounds, matched) for row, matched in zip(self._row_ids(rows), text_match)],
+                    dtype=bool,
+                )
+            mask &= np.where(self._select(self.has_coords, rows), inside, text_match)
+        elif neighborhoods:
+            mask &= self.any_location(neighborhoods, rows)
+
+        for key, expected in (filters or {}).items():
+            values = self._filter_values(key, rows)
+            if isinstance(expected, (list, tuple, set)):
+                expected_values = {str(option).lower() for option in expected}
+                mask &= np.array([value in expected_values for value in values], dtype=bool)
+            else:
+                mask &= values == str(expected).lower()
+        return mask
+
+    def _inside_bbox(self, row: int, bounds: list, text_match: bool) -> bool:
+        # bbox con valores no numéricos: misma comparación que la referencia fila a fila, con su fallback por texto
+        if not self.has_coords[row]:
+            return False
+        min_lat, max_lat, min_lon, max_lon = bounds
+        lat, lng = float(self.lat[row]), float(self.lng[row])
+        try:
+            return min_lat <= lat <= max_lat and min_lon <= lng <= max_lon
+        except TypeError:
+            return bool(text_match)
+
+    def any_location(self, neighborhoods, rows=None) -> np.ndarray:
+        mask = np.zeros(self._size(rows), dtype=bool)
+        for neighborhood in neighborhoods:
+            mask |= self.location_mask(_fold_term(neighborhood), rows)
+        return mask
+
+    def scores(self, features: dict, rows=None) -> np.ndarray:
+        """Puntaje heurístico para todas las filas, o solo para las de `rows`."""
+        scores = np.zeros(self._size(rows), dtype=np.int64)
+        for token in features["tokens"]:
+            if token:
+                scores += 2 * self.text_mask(_fold_term(token), rows)
+        for phrase in features["phrases"]:
+            if phrase:
+                scores += 4 * self.text_mask(_fold_term(phrase), rows)
+        for neighborhood in features["neighborhoods"]:
+            if neighborhood:
+                scores += 5 * self.text_mask(_fold_term(neighborhood), rows)
+        for ptype in features["property_types"]:
+            scores += 6 * self.type_mask(ptype, rows)
+        for term in features["must_have_terms"]:
+            if term:
+                scores += 5 * self.amenity_mask(term, rows)
+
+        desired_bedrooms = features["bedrooms"]
+        if desired_bedrooms is not None:
+            room_values = self._select(self.score_rooms, rows)
+            known = ~np.isnan(room_values)
+            scores += np.where(known & (room_values == desired_bedrooms), 6, 0)
+            scores += np.where(known & (room_values > desired_bedrooms), 3, 0)
+            scores += np.where(known & (room_values < desired_bedrooms), -4, 0)
+
+        desired_bathrooms = features["bathrooms"]
+        if desired_bathrooms is not None:
+            bathrooms = self._select(self.bathrooms, rows)
+            known = ~np.isnan(bathrooms)
+            scores += np.where(known & (bathrooms == desired_bathrooms), 3, 0)
+            scores += np.where(known & (bathrooms > desired_bathrooms), 1, 0)
+            scores += np.where(known & (bathrooms < desired_bathrooms), -2, 0)
+        return scores
+
+def _build_property_columns(snapshot) -> PropertyColumns:
+    payloads = snapshot.payloads()
+    texts = snapshot.derived("search_text", SNAPSHOT_INDEX_BUILDERS["search_text"])
+    return PropertyColumns(payloads, snapshot.point_ids, [texts.get(point_id) for point_id in snapshot.point_ids])
+
+SNAPSHOT_INDEX_BUILDERS["columns"] = _build_property_columns
+
+def _evaluate_candidates(records: list, features: dict, filters: dict, neighborhood_bbox: dict = None, with_scores: bool = True):
+    """Evalúa en lote una lista de records de Qdrant: devuelve (pasa_filtros, puntaje) por record, en orden.
+
+    Los records que coinciden con el snapshot (mismo SNAPSHOT_CHANGE_FIELD) reutilizan sus columnas
+    precalculadas; el resto se normaliza en el momento.
+    """
+    passes = [False] * len(records)
+    scores = [0] * len(records)
+    snapshot = property_snapshot.current
+    columns = snapshot.derived("columns", SNAPSHOT_INDEX_BUILDERS["columns"]) if snapshot is not None else None
+
+    known, unknown = [], []
+    for position, record in enumerate(records):
+        row = columns.rows.get(record.id) if columns is not None else None
+        if row is not None and not _snapshot_has_current(snapshot, record.id, record.payload):
+            row = None
+        if row is None:
+            unknown.append((position, len(unknown)))
+        else:
+            known.append((position, row))
+
+    # Los records del snapshot se evalúan solo en sus filas, no sobre toda la colección
+    batches = []
+    if known:
+        batches.append((columns, known, np.array([row for _, row in known], dtype=np.int64)))
+    if unknown:
+        batches.append((PropertyColumns([records[position].payload or {} for position, _ in unknown]), unknown, None))
+    for batch_columns, rows, selected in batches:
+        mask = batch_columns.passes(features, filters, neighborhood_bbox, rows=selected)
+        row_scores = batch_columns.scores(features, rows=selected) if with_scores else None
+        for index, (position, _) in enumerate(rows):
+            passes[position] = bool(mask[index])
+            if with_scores:
+                scores[position] = int(row_scores[index])
+    return passes, scores
+
+# Páginas a partir de este tamaño se evalúan en un thread para no frenar el event loop
+EVALUATE_IN_THREAD_MIN_HITS = 64
+
+async def _evaluate_candidates_async(records: list, features: dict, filters: dict, neighborhood_bbox: dict = None, with_scores: bool = True):
+    """_evaluate_candidates desde código async: en el loop si es barato, en un thread si la página es
+    grande o si las columnas del snapshot todavía no están construidas (se construirían sobre toda la colección)."""
+    snapshot = property_snapshot.current
+    if len(records) < EVALUATE_IN_THREAD_MIN_HITS and (snapshot is None or snapshot.peek("columns") is not None):
+        return _evaluate_candidates(records, features, filters, neighborhood_bbox, with_scores)
+    return await asyncio.to_thread(_evaluate_candidates, records, features, filters, neighborhood_bbox, with_scores)
+
+# --- Keyword Index (BM25) ---
+# Índice invertido sobre toda la colección para el camino por keywords: recall completo y ranking
+# BM25, sin depender del orden del scroll ni de una ventana de N registros.
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_TITLE_WEIGHT = 2  # las palabras del título cuentan doble
+
+SPANISH_STOPWORDS = frozenset(
+    "a al ante con contra de del desde e el en entre hacia hasta la las lo los o para por que se segun "
+    "sin sobre su sus u un una unas unos y ya mi me busco buscar quiero necesito hay muy mas".split()
+)
+
+@lru_cache(maxsize=65536)
+def _spanish_stem(word: str) -> str:
+    """Stemming liviano para español: plurales y vocal final ("balcones" -> "balcon", "casas" -> "cas")."""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("es") and len(word) > 4 and word[-3] not in "aeiou":
+        word = word[:-2]
+    elif word.endswith("s"):
+        word = word[:-1]
+    if len(word) > 3 and word[-1] in "aeo":
+        word = word[:-1]
+    return word
+
+def _keyword_terms(words) -> list:
+    """Términos indexables a partir de palabras ya normalizadas (sin stopwords, con stemming)."""
+    return [_spanish_stem(word) for word in words if word not in SPANISH_STOPWORDS]
+
+
+class KeywordIndex:
+    """Índice invertido BM25 sobre los perfiles de texto de un snapshot (mismo orden de filas que PropertyColumns)."""
+
+    def __init__(self, profiles: list):
+        self.size = len(profiles)
+        postings = {}
+        lengths = np.zeros(self.size, dtype=np.float32)
+        for row, profile in enumerate(profiles):
+            terms = _keyword_terms(profile.text.split())
+            title_terms = _keyword_terms(_folded_words(profile.payload.get("title")))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term in title_terms:
+                counts[term] = counts.get(term, 0) + BM25_TITLE_WEIGHT - 1
+            lengths[row] = len(terms) + len(title_terms) * (BM25_TITLE_WEIGHT - 1)
+            for term, count in counts.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(row)
+                postings[term][1].append(count)
+
+        average_length = float(lengths.mean()) if self.size and lengths.mean() > 0 else 1.0
+        self.length_norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+        self.postings = {
+            term: (np.array(rows, dtype=np.int32), np.array(counts, dtype=np.float32))
+            for term, (rows, counts) in postings.items()
+        }
+
+    def score(self, query: str) -> np.ndarray:
+        """Puntaje BM25 de cada fila para la consulta (0 si no comparte ningún término)."""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(_keyword_terms(_folded_words(query))):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            rows, tf = posting
+            df = len(rows)
+            idf = math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+            scores[rows] += idf * tf * (BM25_K1 + 1) / (tf + self.length_norm[rows])
+        return scores
+
+    def stats(self) -> dict:
+        return {"documents": self.size, "terms": len(self.postings)}
+
+SNAPSHOT_INDEX_BUILDERS["keywords"] = lambda snapshot: KeywordIndex(
+    snapshot.derived("columns", SNAPSHOT_INDEX_BUILDERS["columns"]).profiles
+)
+
+def _keyword_search(snapshot, search_request: SearchRequestModel, neighborhood_data: dict = None) -> list:
+    """Búsqueda por keywords sobre toda la colección: filtros estructurados vectorizados + ranking BM25.
+
+    Mismo contrato que _fallback_semantic_search: si nada pasa el filtro geográfico estricto y hay
+    un barrio, se relaja a "el barrio aparece en la ubicación de la propiedad".
+    """
+    features = _parse_query_features(search_request.query)
+    filters = search_request.filters or {}
+    columns = snapshot.derived("columns", SNAPSHOT_INDEX_BUILDERS["columns"])
+    keywords = snapshot.derived("keywords", SNAPSHOT_INDEX_BUILDERS["keywords"])
+
+    passes = columns.passes(features, filters, neighborhood_data)
+    if not passes.any() and neighborhood_data:
+        names = list(features.get("neighborhoods") or [])
+        if neighborhood_data.get("name"):
+            names.append(neighborhood_data["name"])
+        passes = columns.passes(features, filters, None) & columns.any_location(names)
+        print(f"⚠️ Sin resultados con el filtro geográfico estricto: {int(passes.sum())} propiedades por texto del barrio")
+
+    rows = np.flatnonzero(passes)
+    if not len(rows):
+        return []
+    bm25 = keywords.score(search_request.query)[rows]
+    heuristic = columns.scores(features, rows)
+    if (bm25 > 0).any():
+        rows, heuristic, bm25 = rows[bm25 > 0], heuristic[bm25 > 0], bm25[bm25 > 0]
+    # BM25 primero, después el puntaje estructurado y por último el orden del snapshot
+    order = np.lexsort((rows, -heuristic, -bm25))[: search_request.top_k]
+    print(f"✅ Keyword index: {len(rows)} candidatas de {columns.size}, retornando {len(order)}")
+    return [columns.payloads[row] for row in rows[order]]
+
+# --- Nearest Alternatives ---
+# Cuando una búsqueda no devuelve nada, se ofrecen las propiedades más cercanas a lo pedido
+# (otra cantidad de ambientes/dormitorios, un baño menos, un barrio vecino) en una sola pasada
+# sobre toda la colección, ordenadas por distancia a la consulta.
+
+ALTERNATIVES_MAX_ROOM_DELTA = 2     # ambientes/dormitorios de diferencia
+ALTERNATIVES_MAX_BATHROOM_DELTA = 1
+ALTERNATIVES_MAX_KM = 3.0           # distancia máxima al bbox del barrio
+ALTERNATIVES_KM_PER_STEP = 1.5      # 1.5 km fuera del barrio "pesan" como un ambiente de diferencia
+ALTERNATIVES_PER_GROUP = 2
+ALTERNATIVES_SCROLL_LIMIT = 400
+
+def _describe_request(features: dict, neighborhood_data: dict = None) -> str:
+    """"1 ambiente en La Perla", "3 dormitorios y 2 baños", etc."""
+    parts = []
+    if features.get("search_mode") == "ambientes" and features.get("ambientes") is not None:
+        parts.append("1 ambiente" if features["ambientes"] == 1 else f"{features['ambientes']} ambientes")
+    elif features.get("bedrooms") is not None:
+        parts.append("1 dormitorio" if features["bedrooms"] == 1 else f"{features['bedrooms']} dormitorios")
+    if features.get("bathrooms") is not None:
+        parts.append("1 baño" if features["bathrooms"] == 1 else f"{features['bathrooms']} baños")
+    text = " y ".join(parts) or "esas características"
+    if neighborhood_data and neighborhood_data.get("name"):
+        text += f" en {neighborhood_data['name']}"
+    return text
+
+def _alternative_candidates(search_request: SearchRequestModel, features: dict, neighborhood_data: dict = None) -> PropertyColumns:
+    """Columnas de los candidatos: todo el snapshot, o un único scroll relajado si no está cargado."""
+    snapshot = property_snapshot.current
+    if snapshot is not None:
+        return snapshot.derived("columns", SNAPSHOT_INDEX_BUILDERS["columns"])
+
+    conditions = []
+    if neighborhood_data and neighborhood_data.get("bbox"):
+        geo_condition = _geo_bbox_condition(neighborhood_data["bbox"], margin_ratio=1.0)
+        if geo_condition is not None:
+            conditions.append(geo_condition)
+    if features.get("property_types"):
+        conditions.append(models.FieldCondition(
+            key="property_type",
+            match=models.MatchAny(any=list(features["property_types"]))
+        ))
+    records, _ = qdrant_cli.scroll(
+        collection_name=settings["collection_name"],
+        limit=ALTERNATIVES_SCROLL_LIMIT,
+        with_payload=True,
+        with_vectors=False,
+        scroll_filter=models.Filter(must=conditions) if conditions else None,
+    )
+    return PropertyColumns([record.payload or {} for record in records])
+
+def _nearest_alternatives(search_request: SearchRequestModel, features: dict, neighborhood_data: dict = None):
+    """Propiedades más cercanas a lo pedido, agrupadas por en qué difieren.
+
+    Devuelve el dict {"properties": [], "alternatives": [...], "groups": [...], "message": ...}
+    que /search retorna cuando no hay resultados exactos, o None si no aplica o no hay nada cerca.
+    """
+    search_mode = features.get("search_mode")
+    if search_mode == "ambientes" and features.get("ambientes") is not None:
+        desired_rooms, room_unit = features["ambientes"], "ambientes"
+    elif features.get("bedrooms") is not None:
+        desired_rooms, room_unit = features["bedrooms"], "dormitorios"
+    else:
+        desired_rooms, room_unit = None, None
+    desired_bathrooms = features.get("bathrooms")
+    names = list(features.get("neighborhoods") or [])
+    if neighborhood_data and neighborhood_data.get("name"):
+        names.append(neighborhood_data["name"])
+    if desired_rooms is None and desired_bathrooms is None and not names:
+        return None
+
+    columns = _alternative_candidates(search_request, features, neighborhood_data)
+    if not columns.size:
+        return None
+
+    # Restricciones duras: tipo de propiedad y filtros explícitos del request
+    hard_features = {"property_types": features.get("property_types") or set(), "neighborhoods": []}
+    distance = np.where(columns.passes(hard_features, search_request.filters or {}), 0.0, np.inf)
+
+    rooms_delta = np.zeros(columns.size)
+    if desired_rooms is not None:
+        if room_unit == "ambientes":
+            # Sin "ambientes" cargado se estima como dormitorios + 1 (monoambiente = 0 dormitorios)
+            rooms = np.where(np.isnan(columns.ambientes), columns.bedrooms + 1, columns.ambientes)
+        else:
+            rooms = columns.bedrooms
+        rooms_delta = np.abs(rooms - desired_rooms)
+        distance += np.where(np.isnan(rooms) | (rooms_delta > ALTERNATIVES_MAX_ROOM_DELTA), np.inf, rooms_delta)
+
+    bathrooms_delta = np.zeros(columns.size)
+    if desired_bathrooms is not None:
+        bathrooms_delta = np.where(np.isnan(columns.bathrooms), 1.0, np.maximum(desired_bathrooms - columns.bathrooms, 0))
+        distance += np.where(bathrooms_delta > ALTERNATIVES_MAX_BATHROOM_DELTA, np.inf, bathrooms_delta)
+
+    outside_km = np.zeros(columns.size)
+    if names:
+        text_match = columns.any_location(names)
+        bbox = (neighborhood_data or {}).get("bbox") or {}
+        bounds = [bbox.get(key) for key in ("min_lat", "max_lat", "min_lon", "max_lon")]
+        if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in bounds):
+            min_lat, max_lat, min_lon, max_lon = bounds
+            lat_gap = np.maximum(np.maximum(min_lat - columns.lat, columns.lat - max_lat), 0) * 111.0
+            lng_gap = np.maximum(np.maximum(min_lon - columns.lng, columns.lng - max_lon), 0) * 111.0 * math.cos(math.radians((min_lat + max_lat) / 2))
+            geo_km = np.hypot(lat_gap, lng_gap)
+            outside_km = np.where(columns.has_coords, geo_km, np.where(text_match, 0.0, np.inf))
+        else:
+            outside_km = np.where(text_match, 0.0, np.inf)
+        distance += np.where(outside_km > ALTERNATIVES_MAX_KM, np.inf, outside_km / ALTERNATIVES_KM_PER_STEP)
+
+    # Distancia 0 = cumple todo lo pedido: no es una alternativa (la búsqueda exacta la descartó por otro motivo)
+    rows = np.flatnonzero(np.isfinite(distance) & (distance > 0))
+    if not len(rows):
+        return None
+    heuristic = columns.scores(features, rows)
+    rows = rows[np.lexsort((rows, -heuristic, distance[rows]))]
+
+    limit = max(search_request.top_k, 2 * ALTERNATIVES_PER_GROUP)
+    alternatives, groups = [], OrderedDict()
+    for row in rows:
+        reasons = []
+        if desired_rooms is not None and rooms_delta[row] > 0:
+            value = int(rooms[row])
+            unit = room_unit if value != 1 else ("ambiente" if room_unit == "ambientes" else "dormitorio")
+            reasons.append(f"{value} {unit}")
+        if desired_bathrooms is not None and bathrooms_delta[row] > 0:
+            reasons.append("menos baños")
+        if outside_km[row] > 0 and neighborhood_data:
+            reasons.append(f"cerca de {neighborhood_data.get('name')}")
+        label = ", ".join(reasons)
+        if groups.get(label, 0) >= ALTERNATIVES_PER_GROUP:
+            continue
+        groups[label] = groups.get(label, 0) + 1
+        alternatives.append(columns.payloads[row])
+        if len(alternatives) >= limit:
+            break
+
+    summary = ", ".join(f"{count} con {label}" for label, count in groups.items())
+    print(f"✅ Encontradas {len(alternatives)} propiedades alternativas ({summary})")
+    return {
+        "properties": [],
+        "alternatives": alternatives,
+        "groups": [{"label": label, "count": count} for label, count in groups.items()],
+        "message": f"No encontré propiedades con exactamente {_describe_request(features, neighborhood_data)}, pero encontré {len(alternatives)} propiedades similares: {summary}.",
+    }
+
+# --- In-Memory Vector Index ---
+# El catálogo es de unos pocos miles de propiedades: una búsqueda exacta por producto de matrices
+# en el proceso es más rápida que el round trip a Qdrant. Se construye con cada versión del snapshot
+# y solo se usa mientras la colección no supere VECTOR_INDEX_MAX_POINTS.
+
+VECTOR_INDEX_MASK_CACHE = 256   # máscaras de filtros de Qdrant por versión
+VECTOR_INDEX_INT8_CHUNK = 4096  # filas por bloque al des-cuantizar int8
+
+def _filter_conditions(conditions) -> list:
+    if conditions is None:
+        return []
+    return list(conditions) if isinstance(conditions, (list, tuple)) else [conditions]
+
+def _payload_values(payload: dict, key: str) -> list:
+    value = payload
+    for part in key.split("."):
+        if not isinstance(value, dict):
+            return []
+        value = value.get(part)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def _condition_matches(payload: dict, condition) -> bool:
+    if isinstance(condition, models.Filter):
+        return _payload_matches_filter(payload, condition)
+    if not isinstance(condition, models.FieldCondition):
+        raise ValueError(f"Unsupported filter condition: {type(condition).__name__}")
+    values = _payload_values(payload, condition.key)
+    if condition.match is not None:
+        if isinstance(condition.match, models.MatchValue):
+            return any(value == condition.match.value for value in values)
+        if isinstance(condition.match, models.MatchAny):
+            return any(value in condition.match.any for value in values if not isinstance(value, (dict, list)))
+        raise ValueError(f"Unsupported match: {type(condition.match).__name__}")
+    if condition.range is not None:
+        bounds = condition.range
+        return any(
+            (bounds.gt is None or value > bounds.gt) and (bounds.gte is None or value >= bounds.gte)
+            and (bounds.lt is None or value < bounds.lt) and (bounds.lte is None or value <= bounds.lte)
+            for value in values
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+        )
+    if condition.geo_bounding_box is not None:
+        box = condition.geo_bounding_box
+        return any(
+            isinstance(value, dict) and isinstance(value.get("lat"), (int, float)) and isinstance(value.get("lon"), (int, float))
+            and box.bottom_right.lat <= value["lat"] <= box.top_left.lat
+            and box.top_left.lon <= value["lon"] <= box.bottom_right.lon
+            for value in values
+        )
+    raise ValueError(f"Unsupported field condition on '{condition.key}'")
+
+def _payload_matches_filter(payload: dict, query_filter) -> bool:
+    """Evalúa un models.Filter de Qdrant (must / should / must_not) sobre un payload en memoria."""
+    if query_filter is None:
+        return True
+    if not all(_condition_matches(payload, condition) for condition in _filter_conditions(query_filter.must)):
+        return False
+    should = _filter_conditions(query_filter.should)
+    if should and not any(_condition_matches(payload, condition) for condition in should):
+        return False
+    return not any(_condition_matches(payload, condition) for condition in _filter_conditions(query_filter.must_not))
+
+
+class InMemoryVectorIndex:
+    """Matriz (float32 o int8 con escala por fila) con los vectores del snapshot, en el orden de sus filas.
+
+    Los vectores de las propiedades cuyo payload no cambió se reutilizan del índice anterior; solo se
+    traen de Qdrant los nuevos o modificados.
+    """
+
+    def __init__(self, snapshot: PropertySnapshot, mode: str, distance, previous=None):
+        self.version = snapshot.version
+        self.mode = mode
+        self.distance = distance
+        point_ids = snapshot.point_ids
+        self.rows = {point_id: row for row, point_id in enumerate(point_ids)}
+        self.hashes = dict(snapshot.hashes)
+        self._payloads = snapshot.payloads()
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.total_ms = 0.0
+
+        reusable = previous is not None and previous.mode == mode and previous.distance == distance
+        vectors, reused = {}, 0
+        if reusable:
+            for point_id in point_ids:
+                row = previous.rows.get(point_id)
+                if row is not None and previous.has_vector[row] and previous.hashes.get(point_id) == snapshot.hashes.get(point_id):
+                    vectors[point_id] = previous._row_vector(row)
+                    reused += 1
+        missing = [point_id for point_id in point_ids if point_id not in vectors]
+        vectors.update(self._fetch_vectors(missing, scroll=len(missing) > len(point_ids) // 2))
+
+        dimension = next((len(vector) for vector in vectors.values()), 0)
+        matrix = np.zeros((len(point_ids), dimension), dtype=np.float32)
+        self.has_vector = np.zeros(len(point_ids), dtype=bool)
+        for point_id, vector in vectors.items():
+            row = self.rows.get(point_id)
+            if row is not None and len(vector) == dimension:
+                matrix[row] = vector
+                self.has_vector[row] = True
+        if distance == models.Distance.COSINE:
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= np.where(norms > 0, norms, 1.0)
+        self.dimension = dimension
+        if mode == "int8":
+            # Cuantización simétrica por fila: vector ≈ int8 * escala
+            scales = np.abs(matrix).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self.scales = scales.astype(np.float32)
+            self.matrix = np.round(matrix / self.scales[:, None]).astype(np.int8)
+        else:
+            self.scales = None
+            self.matrix = matrix
+        print(f"✅ Vector index v{self.version} ({mode}): {int(self.has_vector.sum())}/{len(point_ids)} vectors, "
+              f"{reused} reused, {len(missing)} fetched, {self.matrix.nbytes / 1e6:.1f} MB")
+
+    @staticmethod
+    def _record_vector(record):
+        vector = record.vector
+        if isinstance(vector, dict):
+            raise ValueError("named vectors are not supported by the in-memory index")
+        return np.asarray(vector, dtype=np.float32) if vector is not None else None
+
+    def _fetch_vectors(self, point_ids: list, scroll: bool) -> dict:
+        if not point_ids:
+            return {}
+        vectors = {}
+        if scroll:
+            wanted = set(point_ids)
+            offset = None
+            while True:
+                records, offset = qdrant_cli.scroll(
+                    collection_name=settings["collection_name"],
+                    limit=SNAPSHOT_PAGE_SIZE,
+                    offset=offset,
+                    with_payload=False,
+                    with_vectors=True,
+                )
+                for record in records:
+                    if record.id in wanted:
+                        vectors[record.id] = self._record_vector(record)
+                if offset is None:
+                    break
+        else:
+            for i in range(0, len(point_ids), SNAPSHOT_RETRIEVE_CHUNK):
+                for record in qdrant_cli.retrieve(
+                    collection_name=settings["collection_name"],
+                    ids=point_ids[i : i + SNAPSHOT_RETRIEVE_CHUNK],
+                    with_payload=False,
+                    with_vectors=True,
+                ):
+                    vectors[record.id] = self._record_vector(record)
+        return {point_id: vector for point_id, vector in vectors.items() if vector is not None}
+
+    def _row_vector(self, row: int):
+        if self.scales is None:
+            return self.matrix[row]
+        return self.matrix[row].astype(np.float32) * self.scales[row]
+
+    def filter_mask(self, query_filter):
+        """Filas que cumplen el filtro de Qdrant; se calcula una vez por filtro y versión."""
+        if query_filter is None:
+            return self.has_vector
+        key = repr(query_filter)
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+        mask = np.fromiter((_payload_matches_filter(payload, query_filter) for payload in self._payloads), dtype=bool, count=len(self._payloads))
+        mask &= self.has_vector
+        with self._lock:
+            self._masks[key] = mask
+            while len(self._masks) > VECTOR_INDEX_MASK_CACHE:
+                self._masks.popitem(last=False)
+        return mask
+
+    def _scores(self, query) -> np.ndarray:
+        if self.scales is None:
+            return self.matrix @ query
+        scores = np.empty(len(self.matrix), dtype=np.float32)
+        for start in range(0, len(self.matrix), VECTOR_INDEX_INT8_CHUNK):
+            block = self.matrix[start:start + VECTOR_INDEX_INT8_CHUNK].astype(np.float32)
+            scores[start:start + len(block)] = block @ query
+        return scores * self.scales
+
+    def search(self, query_vector: list, mask, top_k: int) -> list:
+        """Filas de los top_k vectores más similares dentro de `mask`, de mayor a menor score."""
+        started = time.perf_counter()
+        query = np.asarray(query_vector, dtype=np.float32)
+        if self.distance == models.Distance.COSINE:
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+        candidates = np.flatnonzero(mask)
+        result = []
+        if len(candidates) and top_k > 0:
+            scores = self._scores(query)[candidates]
+            k = min(top_k, len(candidates))
+            top = np.argpartition(-scores, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+            order = np.lexsort((candidates[top], -scores[top]))
+            result = candidates[top][order].tolist()
+        with self._lock:
+            self.searches += 1
+            self.total_ms += (time.perf_counter() - started) * 1000
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "version": self.version,
+                "mode": self.mode,
+                "distance": str(self.distance),
+                "vectors": int(self.has_vector.sum()),
+                "dimension": self.dimension,
+                "memory_mb": round(self.matrix.nbytes / 1e6, 2),
+                "cached_masks": len(self._masks),
+                "searches": self.searches,
+                "avg_ms": round(self.total_ms / self.searches, 3) if self.searches else None,
+            }
+
+
+_LAST_VECTOR_INDEX = None
+
+def _build_vector_index(snapshot: PropertySnapshot):
+    """Índice vectorial del snapshot, o None si está desactivado o la colección es demasiado grande."""
+    global _LAST_VECTOR_INDEX
+    mode = settings.get("vector_index", "off")
+    if mode not in ("float32", "int8"):
+        return None
+    max_points = settings.get("vector_index_max_points", 20000)
+    if len(snapshot) > max_points:
+        print(f"ℹ️ Vector index disabled: {len(snapshot)} properties > VECTOR_INDEX_MAX_POINTS={max_points}, searching in Qdrant")
+        _LAST_VECTOR_INDEX = None
+        return None
+    vectors_config = qdrant_cli.get_collection(collection_name=settings["collection_name"]).config.params.vectors
+    distance = getattr(vectors_config, "distance", None)
+    if distance not in (models.Distance.COSINE, models.Distance.DOT):
+        print(f"ℹ️ Vector index disabled: distance {distance} not supported, searching in Qdrant")
+        return None
+    index = InMemoryVectorIndex(snapshot, mode, distance, previous=_LAST_VECTOR_INDEX)
+    _LAST_VECTOR_INDEX = index
+    return index
+
+# Va último: es el único builder que vuelve a Qdrant (trae los vectores)
+SNAPSHOT_INDEX_BUILDERS["vectors"] = _build_vector_index
+
+def _in_memory_vector_index(dimension: int):
+    """(snapshot, índice) si hay un índice vectorial listo para vectores de esa dimensión; si no (None, None)."""
+    snapshot = property_snapshot.current
+    index = snapshot.peek("vectors") if snapshot is not None else None
+    if index is None or index.dimension != dimension:
+        return None, None
+    return snapshot, index
+
+def _local_vector_search(search_request: SearchRequestModel, features: dict, query_filter, neighborhood_data: dict, query_vector: list):
+    """top_k por producto de matrices sobre el índice en memoria; None si hay que ir a Qdrant.
+
+    La máscara combina el filtro de Qdrant (cacheado por versión) con los filtros estructurados de
+    PropertyColumns.passes, así que devuelve directamente los top_k que pasan.
+    """
+    snapshot, index = _in_memory_vector_index(len(query_vector))
+    if index is None:
+        return None
+    try:
+        columns = snapshot.derived("columns", SNAPSHOT_INDEX_BUILDERS["columns"])
+        mask = index.filter_mask(query_filter) & columns.passes(features, search_request.filters or {}, neighborhood_data)
+        rows = index.search(query_vector, mask, search_request.top_k)
+    except Exception as e:
+        print(f"⚠️ In-memory vector search failed, using Qdrant: {e}")
+        return None
+    print(f"✅ {len(rows)} propiedades pasaron los filtros (índice vectorial en memoria, {int(mask.sum())} candidatas)")
+    return [columns.payloads[row] for row in rows]
+
+# --- Adaptive Paging ---
+# Qdrant ya aplica los filtros estructurados, pero parte de los hits todavía cae en los filtros de texto
+# y de barrio. En vez de un over-fetch fijo, se pagina con offsets y el tamaño de cada página sale de
+# la tasa de aprobación observada para esa combinación de filtros.
+
+PAGING_MIN_PASS_RATE = 0.02
+PAGING_SAFETY_FACTOR = 1.5
+PAGING_MIN_PAGE = 10
+PAGING_EWMA_ALPHA = 0.3
+PAGING_MAX_SIGNATURES = 512
+
+def _filter_signature(search_request: SearchRequestModel, features: dict, neighborhood_data: dict = None) -> str:
+    """Clave de la combinación de filtros de una búsqueda (los valores de texto libre no cuentan)."""
+    parts = []
+    if features.get("search_mode") == "ambientes" and features.get("ambientes") is not None:
+        parts.append(f"ambientes={features['ambientes']}")
+    elif features.get("bedrooms") is not None:
+        parts.append(f"bedrooms={features['bedrooms']}")
+    if features.get("bathrooms") is not None:
+        parts.append(f"bathrooms={features['bathrooms']}")
+    if features.get("property_types"):
+        parts.append("type=" + "|".join(sorted(features["property_types"])))
+    if neighborhood_data:
+        parts.append(f"neighborhood={neighborhood_data.get('slug') or neighborhood_data.get('name')}")
+    elif features.get("neighborhoods"):
+        parts.append("neighborhood_text")
+    if search_request.filters:
+        parts.append("filters=" + "|".join(sorted(search_request.filters)))
+    return ",".join(parts) or "none"
+
+
+class PassRateEstimator:
+    """Tasa de aprobación (hits que pasan PropertyColumns.passes / hits traídos) por combinación de filtros, con EWMA."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signatures = OrderedDict()
+
+    def _entry(self, signature: str) -> dict:
+        entry = self._signatures.get(signature)
+        if entry is None:
+            entry = {"rate": None, "searches": 0, "pages": 0, "fetched": 0, "passed": 0, "short": 0}
+            self._signatures[signature] = entry
+            while len(self._signatures) > PAGING_MAX_SIGNATURES:
+                self._signatures.popitem(last=False)
+        else:
+            self._signatures.move_to_end(signature)
+        return entry
+
+    def page_size(self, signature: str, needed: int) -> int:
+        """Hits a pedir para conseguir `needed` aprobados con la tasa estimada."""
+        max_page = settings.get("search_max_page_size", 256)
+        with self._lock:
+            entry = self._signatures.get(signature)
+            rate = entry["rate"] if entry else None
+        if rate is None:
+            return min(max(needed * 3, 50), max_page)
+        size = math.ceil(needed / max(rate, PAGING_MIN_PASS_RATE) * PAGING_SAFETY_FACTOR)
+        return int(min(max(size, needed, PAGING_MIN_PAGE), max_page))
+
+    def observe(self, signature: str, fetched: int, passed: int):
+        if not fetched:
+            return
+        with self._lock:
+            entry = self._entry(signature)
+            rate = passed / fetched
+            entry["rate"] = rate if entry["rate"] is None else (1 - PAGING_EWMA_ALPHA) * entry["rate"] + PAGING_EWMA_ALPHA * rate
+            entry["pages"] += 1
+            entry["fetched"] += fetched
+            entry["passed"] += passed
+
+    def record_search(self, signature: str, satisfied: bool):
+        with self._lock:
+            entry = self._entry(signature)
+            entry["searches"] += 1
+            if not satisfied:
+                entry["short"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = [(signature, dict(entry)) for signature, entry in self._signatures.items()]
+        searches = sum(entry["searches"] for _, entry in entries)
+        pages = sum(entry["pages"] for _, entry in entries)
+        fetched = sum(entry["fetched"] for _, entry in entries)
+        entries.sort(key=lambda item: item[1]["searches"], reverse=True)
+        return {
+            "searches": searches,
+            "avg_pages": round(pages / searches, 2) if searches else None,
+            "pass_rate": round(sum(entry["passed"] for _, entry in entries) / fetched, 3) if fetched else None,
+            "short_results": sum(entry["short"] for _, entry in entries),
+            "signatures": {
+                signature: {
+                    "rate": round(entry["rate"], 3) if entry["rate"] is not None else None,
+                    "searches": entry["searches"],
+                    "avg_pages": round(entry["pages"] / entry["searches"], 2) if entry["searches"] else None,
+                    "fetched": entry["fetched"],
+                    "passed": entry["passed"],
+                    "short": entry["short"],
+                }
+                for signature, entry in entries[:50]
+            },
+        }
+
+
+pass_rate_estimator = PassRateEstimator()
+
+async def _qdrant_search_page(query_vector: list, query_filter, limit: int, offset: int = 0) -> list:
+    search_kwargs = dict(
+        collection_name=settings["collection_name"],
+        query_vector=query_vector,
+        limit=limit,
+        offset=offset,
+        query_filter=query_filter,
+        search_params=models.SearchParams(hnsw_ef=128, exact=False),
+    )
+    if async_qdrant_cli is not None:
+        return await async_qdrant_cli.search(**search_kwargs)
+    return await asyncio.to_thread(qdrant_cli.search, **search_kwargs)
+
+async def _paged_vector_search(search_request: SearchRequestModel, features: dict, query_filter, neighborhood_data: dict,
+                               query_vector: list, first_page: tuple = None) -> list:
+    """Pagina la búsqueda vectorial hasta juntar top_k hits que pasan los filtros (o agotar la colección).
+
+    `first_page` = (hits, limit) si la primera página ya se trajo (por ejemplo en un search_batch).
+    """
+    if first_page is None and _in_memory_vector_index(len(query_vector))[1] is not None:
+        # Producto de matrices sobre toda la colección: fuera del event loop
+        properties = await asyncio.to_thread(_local_vector_search, search_request, features, query_filter, neighborhood_data, query_vector)
+        if properties is not None:
+            return properties
+
+    top_k = search_request.top_k
+    signature = _filter_signature(search_request, features, neighborhood_data)
+    max_pages = max(settings.get("search_max_pages", 5), 1)
+    properties, offset, pages = [], 0, 0
+    limit = pass_rate_estimator.page_size(signature, top_k)
+    while pages < max_pages:
+        if pages == 0 and first_page is not None:
+            hits, limit = first_page
+        else:
+            hits = await _qdrant_search_page(query_vector, query_filter, limit, offset)
+        pages += 1
+
+        # Filtros en lote sobre toda la página (la tasa observada no depende de dónde se corte)
+        passes, _ = await _evaluate_candidates_async(hits, features, search_request.filters or {}, neighborhood_data, with_scores=False)
+        pass_rate_estimator.observe(signature, len(hits), sum(passes))
+        for hit, passed in zip(hits, passes):
+            if passed and len(properties) < top_k:
+                properties.append(hit.payload)
+
+        offset += len(hits)
+        if len(properties) >= top_k or len(hits) < limit:
+            break
+        limit = pass_rate_estimator.page_size(signature, top_k - len(properties))
+
+    pass_rate_estimator.record_search(signature, len(properties) >= top_k)
+    print(f"✅ {len(properties)} propiedades pasaron los filtros ({pages} página(s), {offset} hits de Qdrant)")
+    return properties
+
+# --- Hybrid Retrieval ---
+# Las dos patas de /search (vectorial en Qdrant y keywords BM25) corren en paralelo y se fusionan
+# con Reciprocal Rank Fusion, dentro de un único presupuesto de latencia.
+
+async def _vector_search(search_request: SearchRequestModel, features: dict, query_filter, neighborhood_data: dict, embedding) -> list:
+    """Pata vectorial: embedding de la consulta (ya en curso) + búsqueda paginada en Qdrant + filtros en lote. Propaga los errores."""
+    query_vector = await embedding
+    print(f"✅ Embedding generado (dimensión: {len(query_vector)})")
+    return await _paged_vector_search(search_request, features, query_filter, neighborhood_data, query_vector)
+
+def _payload_identity(payload: dict):
+    for field in PROPERTY_ID_FIELDS:
+        value = payload.get(field)
+        if value is not None:
+            return str(value)
+    return id(payload)
+
+def _rrf_fuse(ranked_lists: list, limit: int, k: int = 60) -> list:
+    """Reciprocal Rank Fusion: cada lista aporta 1 / (k + posición) a cada propiedad."""
+    scores, payloads, first_seen = {}, {}, {}
+    for ranked in ranked_lists:
+        for rank, payload in enumerate(ranked, start=1):
+            key = _payload_identity(payload)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            payloads.setdefault(key, payload)
+            first_seen.setdefault(key, len(first_seen))
+    ordered = sorted(scores, key=lambda key: (-scores[key], first_seen[key]))
+    return [payloads[key] for key in ordered[:limit]]
+
+
+class HybridSearchStats:
+    """Contadores de la búsqueda híbrida: latencias, timeouts y errores por pata."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.degraded = 0
+        self.legs = {}
+
+    def record_search(self, complete: bool):
+        with self._lock:
+            self.searches += 1
+            if not complete:
+                self.degraded += 1
+
+    def record(self, leg: str, outcome: str, elapsed_ms: float = None):
+        with self._lock:
+            entry = self.legs.setdefault(leg, {"ok": 0, "timeout": 0, "error": 0, "total_ms": 0.0, "max_ms": 0.0})
+            entry[outcome] += 1
+            if elapsed_ms is not None:
+                entry["total_ms"] += elapsed_ms
+                entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+
+    def stats(self) -> dict:
+        with self._lock:
+            legs = {}
+            for leg, entry in self.legs.items():
+                finished = entry["ok"] + entry["error"]
+                legs[leg] = {
+                    "ok": entry["ok"],
+                    "timeout": entry["timeout"],
+                    "error": entry["error"],
+                    "avg_ms": round(entry["total_ms"] / finished, 1) if finished else None,
+                    "max_ms": round(entry["max_ms"], 1),
+                }
+            return {"searches": self.searches, "degraded": self.degraded, "legs": legs}
+
+
+hybrid_search_stats = HybridSearchStats()
+
+async def _timed_leg(timings: dict, leg: str, awaitable):
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[leg] = (time.perf_counter() - started) * 1000
+
+async def _hybrid_search(search_request: SearchRequestModel, neighborhood_data: dict = None, vector_leg=None):
+    """Corre las patas vectorial y por keywords en paralelo y fusiona sus rankings con RRF.
+
+    `vector_leg` es la corrutina de la pata vectorial (None = sin pata vectorial).
+    Devuelve (propiedades, completo). completo es False si alguna pata no terminó dentro de
+    SEARCH_LATENCY_BUDGET_MS o falló; en ese caso se usa lo que haya llegado a tiempo.
+    """
+    budget = settings.get("search_latency_budget_ms", 2500) / 1000.0
+    timings = {}
+    legs = {
+        "keyword": asyncio.create_task(_timed_leg(
+            timings, "keyword", asyncio.to_thread(_fallback_semantic_search, search_request, neighborhood_data)
+        ))
+    }
+    if vector_leg is not None:
+        legs["vector"] = asyncio.create_task(_timed_leg(timings, "vector", vector_leg))
+
+    await asyncio.wait(legs.values(), timeout=budget)
+    ranked_lists, complete, timed_out = [], True, False
+    for leg in ("vector", "keyword"):
+        future = legs.get(leg)
+        if future is None:
+            continue
+        if not future.done():
+            # La pata vectorial se cancela; la de keywords sigue en su thread pero se descarta
+            future.cancel()
+            hybrid_search_stats.record(leg, "timeout")
+            print(f"⏱️ Pata '{leg}' excedió el presupuesto de {budget * 1000:.0f} ms")
+            complete, timed_out = False, True
+            continue
+        try:
+            ranked = future.result()
+        except Exception as e:
+            hybrid_search_stats.record(leg, "error", timings.get(leg))
+            print(f"❌ Error en la pata '{leg}': {e}")
+            complete = False
+            continue
+        hybrid_search_stats.record(leg, "ok", timings.get(leg))
+        print(f"✅ Pata '{leg}': {len(ranked)} propiedades")
+        ranked_lists.append(ranked)
 
-    scored_payloads.sort(key=lambda item: item[0], reverse=True)
-    result = [payload for _, payload in scored_payloads[: search_request.top_k]]
-    print(f"✅ Fallback retornó {len(result)} propiedades después de filtrar")
-    return result
+    hybrid_search_stats.record_search(complete)
+    if not ranked_lists and timed_out:
+        raise HTTPException(status_code=504, detail="Search timed out.")
+    return _rrf_fuse(ranked_lists, search_request.top_k, settings.get("rrf_k", 60)), complete
 
 # --- API Endpoints ---
 
@@ -946,8 +3829,58 @@ def test_property_endpoint():
     }
 
 
+# --- Conditional GET ---
+# Los endpoints de lectura derivan un ETag fuerte del digest del snapshot (contenido de la colección)
+# más la ruta y los query params (bbox, zoom, cursor, proyección...). Si coincide con If-None-Match
+# se responde 304 sin tocar Qdrant ni serializar nada.
+
+def _collection_etag(request: Request, snapshot: PropertySnapshot = None):
+    """ETag de la respuesta para la versión actual de la colección; None si no hay snapshot."""
+    snapshot = snapshot or property_snapshot.ensure_loaded()
+    if snapshot is None:
+        return None
+    params = "&".join(f"{key}={value}" for key, value in sorted(request.query_params.multi_items()))
+    raw = f"{snapshot.digest}|{request.url.path}|{params}".encode("utf-8")
+    return '"' + hashlib.blake2b(raw, digest_size=12).hexdigest() + '"'
+
+def _not_modified(request: Request, etag: str, cache_control: str):
+    """Respuesta 304 si If-None-Match coincide con el ETag; None si hay que mandar el cuerpo.
+
+    "*" coincide con cualquier representación: llamarla recién cuando se sabe que el recurso existe.
+    """
+    header = request.headers.get("if-none-match")
+    if not etag or not header:
+        return None
+    # If-None-Match usa comparación débil: W/"x" equivale a "x"
+    tags = [tag.strip() for tag in header.split(",")]
+    if "*" in tags or any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+def _conditional_headers(etag: str, cache_control: str, **extra) -> dict:
+    headers = {"Cache-Control": cache_control, **extra}
+    if etag:
+        headers["ETag"] = etag
+    return headers
+
+# Listados y detalle: el cliente guarda la respuesta pero revalida siempre con el ETag
+PROPERTY_CACHE_CONTROL = "public, no-cache"
+GEOJSON_CACHE_CONTROL = "public, max-age=30"
+
+
 @app.get("/properties/all", summary="Get All Properties")
-def get_all_properties(request: Request):
+def get_all_properties(
+    request: Request,
+    cursor: str = Query(None, description="Cursor returned by the previous page (next_cursor / X-Next-Cursor)"),
+    limit: int = Query(None, ge=1, le=PROPERTIES_PAGE_SIZE, description="Page size (max 1000)"),
+    stream: bool = Query(False, description="Stream the whole collection as NDJSON, one property per line"),
+):
+    """
+    Sin parámetros devuelve la primera página (hasta 1000) como lista, como siempre; si hay más,
+    el header X-Next-Cursor trae el cursor de la siguiente. Con cursor y/o limit devuelve
+    {"properties", "next_cursor", "count"}. Con stream=true recorre la colección entera en NDJSON
+    sin armar la lista en memoria.
+    """
     tenant_id = getattr(request.state, "tenant_id", None)
     
     # NUEVA LÓGICA: Siempre mostrar todas las propiedades
@@ -955,110 +3888,169 @@ def get_all_properties(request: Request):
     print(f"Fetching all properties for tenant: {tenant_id} (all properties visible to all tenants)")
 
     try:
-        results, _ = qdrant_cli.scroll(
-            collection_name=settings["collection_name"],
-            limit=1000,
-            with_payload=True,
-            with_vectors=False,
-            scroll_filter=None  # No filter - show all properties
-        )
+        offset = _decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+    snapshot = property_snapshot.ensure_loaded()
+    etag = _collection_etag(request, snapshot)
+    not_modified = _not_modified(request, etag, PROPERTY_CACHE_CONTROL)
+    if not_modified is not None:
+        return not_modified
+
+    if stream:
+        def ndjson_lines():
+            # Una página a la vez: la memoria no crece con el tamaño del catálogo. Se recorre la misma
+            # versión del snapshot que generó el ETag, aunque se publique otra durante el stream
+            for payloads in _iter_property_pages(snapshot, limit or PROPERTIES_PAGE_SIZE):
+                yield "".join(json.dumps(payload, default=str) + "\n" for payload in payloads)
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson", headers=_conditional_headers(etag, PROPERTY_CACHE_CONTROL))
+
+    try:
+        payloads, next_offset = _property_page(offset, limit or PROPERTIES_PAGE_SIZE, snapshot)
         # --- DEBUGGING PRINT ---
-        print(f"Qdrant query returned {len(results)} properties for tenant {tenant_id}.")
+        print(f"Returned {len(payloads)} properties for tenant {tenant_id} (more: {next_offset is not None}).")
         # --- END DEBUGGING ---
-        return [record.payload for record in results]
     except Exception as e:
         print(f"Error retrieving all properties: {e}")
         raise HTTPException(status_code=500, detail="Could not retrieve properties from the database.")
 
+    next_cursor = _encode_cursor(next_offset) if next_offset is not None else None
+    headers = _conditional_headers(etag, PROPERTY_CACHE_CONTROL)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if cursor is None and limit is None:
+        return Response(content=_dumps_json(payloads), media_type="application/json", headers=headers)
+    return Response(
+        content=_dumps_json({"properties": payloads, "next_cursor": next_cursor, "count": len(payloads)}),
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+def _properties_in_bbox(minx: float, miny: float, maxx: float, maxy: float) -> list:
+    """Propiedades dentro del bbox como [(payload, lat, lng)], usando el índice espacial del snapshot."""
+    snapshot = property_snapshot.ensure_loaded()
+    if snapshot is not None:
+        spatial = snapshot.derived("spatial", SpatialIndex)
+        return [
+            (snapshot.records[point_id], *spatial.coords[point_id])
+            for point_id in spatial.query_bbox(minx, miny, maxx, maxy)
+        ]
+
+    # Sin snapshot: recorrer la colección en Qdrant página por página y filtrar en Python
+    matches = []
+    for payloads in _iter_property_pages(None):
+        for payload in payloads:
+            lat, lng = _extract_property_coords(payload)
+            if lat is not None and minx <= lng <= maxx and miny <= lat <= maxy:
+                matches.append((payload, lat, lng))
+    return matches
+
+
+# Proyecciones de /properties/geojson: los pines del mapa solo necesitan id, precio, tipo y una miniatura;
+# las tarjetas, lo que muestra PropertyCard. "full" es el payload completo (comportamiento original).
+# "card" no trae descripción, amenities, tour ni plano: PropertyMap completa la propiedad con
+# GET /properties?ids=...&profile=full al abrir PropertyModal.
+GEOJSON_PROFILES = {
+    "pin": ("id", "price", "currency", "property_type", "tipo_operacion", "hasVirtualTour", "isNew", "thumbnail"),
+    "card": (
+        "id", "price", "currency", "property_type", "tipo_operacion", "hasVirtualTour", "isNew", "thumbnail",
+        "title", "address", "zone", "localidad", "neighborhood", "ambientes", "bedrooms", "bathrooms",
+        "garage_count", "area_m2", "total_surface", "price_per_m2", "expenses", "badge", "realty", "images",
+    ),
+    "full": None,
+}
+
+def _projection_fields(profile: str, fields: str):
+    """Campos a devolver: `fields` (lista separada por comas) pisa al perfil; None = payload completo."""
+    if fields:
+        return tuple(dict.fromkeys(["id"] + [field.strip() for field in fields.split(",") if field.strip()]))
+    return GEOJSON_PROFILES[profile]
+
+def _project_payload(payload: dict, fields) -> dict:
+    if fields is None:
+        return {**payload, "images": payload.get('images', [])}
+    projected = {}
+    for field in fields:
+        if field == "thumbnail":
+            images = payload.get("images") or payload.get("images_array") or []
+            projected["thumbnail"] = images[0] if images else None
+        elif field in payload:
+            projected[field] = payload[field]
+    return projected
+
+def _point_feature(payload: dict, lat: float, lng: float, fields=None) -> dict:
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [lng, lat]
+        },
+        "properties": _project_payload(payload, fields)
+    }
+
+def _dumps_json(content) -> bytes:
+    """Serializa con orjson si está instalado (varias veces más rápido que json.dumps)."""
+    if orjson is not None:
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=str).encode("utf-8")
+
 
 @app.get("/properties/geojson", summary="Get Properties by Viewport (BBOX)")
 def get_properties_geojson(
     request: Request,
     bbox: str = Query(..., description="Bounding box: minLon,minLat,maxLon,maxLat"),
     zoom: int = Query(12, description="Current map zoom level"),
-    limit: int = Query(1000, description="Max properties to return")
+    limit: int = Query(None, description="Optional cap on the number of properties returned"),
+    cluster: bool = Query(False, description="Return precomputed clusters (with counts and price ranges) at low zoom"),
+    profile: str = Query("full", description="Feature properties to return: pin, card or full"),
+    fields: str = Query(None, description="Comma-separated payload fields to return (overrides profile)")
 ):
     """
     Endpoint optimizado para cargar propiedades solo en el viewport visible.
-    Retorna GeoJSON con las propiedades dentro del bounding box especificado.
+    Retorna GeoJSON con todas las propiedades dentro del bounding box especificado.
+    Con cluster=true, en zooms <= CLUSTER_MAX_ZOOM devuelve clusters calculados sobre toda la colección.
+    profile=pin|card (o fields=) recorta las properties de cada feature a los campos que usa el mapa.
     """
     tenant_id = getattr(request.state, "tenant_id", None)
+    if profile not in GEOJSON_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Invalid profile. Use one of: {', '.join(GEOJSON_PROFILES)}")
+    projection = _projection_fields(profile, fields)
+    
+    etag = _collection_etag(request)
+    not_modified = _not_modified(request, etag, GEOJSON_CACHE_CONTROL)
+    if not_modified is not None:
+        return not_modified
     
     try:
         # Parsear bbox
         minx, miny, maxx, maxy = map(float, bbox.split(","))
         
-        # Ajustar límite según zoom (menos propiedades en zooms bajos)
-        if zoom < 10:
-            limit = min(limit, 300)
-        elif zoom < 12:
-            limit = min(limit, 700)
-        
         print(f"Fetching properties in BBOX: [{minx}, {miny}, {maxx}, {maxy}] at zoom {zoom} for tenant {tenant_id}")
-        print(f"Collection name: {settings['collection_name']}")
-        
-        # Obtener propiedades de Qdrant
-        results, _ = qdrant_cli.scroll(
-            collection_name=settings["collection_name"],
-            limit=limit,
-            with_payload=True,
-            with_vectors=False,
-            scroll_filter=None
-        )
         
-        print(f"Qdrant returned {len(results)} properties")
-        
-        # Filtrar propiedades dentro del bbox
-        features = []
-        print(f"Processing {len(results)} properties from Qdrant...")
-        print(f"BBOX: [{minx}, {miny}, {maxx}, {maxy}]")
+        features = None
+        snapshot = property_snapshot.ensure_loaded() if cluster else None
+        if snapshot is not None:
+            nodes = snapshot.derived("clusters", PropertyClusterIndex).query(minx, miny, maxx, maxy, zoom)
+            if nodes is not None:
+                spatial = snapshot.derived("spatial", SpatialIndex)
+                features = []
+                for node in nodes:
+                    if node.point_id is not None:
+                        lat, lng = spatial.coords[node.point_id]
+                        features.append(_point_feature(snapshot.records[node.point_id], lat, lng, projection))
+                    else:
+                        features.append(_cluster_feature(node))
+                print(f"Returning {len(features)} clustered features at zoom {zoom}")
         
-        for record in results:
-            try:
-                payload = record.payload
-                
-                # Obtener coordenadas (soportar múltiples formatos)
-                lat = payload.get('lat') or payload.get('latitude') or payload.get('latitud')
-                lng = payload.get('lng') or payload.get('longitude') or payload.get('longitud') or payload.get('lon')
-                
-                # Si no hay coordenadas directas, intentar parsear location
-                if not lat or not lng:
-                    location = payload.get('location')
-                    if location and isinstance(location, str) and 'POINT' in location:
-                        import re
-                        match = re.search(r'POINT\s*\(\s*(-?[0-9.]+)\s+(-?[0-9.]+)\s*\)', location)
-                        if match:
-                            lng = float(match.group(1))
-                            lat = float(match.group(2))
-            except Exception as e:
-                print(f"Error processing property: {e}")
-                continue
-            
-            # Convertir a float si es necesario
-            try:
-                lat = float(lat) if lat else None
-                lng = float(lng) if lng else None
-            except (ValueError, TypeError):
-                continue
-            
-            # Debug: mostrar coordenadas de cada propiedad
-            print(f"Property {payload.get('id')}: lat={lat}, lng={lng}")
-            
-            # Verificar que esté dentro del bbox
-            if lat and lng and minx <= lng <= maxx and miny <= lat <= maxy:
-                # Construir feature GeoJSON
-                feature = {
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [lng, lat]
-                    },
-                    "properties": {
-                        **payload,
-                        "images": payload.get('images', [])
-                    }
-                }
-                features.append(feature)
+        if features is None:
+            # Consultar el índice espacial (todas las propiedades del bbox, no solo la primera página)
+            matches = _properties_in_bbox(minx, miny, maxx, maxy)
+            if limit is not None and len(matches) > limit:
+                print(f"Truncating {len(matches)} matches to limit={limit}")
+                matches = matches[:limit]
+            features = [_point_feature(payload, lat, lng, projection) for payload, lat, lng in matches]
         
         # Construir GeoJSON
         geojson = {
@@ -1068,18 +4060,10 @@ def get_properties_geojson(
         
         print(f"Returning {len(features)} properties in viewport")
         
-        # Si no hay propiedades, devolver GeoJSON vacío en lugar de error
-        if len(features) == 0:
-            print("No properties found in bbox, returning empty GeoJSON")
-            print("DEBUG: This should return empty GeoJSON, not error")
-        
         return Response(
-            content=json.dumps(geojson),
+            content=_dumps_json(geojson),
             media_type="application/geo+json",
-            headers={
-                "Cache-Control": "public, max-age=30",
-                "Access-Control-Allow-Origin": "*"
-            }
+            headers=_conditional_headers(etag, GEOJSON_CACHE_CONTROL, **{"Access-Control-Allow-Origin": "*"})
         )
         
     except ValueError as e:
@@ -1089,61 +4073,120 @@ def get_properties_geojson(
         raise HTTPException(status_code=500, detail="Could not retrieve properties.")
 
 
+# Tiles: URL fija por tile, la CDN puede cachearlas; después de un minuto se revalidan con el ETag
+TILE_CACHE_CONTROL = "public, max-age=60"
+
+@app.get("/properties/tiles/{z}/{x}/{y}.mvt", summary="Property Map Vector Tile")
+def get_property_tile(request: Request, z: int, x: int, y: int):
+    """
+    Tile Mapbox Vector Tile con la capa "properties" (pines con los campos del perfil pin) y, hasta
+    CLUSTER_MAX_ZOOM, la capa "clusters" (mismos clusters que /properties/geojson?cluster=true).
+    """
+    if not 0 <= z <= MVT_MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(status_code=400, detail="Invalid tile coordinates.")
+
+    snapshot = property_snapshot.ensure_loaded()
+    etag = _collection_etag(request, snapshot)
+    not_modified = _not_modified(request, etag, TILE_CACHE_CONTROL)
+    if not_modified is not None:
+        return not_modified
+
+    try:
+        tile = tile_cache.get(snapshot.version, (z, x, y)) if snapshot is not None else None
+        if tile is None:
+            tile = _encode_property_tile(snapshot, z, x, y)
+            if snapshot is not None:
+                tile_cache.put(snapshot.version, (z, x, y), tile)
+    except Exception as e:
+        print(f"Error building tile {z}/{x}/{y}: {e}")
+        raise HTTPException(status_code=500, detail="Could not build tile.")
+
+    return Response(
+        content=tile,
+        media_type="application/vnd.mapbox-vector-tile",
+        headers=_conditional_headers(etag, TILE_CACHE_CONTROL),
+    )
+
+
+PROPERTY_BATCH_MAX_IDS = 200
+
+def _property_batch_response(ids: list, profile: str, fields: str, request: Request = None) -> Response:
+    """Propiedades en el orden de `ids` (null si no existe) proyectadas con el perfil o los campos pedidos.
+
+    Con `request` la respuesta es condicional (ETag / If-None-Match), salvo que alguna propiedad haya
+    salido de Qdrant en vez del snapshot.
+    """
+    if len(ids) > PROPERTY_BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"Too many ids (max {PROPERTY_BATCH_MAX_IDS}).")
+    if profile not in GEOJSON_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Invalid profile. Use one of: {', '.join(GEOJSON_PROFILES)}")
+    projection = _projection_fields(profile, fields)
+    try:
+        payloads, source = _lookup_property_payloads(ids)
+    except Exception as e:
+        print(f"Error hydrating properties: {e}")
+        raise HTTPException(status_code=500, detail="Could not retrieve properties.")
+    headers = None
+    if request is not None:
+        etag = _collection_etag(request, source) if source is not None else None
+        not_modified = _not_modified(request, etag, PROPERTY_CACHE_CONTROL)
+        if not_modified is not None:
+            return not_modified
+        headers = _conditional_headers(etag, PROPERTY_CACHE_CONTROL)
+    return Response(
+        content=_dumps_json({
+            "properties": [_project_payload(payload, projection) if payload is not None else None for payload in payloads],
+            "missing": [property_id for property_id, payload in zip(ids, payloads) if payload is None],
+        }),
+        media_type="application/json",
+        headers=headers,
+    )
+
+@app.post("/properties/batch", summary="Get Properties by IDs")
+def get_properties_batch(batch_request: PropertyBatchRequestModel):
+    """
+    Varias propiedades por id (id, property_id, uuid o id de punto) en un solo request, en el orden
+    pedido. Para favoritos, historial, visitas y el agente, en lugar de un /properties/{id} por propiedad.
+    """
+    fields = ",".join(batch_request.fields) if batch_request.fields else None
+    return _property_batch_response(batch_request.ids, batch_request.profile, fields)
+
+@app.get("/properties", summary="Get Properties by IDs")
+def get_properties_by_ids(
+    request: Request,
+    ids: str = Query(..., description="Comma-separated property ids"),
+    profile: str = Query("full", description="Properties fields to return: pin, card or full"),
+    fields: str = Query(None, description="Comma-separated payload fields to return (overrides profile)")
+):
+    """Como POST /properties/batch, pero cacheable: responde con ETag y acepta If-None-Match."""
+    property_ids = [property_id.strip() for property_id in ids.split(",") if property_id.strip()]
+    return _property_batch_response(property_ids, profile, fields, request)
+
+
+@app.get("/properties/snapshot/status", summary="Property Snapshot Status")
+def get_snapshot_status():
+    """Versión, tamaño y antigüedad del snapshot en memoria de la colección."""
+    return property_snapshot.status()
+
+
 @app.get("/properties/{property_id}", summary="Get Property Details")
 def get_property_details(property_id: str, request: Request):
     """Get detailed information for a specific property by ID."""
     try:
-        # Search for the property in Qdrant - try different ID field names
-        results = None
-        
-        # Try searching by 'id' field first
-        try:
-            results = qdrant_cli.scroll(
-                collection_name=settings["collection_name"],
-                limit=1,
-                with_payload=True,
-                with_vectors=False,
-                scroll_filter=models.Filter(
-                    must=[models.FieldCondition(key="id", match=models.MatchValue(value=property_id))]
-                )
-            )[0]
-        except:
-            pass
-        
-        # If not found, try searching by 'property_id' field
-        if not results:
-            try:
-                results = qdrant_cli.scroll(
-                    collection_name=settings["collection_name"],
-                    limit=1,
-                    with_payload=True,
-                    with_vectors=False,
-                    scroll_filter=models.Filter(
-                        must=[models.FieldCondition(key="property_id", match=models.MatchValue(value=property_id))]
-                    )
-                )[0]
-            except:
-                pass
-        
-        # If still not found, try searching by 'uuid' field
-        if not results:
-            try:
-                results = qdrant_cli.scroll(
-                    collection_name=settings["collection_name"],
-                    limit=1,
-                    with_payload=True,
-                    with_vectors=False,
-                    scroll_filter=models.Filter(
-                        must=[models.FieldCondition(key="uuid", match=models.MatchValue(value=property_id))]
-                    )
-                )[0]
-            except:
-                pass
+        payloads, source = _lookup_property_payloads([property_id])
+        payload = payloads[0]
         
-        if not results:
+        if not payload:
             raise HTTPException(status_code=404, detail="Property not found.")
+
+        # If-None-Match recién con la propiedad resuelta; sin ETag si salió de Qdrant y no del snapshot
+        etag = _collection_etag(request, source) if source is not None else None
+        not_modified = _not_modified(request, etag, PROPERTY_CACHE_CONTROL)
+        if not_modified is not None:
+            return not_modified
         
-        property_data = results[0].payload
+        # Copia para no modificar el payload compartido del snapshot
+        property_data = dict(payload)
         
         # Generate proxy URLs for images
         images = property_data.get("images", []) or property_data.get("images_array", [])
@@ -1160,10 +4203,11 @@ def get_property_details(property_id: str, request: Request):
         property_data["images"] = proxy_images
         property_data["images_array"] = proxy_images
         
-        return {
-            "property": property_data,
-            "total_images": len(images)
-        }
+        return Response(
+            content=json.dumps({"property": property_data, "total_images": len(images)}, default=str),
+            media_type="application/json",
+            headers=_conditional_headers(etag, PROPERTY_CACHE_CONTROL),
+        )
         
     except HTTPException:
         raise
@@ -1173,7 +4217,7 @@ def get_property_details(property_id: str, request: Request):
 
 
 @app.post("/search", summary="Semantic Property Search")
-def search(request: Request, search_request: SearchRequestModel):
+async def search(request: Request, search_request: SearchRequestModel):
     tenant_id = getattr(request.state, "tenant_id", None)
 
     print(f"🔍 Performing search for tenant: {tenant_id}")
@@ -1181,8 +4225,51 @@ def search(request: Request, search_request: SearchRequestModel):
     print(f"🔍 Filters: {search_request.filters}")
     print(f"🔍 Top K: {search_request.top_k}")
 
-    properties = []
-    features = _parse_query_features(search_request.query)
+    cache_key = SearchResultCache.make_key(search_request, tenant_id)
+    version = _collection_version()
+    cached = search_result_cache.get(cache_key, version)
+    if cached is not None:
+        print(f"✅ Resultado obtenido de la cache (versión {version})")
+        return cached
+
+    result, complete = await _execute_search(search_request)
+    if complete:
+        # Un resultado parcial (una pata fuera de presupuesto o con error) no se cachea
+        search_result_cache.put(cache_key, version, result)
+    return result
+
+
+async def _execute_search(search_request: SearchRequestModel):
+    """Pipeline completo de /search: parseo, barrio, embeddings, Qdrant, filtros, fallback y alternativas.
+
+    Devuelve (resultado, completo); completo es False si la búsqueda híbrida se degradó.
+    """
+    # El embedding solo depende del texto: arranca ya, en paralelo con el parseo y la búsqueda del barrio
+    embedding = None
+    if _embeddings_available():
+        embedding = asyncio.ensure_future(_get_query_embedding_async(search_request.query))
+    try:
+        features, neighborhood_data = await asyncio.to_thread(_analyse_query, search_request.query)
+        query_filter = _build_query_filter(search_request, features, neighborhood_data)
+        vector_leg = None
+        if embedding is not None:
+            vector_leg = _vector_search(search_request, features, query_filter, neighborhood_data, embedding)
+        return await _search_pipeline(search_request, features, neighborhood_data, vector_leg)
+    finally:
+        _discard_task(embedding)
+
+def _discard_task(task):
+    """Cancela una tarea auxiliar que ya no hace falta (o marca como leída su excepción)."""
+    if task is None:
+        return
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
+
+def _analyse_query(query: str):
+    """Features de la consulta y barrio mencionado (puede consultar Supabase si el gazetteer no está cargado)."""
+    features = _parse_query_features(query)
     
     # Buscar barrio mencionado en la query
     neighborhood_data = None
@@ -1193,7 +4280,10 @@ def search(request: Request, search_request: SearchRequestModel):
             if neighborhood_data:
                 print(f"✅ Barrio encontrado: {neighborhood_data['name']} (bbox: {neighborhood_data['bbox']})")
                 break
+    return features, neighborhood_data
 
+def _build_query_filter(search_request: SearchRequestModel, features: dict, neighborhood_data: dict = None):
+    """Filtro de Qdrant a partir de los filtros del request, el barrio y las features de la consulta."""
     # Construir filtros de Qdrant
     qdrant_conditions = []
     
@@ -1215,24 +4305,11 @@ def search(request: Request, search_request: SearchRequestModel):
     # Agregar filtros geográficos si se encontró un barrio
     if neighborhood_data and neighborhood_data.get("bbox"):
         bbox = neighborhood_data["bbox"]
-        if bbox.get("min_lat") and bbox.get("max_lat") and bbox.get("min_lon") and bbox.get("max_lon"):
-            # Filtrar por latitud (bbox)
-            qdrant_conditions.append(models.FieldCondition(
-                key="latitude",
-                range=models.Range(
-                    gte=float(bbox["min_lat"]),
-                    lte=float(bbox["max_lat"])
-                )
-            ))
-            # Filtrar por longitud (bbox)
-            qdrant_conditions.append(models.FieldCondition(
-                key="longitude",
-                range=models.Range(
-                    gte=float(bbox["min_lon"]),
-                    lte=float(bbox["max_lon"])
-                )
-            ))
-            print(f"✅ Filtros geográficos aplicados: lat[{bbox['min_lat']}, {bbox['max_lat']}], lon[{bbox['min_lon']}, {bbox['max_lon']}]")
+        geo_condition = _geo_bbox_condition(bbox)
+        if geo_condition is not None:
+            # Poda espacial dentro de Qdrant usando el índice GEO
+            qdrant_conditions.append(geo_condition)
+            print(f"✅ Filtro geo_bounding_box aplicado: lat[{bbox['min_lat']}, {bbox['max_lat']}], lon[{bbox['min_lon']}, {bbox['max_lon']}]")
     
     # Aplicar filtros de características extraídas de la query
     search_mode = features.get("search_mode")
@@ -1312,95 +4389,140 @@ def search(request: Request, search_request: SearchRequestModel):
     
     if query_filter:
         print(f"✅ Filtros de Qdrant aplicados: {len(qdrant_conditions)} condiciones")
+    return query_filter
 
-    # Intentar búsqueda semántica con embeddings
-    embeddings_available = bool(settings.get("openai_api_key"))
-    if embeddings_available:
-        try:
-            print("🔍 Generando embedding con OpenAI...")
-            # Logging adicional para debuggear el problema del espacio
-            current_key = settings.get("openai_api_key", "")
-            if current_key:
-                print(f"🔍 DEBUG - API Key antes de llamada: length={len(current_key)}, ends_with_space={current_key.endswith(' ')}, repr={repr(current_key[-10:])}")
-            embedding_response = openai_cli.embeddings.create(
-                input=search_request.query,
-                model="text-embedding-3-small"
-            )
-            query_vector = embedding_response.data[0].embedding
-            print(f"✅ Embedding generado (dimensión: {len(query_vector)})")
-
-            # Búsqueda en Qdrant con filtros
-            search_limit = max(search_request.top_k * 3, 50)  # Buscar más resultados para filtrar después
-            print(f"🔍 Buscando en Qdrant con límite: {search_limit}")
-            
-            hits = qdrant_cli.search(
-                collection_name=settings["collection_name"],
-                query_vector=query_vector,
-                limit=search_limit,
-                query_filter=query_filter,
-                search_params=models.SearchParams(hnsw_ef=128, exact=False),
-            )
-
-            print(f"✅ Qdrant retornó {len(hits)} resultados")
-            
-            # Aplicar filtros adicionales de texto
-            for hit in hits:
-                payload = hit.payload
-                # Verificar que pase los filtros de texto (keywords, frases, etc.)
-                if _passes_filters(payload, features, search_request.filters or {}, neighborhood_data):
-                    properties.append(payload)
-                    if len(properties) >= search_request.top_k:
-                        break
-
-            print(f"✅ {len(properties)} propiedades pasaron los filtros de texto")
-            
-            if not properties:
-                print("⚠️ Embedding search retornó resultados pero ninguno pasó los filtros estructurados.")
-        except Exception as e:
-            print(f"❌ Error durante búsqueda con embeddings: {e}")
-            import traceback
-            traceback.print_exc()
-            properties = []
+async def _search_pipeline(search_request: SearchRequestModel, features: dict, neighborhood_data: dict, vector_leg):
+    """Recuperación (vectorial y/o keywords), alternativas y recorte a top_k. Devuelve (resultado, completo)."""
+    properties = []
+    complete = True
+    if settings.get("hybrid_search"):
+        # Ambas patas en paralelo: la latencia queda acotada por la más lenta, no por la suma
+        if vector_leg is None:
+            print("⚠️ OPENAI_API_KEY no configurada. Solo búsqueda por keywords.")
+        properties, complete = await _hybrid_search(search_request, neighborhood_data, vector_leg)
     else:
-        print("⚠️ OPENAI_API_KEY no configurada. Usando búsqueda por keywords.")
+        # Intentar búsqueda semántica con embeddings
+        if vector_leg is not None:
+            try:
+                properties = await vector_leg
+                if not properties:
+                    print("⚠️ Embedding search retornó resultados pero ninguno pasó los filtros estructurados.")
+            except Exception as e:
+                print(f"❌ Error durante búsqueda con embeddings: {e}")
+                import traceback
+                traceback.print_exc()
+                properties = []
+                # Resultado degradado al fallback: no debe quedar en la caché de búsquedas
+                complete = False
+        else:
+            print("⚠️ OPENAI_API_KEY no configurada. Usando búsqueda por keywords.")
 
-    # Si no hay resultados, usar fallback
-    if not properties:
-        print("🔄 Usando búsqueda fallback por keywords...")
-        properties = _fallback_semantic_search(search_request, neighborhood_data)
+        # Si no hay resultados, usar fallback
+        if not properties:
+            print("🔄 Usando búsqueda fallback por keywords...")
+            properties = await asyncio.to_thread(_fallback_semantic_search, search_request, neighborhood_data)
 
     if not properties:
         print("⚠️ No se encontraron propiedades")
-        # Buscar alternativas: si busca 1 ambiente, buscar 2 y 3 ambientes en el mismo barrio
-        alternative_properties = []
-        if search_mode == "ambientes" and desired_ambientes == 1 and neighborhood_data:
-            print("🔍 Buscando alternativas: propiedades con 2 o 3 ambientes en el mismo barrio...")
-            for alt_ambientes in [2, 3]:
-                alt_features = features.copy()
-                alt_features["ambientes"] = alt_ambientes
-                alt_features["bedrooms"] = alt_ambientes - 1
-                alt_search_request = SearchRequestModel(
-                    query=f"{search_request.query.replace('1 ambiente', f'{alt_ambientes} ambientes')}",
-                    top_k=3,
-                    filters=search_request.filters or {}
-                )
-                alt_results = _fallback_semantic_search(alt_search_request, neighborhood_data)
-                if alt_results:
-                    alternative_properties.extend(alt_results[:2])  # Máximo 2 por alternativa
-            if alternative_properties:
-                print(f"✅ Encontradas {len(alternative_properties)} propiedades alternativas (2-3 ambientes)")
-                # Retornar objeto con metadata para que el agente pueda sugerir alternativas
-                # El agente puede verificar si es un dict con 'alternatives' para manejar el caso
-                return {
-                    "properties": [],
-                    "alternatives": alternative_properties,
-                    "message": f"No encontré propiedades con exactamente 1 ambiente en {neighborhood_data.get('name', 'La Perla')}, pero encontré {len(alternative_properties)} propiedades con 2 o 3 ambientes en la misma zona."
-                }
+        # Buscar alternativas cercanas (otros ambientes/dormitorios, baños o un barrio vecino) en una sola pasada
+        # El agente puede verificar si es un dict con 'alternatives' para manejar el caso
+        alternatives = await asyncio.to_thread(_nearest_alternatives, search_request, features, neighborhood_data)
+        if alternatives:
+            return alternatives, complete
         # Si no hay alternativas o no aplica, retornar lista vacía normal
-        return []
+        return [], complete
 
     print(f"✅ Retornando {len(properties[:search_request.top_k])} propiedades")
-    return properties[: search_request.top_k]
+    return properties[: search_request.top_k], complete
+
+
+@app.post("/search/batch", summary="Batch Semantic Property Search")
+async def search_batch(request: Request, batch_request: SearchBatchRequestModel):
+    """Varias búsquedas en un request: un solo llamado de embeddings y un solo search_batch en Qdrant.
+
+    Devuelve {"results": [...]} con el mismo resultado que /search para cada búsqueda, en orden.
+    """
+    tenant_id = getattr(request.state, "tenant_id", None)
+    searches = batch_request.searches
+    max_size = settings.get("search_batch_max_size", 20)
+    if len(searches) > max_size:
+        raise HTTPException(status_code=400, detail=f"Too many searches in batch (max {max_size}).")
+    print(f"🔍 Performing batch of {len(searches)} searches for tenant: {tenant_id}")
+
+    version = _collection_version()
+    cache_keys = [SearchResultCache.make_key(search_request, tenant_id) for search_request in searches]
+    results = [search_result_cache.get(cache_key, version) for cache_key in cache_keys]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        computed = await _execute_search_batch([searches[i] for i in pending])
+        for i, (result, complete) in zip(pending, computed):
+            results[i] = result
+            if complete:
+                search_result_cache.put(cache_keys[i], version, result)
+    print(f"✅ Batch: {len(searches) - len(pending)} desde la cache, {len(pending)} ejecutadas")
+    return {"results": results}
+
+
+async def _execute_search_batch(search_requests: list) -> list:
+    """Como _execute_search para varias búsquedas, compartiendo el request de embeddings y el de Qdrant."""
+    embeddings = hits = None
+    if _embeddings_available():
+        embeddings = asyncio.ensure_future(_get_query_embeddings_async([r.query for r in search_requests]))
+    try:
+        analysed = await asyncio.to_thread(lambda: [_analyse_query(r.query) for r in search_requests])
+        query_filters = [
+            _build_query_filter(search_request, features, neighborhood_data)
+            for search_request, (features, neighborhood_data) in zip(search_requests, analysed)
+        ]
+        if embeddings is not None:
+            limits = [
+                pass_rate_estimator.page_size(_filter_signature(search_request, features, neighborhood_data), search_request.top_k)
+                for search_request, (features, neighborhood_data) in zip(search_requests, analysed)
+            ]
+            hits = asyncio.ensure_future(_search_batch_hits(query_filters, limits, embeddings))
+        return await asyncio.gather(*[
+            _search_pipeline(
+                search_request, features, neighborhood_data,
+                _batch_vector_leg(hits, i, search_request, features, query_filters[i], neighborhood_data) if hits is not None else None,
+            )
+            for i, (search_request, (features, neighborhood_data)) in enumerate(zip(search_requests, analysed))
+        ])
+    finally:
+        _discard_task(hits)
+        _discard_task(embeddings)
+
+async def _search_batch_hits(query_filters: list, limits: list, embeddings) -> tuple:
+    """Un único search_batch en Qdrant con el vector, el filtro y el tamaño de página de cada búsqueda.
+
+    Devuelve (vectores, páginas); los vectores se reutilizan si alguna búsqueda necesita más páginas.
+    Con el índice vectorial en memoria no hace falta ir a Qdrant: páginas es None.
+    """
+    vectors = await embeddings
+    if vectors and _in_memory_vector_index(len(vectors[0]))[1] is not None:
+        return vectors, None
+    requests = [
+        models.SearchRequest(
+            vector=vector,
+            filter=query_filter,
+            limit=limit,
+            with_payload=True,
+            params=models.SearchParams(hnsw_ef=128, exact=False),
+        )
+        for query_filter, limit, vector in zip(query_filters, limits, vectors)
+    ]
+    if async_qdrant_cli is not None:
+        results = await async_qdrant_cli.search_batch(collection_name=settings["collection_name"], requests=requests)
+    else:
+        results = await asyncio.to_thread(qdrant_cli.search_batch, collection_name=settings["collection_name"], requests=requests)
+    print(f"✅ Qdrant search_batch: {len(requests)} búsquedas, {sum(len(hits) for hits in results)} resultados")
+    return vectors, [(hits, request.limit) for hits, request in zip(results, requests)]
+
+async def _batch_vector_leg(hits, index: int, search_request: SearchRequestModel, features: dict, query_filter, neighborhood_data: dict = None) -> list:
+    # shield: si la pata de una búsqueda se cancela por presupuesto, el batch compartido sigue para las demás
+    vectors, pages = await asyncio.shield(hits)
+    return await _paged_vector_search(
+        search_request, features, query_filter, neighborhood_data, vectors[index], first_page=pages[index] if pages else None
+    )
 
 
 # --- ENDPOINTS DE FAVORITOS ---
@@ -1834,11 +4956,17 @@ def track_favorite_activity(request: Request, client_id: str, property_id: str,
 
 
 @app.get("/clients/{client_id}/history", summary="Get Complete Client History")
-def get_client_history(request: Request, client_id: str):
+def get_client_history(
+    request: Request,
+    client_id: str,
+    profile: str = Query("card", description="Fields of each entry's property: pin, card or full")
+):
     tenant_id = getattr(request.state, "tenant_id", None)
     
     if not tenant_id:
         raise HTTPException(status_code=400, detail="Tenant ID not found in request state.")
+    if profile not in GEOJSON_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Invalid profile. Use one of: {', '.join(GEOJSON_PROFILES)}")
     
     try:
         # Verificar que el cliente pertenece al tenant
@@ -1878,6 +5006,18 @@ def get_client_history(request: Request, client_id: str):
         
         # Ordenar por fecha descendente
         history.sort(key=lambda x: x["date"], reverse=True)
+
+        # Propiedades de todas las entradas en una sola resolución (snapshot + un scroll para el resto)
+        property_ids = list(dict.fromkeys(str(entry["property_id"]) for entry in history if entry["property_id"] is not None))
+        properties = {}
+        try:
+            projection = _projection_fields(profile, None)
+            for property_id, payload in zip(property_ids, _get_property_payloads(property_ids)):
+                properties[property_id] = _project_payload(payload, projection) if payload is not None else None
+        except Exception as e:
+            print(f"⚠️ Error hydrating client history properties: {e}")
+        for entry in history:
+            entry["property"] = properties.get(str(entry["property_id"]))
         
         return {
             "client_id": client_id,
@@ -1885,6 +5025,8 @@ def get_client_history(request: Request, client_id: str):
             "history": history,
             "total_activities": len(history)
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error retrieving client history: {e}")
         raise HTTPException(status_code=500, detail="Could not retrieve client history.")
@@ -2388,81 +5530,30 @@ async def list_livekit_rooms(request: Request):
 # IMAGE PROXY ENDPOINTS
 # =====================================================
 
-@app.get("/properties/images/{property_id}/{image_index}")
+# {image_index:int}: si no, esta ruta también captura /properties/images/{id}/all (y responde 422)
+@app.get("/properties/images/{property_id}/{image_index:int}")
 async def serve_property_image(property_id: str, image_index: int, request: Request):
     """Proxy endpoint to serve property images from external sources."""
     try:
         import httpx
-        from urllib.parse import urlencode
-        
-        # Get Supabase client
-        supabase_client = create_client(settings["supabase_url"], settings["supabase_key"])
         
         # Get property data to find the original image URL
-        # First, let's try to get the property from Qdrant
         try:
-            # Search for the property in Qdrant - try different ID field names
-            results = None
-            
-            # Try searching by 'id' field first
-            try:
-                results = qdrant_cli.scroll(
-                    collection_name=settings["collection_name"],
-                    limit=1,
-                    with_payload=True,
-                    with_vectors=False,
-                    scroll_filter=models.Filter(
-                        must=[models.FieldCondition(key="id", match=models.MatchValue(value=property_id))]
-                    )
-                )[0]
-            except:
-                pass
-            
-            # If not found, try searching by 'property_id' field
-            if not results:
-                try:
-                    results = qdrant_cli.scroll(
-                        collection_name=settings["collection_name"],
-                        limit=1,
-                        with_payload=True,
-                        with_vectors=False,
-                        scroll_filter=models.Filter(
-                            must=[models.FieldCondition(key="property_id", match=models.MatchValue(value=property_id))]
-                        )
-                    )[0]
-                except:
-                    pass
-            
-            # If still not found, try searching by 'uuid' field
-            if not results:
-                try:
-                    results = qdrant_cli.scroll(
-                        collection_name=settings["collection_name"],
-                        limit=1,
-                        with_payload=True,
-                        with_vectors=False,
-                        scroll_filter=models.Filter(
-                            must=[models.FieldCondition(key="uuid", match=models.MatchValue(value=property_id))]
-                        )
-                    )[0]
-                except:
-                    pass
-            
-            if not results:
-                raise HTTPException(status_code=404, detail="Property not found.")
-            
-            property_data = results[0].payload
-            images = property_data.get("images", []) or property_data.get("images_array", [])
-            
-            if not images or image_index >= len(images):
-                raise HTTPException(status_code=404, detail="Image not found.")
-            
-            image_url = images[image_index]
-            
+            property_data = await asyncio.to_thread(_get_property_payload, property_id)
         except Exception as e:
-            print(f"Error getting property from Qdrant: {e}")
+            print(f"Error getting property {property_id}: {e}")
+            raise HTTPException(status_code=500, detail="Could not retrieve property.")
+        
+        if not property_data:
             raise HTTPException(status_code=404, detail="Property not found.")
         
+        images = property_data.get("images", []) or property_data.get("images_array", [])
+        
+        if not images or not 0 <= image_index < len(images):
+            raise HTTPException(status_code=404, detail="Image not found.")
+        
+        image_url = images[image_index]
+        
         # Download the image from the external source
         async with httpx.AsyncClient() as client:
             try:
@@ -2507,57 +5598,11 @@ async def serve_property_image(property_id: str, image_index: int, request: Requ
 async def get_property_images_urls(property_id: str, request: Request):
     """Get all image URLs for a property with proxy endpoints."""
     try:
-        # Search for the property in Qdrant - try different ID field names
-        results = None
-        
-        # Try searching by 'id' field first
-        try:
-            results = qdrant_cli.scroll(
-                collection_name=settings["collection_name"],
-                limit=1,
-                with_payload=True,
-                with_vectors=False,
-                scroll_filter=models.Filter(
-                    must=[models.FieldCondition(key="id", match=models.MatchValue(value=property_id))]
-                )
-            )[0]
-        except:
-            pass
-        
-        # If not found, try searching by 'property_id' field
-        if not results:
-            try:
-                results = qdrant_cli.scroll(
-                    collection_name=settings["collection_name"],
-                    limit=1,
-                    with_payload=True,
-                    with_vectors=False,
-                    scroll_filter=models.Filter(
-                        must=[models.FieldCondition(key="property_id", match=models.MatchValue(value=property_id))]
-                    )
-                )[0]
-            except:
-                pass
+        property_data = await asyncio.to_thread(_get_property_payload, property_id)
         
-        # If still not found, try searching by 'uuid' field
-        if not results:
-            try:
-                results = qdrant_cli.scroll(
-                    collection_name=settings["collection_name"],
-                    limit=1,
-                    with_payload=True,
-                    with_vectors=False,
-                    scroll_filter=models.Filter(
-                        must=[models.FieldCondition(key="uuid", match=models.MatchValue(value=property_id))]
-                    )
-                )[0]
-            except:
-                pass
-        
-        if not results:
+        if not property_data:
             raise HTTPException(status_code=404, detail="Property not found.")
         
-        property_data = results[0].payload
         images = property_data.get("images", []) or property_data.get("images_array", [])
         
         # Generate proxy URLs for all images
@@ -2576,6 +5621,8 @@ async def get_property_images_urls(property_id: str, request: Request):
             "total_images": len(images)
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error getting property images: {e}")
         raise HTTPException(status_code=500, detail="Could not get property images.")
@@ -2602,6 +5649,57 @@ async def check_proxy_health():
             "timestamp": datetime.now().isoformat()
         }
 
+def _require_admin_token(request: Request):
+    """Exige el header X-Admin-Token igual a ADMIN_API_TOKEN; sin token configurado el endpoint queda deshabilitado."""
+    expected = settings.get("admin_api_token")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin operations are disabled")
+    provided = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(provided.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.get("/debug/cache-stats")
+async def get_cache_stats(request: Request):
+    """Estadísticas de las caches en memoria del servicio. Requiere X-Admin-Token (incluye datos de tenants)."""
+    _require_admin_token(request)
+    snapshot = property_snapshot.current
+    vector_index = snapshot.peek("vectors") if snapshot is not None else None
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "embedding_providers": {backend: provider.stats() for backend, provider in list(_embedding_providers.items())},
+        "search_result_cache": search_result_cache.stats(),
+        "snapshot": property_snapshot.status(),
+        "neighborhoods": neighborhood_gazetteer.status(),
+        "tenants": tenant_resolver.stats(),
+        "hybrid_search": hybrid_search_stats.stats(),
+        "adaptive_paging": pass_rate_estimator.stats(),
+        "vector_index": vector_index.stats() if vector_index is not None else None,
+        "tiles": tile_cache.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.post("/tenants/cache/invalidate", summary="Invalidate Tenant Cache")
+async def invalidate_tenant_cache(request: Request, subdomain: str = Query(None, description="Only this subdomain; all tenants if omitted")):
+    """Invalida la cache de tenants (por ejemplo, después de dar de alta o cambiar un subdominio).
+
+    Requiere X-Admin-Token. La recarga completa desde Supabase se limita a una cada TENANT_RELOAD_MIN_SECONDS.
+    """
+    _require_admin_token(request)
+    if subdomain:
+        tenant_resolver.invalidate(subdomain)
+        return {"message": "Tenant cache invalidated", "subdomain": subdomain}
+
+    wait_seconds = tenant_resolver.claim_forced_reload()
+    if wait_seconds > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Tenant cache was reloaded recently",
+            headers={"Retry-After": str(math.ceil(wait_seconds))},
+        )
+    if not await asyncio.to_thread(tenant_resolver.force_reload):
+        raise HTTPException(status_code=503, detail="Could not reload tenants")
+    return {"message": "Tenant cache reloaded", "subdomain": None}
+
 @app.get("/debug/image-formats")
 async def check_image_formats():
     """Endpoint temporal para verificar formatos de imagen en la base de datos."""
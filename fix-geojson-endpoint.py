@@ -45,61 +45,38 @@ async def get_properties_geojson(
             print("No tenant filter - returning all properties")
         
         # Query Qdrant for properties in the bounding box
-        # If tenant_id is provided, filter by tenant, otherwise get all
+        # El filtro espacial se resuelve en Qdrant con geo_bounding_box sobre el campo geo
+        # (ver fastapi-service/backfill_geo_payload.py); los puntos sin campo geo todavía
+        # se filtran por latitude/longitude. No hace falta un vector de búsqueda.
+        conditions = [
+            models.Filter(should=[
+                models.FieldCondition(
+                    key=settings.get("geo_field", "geo"),
+                    geo_bounding_box=models.GeoBoundingBox(
+                        top_left=models.GeoPoint(lat=maxy, lon=minx),
+                        bottom_right=models.GeoPoint(lat=miny, lon=maxx)
+                    )
+                ),
+                models.Filter(must=[
+                    models.FieldCondition(key="latitude", range=models.Range(gte=miny, lte=maxy)),
+                    models.FieldCondition(key="longitude", range=models.Range(gte=minx, lte=maxx)),
+                ]),
+            ])
+        ]
         if tenant_id:
             # Filter by tenant_id if provided
-            results = qdrant_cli.search(
-                collection_name=settings["collection_name"],
-                query_vector=[0] * 384,  # Dummy vector for spatial search
-                query_filter=models.Filter(
-                    must=[
-                        models.FieldCondition(
-                            key="tenant_id",
-                            match=models.MatchValue(value=tenant_id)
-                        ),
-                        models.FieldCondition(
-                            key="latitude",
-                            range=models.Range(
-                                gte=miny,
-                                lte=maxy
-                            )
-                        ),
-                        models.FieldCondition(
-                            key="longitude", 
-                            range=models.Range(
-                                gte=minx,
-                                lte=maxx
-                            )
-                        )
-                    ]
-                ),
-                limit=limit
-            )
-        else:
-            # Get all properties in the bounding box (no tenant filter)
-            results = qdrant_cli.search(
-                collection_name=settings["collection_name"],
-                query_vector=[0] * 384,  # Dummy vector for spatial search
-                query_filter=models.Filter(
-                    must=[
-                        models.FieldCondition(
-                            key="latitude",
-                            range=models.Range(
-                                gte=miny,
-                                lte=maxy
-                            )
-                        ),
-                        models.FieldCondition(
-                            key="longitude", 
-                            range=models.Range(
-                                gte=minx,
-                                lte=maxx
-                            )
-                        )
-                    ]
-                ),
-                limit=limit
-            )
+            conditions.append(models.FieldCondition(
+                key="tenant_id",
+                match=models.MatchValue(value=tenant_id)
+            ))
+        
+        results, _ = qdrant_cli.scroll(
+            collection_name=settings["collection_name"],
+            scroll_filter=models.Filter(must=conditions),
+            limit=limit,
+            with_payload=True,
+            with_vectors=False
+        )
         
         print(f"Qdrant returned {len(results)} properties")
         
@@ -107,8 +84,9 @@ async def get_properties_geojson(
         features = []
         for result in results:
             payload = result.payload
-            lat = payload.get('latitude')
-            lng = payload.get('longitude')
+            geo = payload.get(settings.get("geo_field", "geo")) or {}
+            lat = geo.get('lat', payload.get('latitude'))
+            lng = geo.get('lon', payload.get('longitude'))
             
             if lat is None or lng is None:
                 continue
@@ -166,7 +144,7 @@ async def get_properties_geojson(
     print("📝 El endpoint ahora soporta:")
     print("   - Sin tenant_id: Devuelve TODAS las propiedades")
     print("   - Con tenant_id: Filtra por tenant específico")
-    print("   - Filtrado por bounding box (lat/lng)")
+    print("   - Filtrado por bounding box (geo_bounding_box en Qdrant)")
     print("   - Formato GeoJSON para el mapa")
 
 if __name__ == "__main__":